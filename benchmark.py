@@ -0,0 +1,392 @@
+"""
+This is the entry point of the micro-benchmark suite of the crawler's hot
+paths: the parsing helpers, the FlareSolverr middlewares and the item
+pipelines.
+
+Each benchmark runs on the sample page of tests/sample_files and on a large
+synthetic page generated by disboard.simulator, with hundreds of servers
+and tags. The timings are compared with the baselines tracked in
+benchmark_baseline.json, and the script exits with an error when a
+benchmark is slower than its baseline by more than the threshold. The
+memory retained by each scraped item is reported too.
+
+The pipelines run against stand-ins: the local Redis server of REDIS_URL
+for ServersGuildIdPipeline (skipped if it is not available), and a cursor
+that only records the queries for PostgresPipeline.
+"""
+import gc
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import timeit
+import tracemalloc
+import redis
+
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from disboard.commons.constants import DISBOARD_URL
+from disboard.commons.helpers import (
+    count_disboard_server_items,
+    extract_disboard_server_items,
+    request_all_category_urls,
+    request_all_tag_urls,
+    request_next_url,
+)
+from disboard.middlewares import (
+    FlareSolverrGetSolutionStatusMiddleware,
+    FlareSolverrRedirectMiddleware,
+    FlareSolverrRetryMiddleware,
+)
+from disboard.pipelines import PostgresPipeline, ServersGuildIdPipeline
+from disboard.simulator import DisboardSimulator
+from dotenv import load_dotenv, find_dotenv
+from scrapy.http import HtmlResponse, Request, TextResponse
+from scrapy.settings import Settings
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+from typing import Callable, Dict, Optional
+
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+SAMPLE_PATH = os.path.join(
+    os.path.dirname(__file__), "tests", "sample_files", "disboard.org_servers_fl=de.html"
+)
+# A benchmark fails when it is this many times slower than its baseline
+DEFAULT_THRESHOLD = 1.25
+
+SETTINGS = Settings(
+    {
+        "USE_WEB_CACHE": False,
+        "LANGUAGE": "de",
+        "PROXY_URL": "http://localhost:8191/v1",
+        "RETRY_TIMES": 4,
+        "RETRY_HTTP_CODES": [500, 502, 503, 504, 522, 524, 404, 408, 429],
+    }
+)
+
+
+def add_cli_arguments() -> Namespace:
+    """
+    Add command line arguments and return the parser.
+    """
+    parser = ArgumentParser(description="Run the micro-benchmark suite")
+
+    parser.add_argument(
+        "-k",
+        "--filter",
+        help="Only run the benchmarks whose name contains this string",
+        type=str,
+        default="",
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        help="Ratio to the baseline from which a benchmark is a regression",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+    )
+    parser.add_argument(
+        "-u",
+        "--update-baseline",
+        help="Store the timings as the new baselines",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-redis",
+        "--redis-url",
+        help="Redis URL of the stand-in server. Defaults to REDIS_URL",
+        type=str,
+    )
+
+    return parser.parse_args()
+
+
+class SpiderStub:
+    name = "benchmark"
+    url_prefix = ""
+    language = "de"
+    base_url = DISBOARD_URL
+    settings = SETTINGS
+
+
+class CursorStub:
+    """
+    Stand-in for a psycopg cursor that only keeps the last query.
+    """
+
+    def execute(self, sql, data):
+        self.last_query = (sql, data)
+
+    def close(self):
+        pass
+
+
+def load_pages() -> Dict[str, str]:
+    """
+    Returns the HTML of the benchmarked pages: the sample page, and a
+    synthetic page with 300 servers and 10 tags per server.
+    """
+    with open(SAMPLE_PATH, "r") as f:
+        sample = f.read()
+
+    simulator = DisboardSimulator(
+        n_of_pages=2, n_of_tags=1000, servers_per_page=300, tags_per_server=10
+    )
+    _, large = simulator.page(f"{DISBOARD_URL}/servers?fl=de")
+    return {"sample": sample, "large": large}
+
+
+def make_response(html: str) -> HtmlResponse:
+    # A new response for each call, so that the HTML is parsed every time
+    return HtmlResponse(
+        url=f"{DISBOARD_URL}/servers?fl=de",
+        headers={"Date": b"Mon, 10 Jul 2023 21:57:03 GMT"},
+        body=html,
+        encoding="utf-8",
+        request=Request(f"{DISBOARD_URL}/servers?fl=de", meta={"language": "de"}),
+    )
+
+
+def get_benchmarks(redis_url: Optional[str]) -> Dict[str, Callable[[], object]]:
+    """
+    Returns the benchmarks by name.
+    """
+    spider = SpiderStub()
+    benchmarks = {}
+
+    pages = load_pages()
+    for page_name, html in pages.items():
+        benchmarks.update(
+            {
+                f"helpers.count_disboard_server_items[{page_name}]": (
+                    lambda html=html: count_disboard_server_items(make_response(html))
+                ),
+                f"helpers.extract_disboard_server_items[{page_name}]": (
+                    lambda html=html: list(
+                        extract_disboard_server_items(make_response(html))
+                    )
+                ),
+                f"helpers.request_next_url[{page_name}]": (
+                    lambda html=html: list(request_next_url(spider, make_response(html)))
+                ),
+                f"helpers.request_all_category_urls[{page_name}]": (
+                    lambda html=html: list(
+                        request_all_category_urls(spider, make_response(html))
+                    )
+                ),
+                f"helpers.request_all_tag_urls[{page_name}]": (
+                    lambda html=html: list(
+                        request_all_tag_urls(spider, make_response(html))
+                    )
+                ),
+            }
+        )
+
+        proxy_request = Request(
+            SETTINGS["PROXY_URL"],
+            method="POST",
+            meta={
+                "original_request": Request(f"{DISBOARD_URL}/servers?fl=de"),
+                "redirected_to_flare_solverr": True,
+            },
+        )
+        solution = json.dumps(
+            {
+                "status": "ok",
+                "solution": {
+                    "url": f"{DISBOARD_URL}/servers?fl=de",
+                    "status": 200,
+                    "response": html,
+                },
+            }
+        )
+        proxy_response = TextResponse(
+            url=SETTINGS["PROXY_URL"], body=solution, encoding="utf-8"
+        )
+        status_middleware = FlareSolverrGetSolutionStatusMiddleware(SETTINGS)
+        redirect_middleware = FlareSolverrRedirectMiddleware(SETTINGS)
+        retry_middleware = FlareSolverrRetryMiddleware(SETTINGS)
+        benchmarks.update(
+            {
+                f"middlewares.FlareSolverrGetSolutionStatusMiddleware[{page_name}]": (
+                    lambda html=html: status_middleware.process_response(
+                        None, make_response(html), spider
+                    )
+                ),
+                f"middlewares.FlareSolverrRedirectMiddleware[{page_name}]": (
+                    lambda response=proxy_response: redirect_middleware.process_response(
+                        proxy_request, response, spider
+                    )
+                ),
+                f"middlewares.FlareSolverrRetryMiddleware[{page_name}]": (
+                    lambda response=make_response(html).replace(status=429): (
+                        retry_middleware.process_response(proxy_request, response, spider)
+                    )
+                ),
+            }
+        )
+
+    items = list(extract_disboard_server_items(make_response(pages["large"])))
+    stats = StatsCollector(get_crawler())
+
+    postgres_pipeline = PostgresPipeline(db_url=None)
+    postgres_pipeline.cursor = CursorStub()
+    benchmarks["pipelines.PostgresPipeline[large]"] = lambda: [
+        postgres_pipeline.process_item(item, spider) for item in items
+    ]
+
+    if redis_url and is_redis_available(redis_url):
+        guild_id_pipeline = ServersGuildIdPipeline(spider.name, redis_url, stats)
+        guild_id_pipeline.open_spider(spider)
+
+        def process_page_items():
+            # Start from an empty set, so that every guild is a new one
+            guild_id_pipeline.client.delete(guild_id_pipeline.key_name)
+            for item in items:
+                guild_id_pipeline.process_item(item, spider)
+
+        def process_page_batch():
+            # Like ItemBatchMiddleware: the page's items are batched first
+            guild_id_pipeline.client.delete(guild_id_pipeline.key_name)
+            guild_id_pipeline.process_items(items, spider)
+            for item in items:
+                guild_id_pipeline.process_item(item, spider)
+
+        benchmarks["pipelines.ServersGuildIdPipeline[large]"] = process_page_items
+        benchmarks["pipelines.ServersGuildIdPipeline[large, batched]"] = (
+            process_page_batch
+        )
+    else:
+        print(f"[{datetime.now()}] Redis is not available, skipping the Redis benchmarks")
+
+    return benchmarks
+
+
+def measure_bytes_per_item(html: str, n_of_pages: int = 20) -> float:
+    """
+    Returns the memory retained by each item extracted from the page, in
+    bytes, once the responses are released.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        items = []
+        for _ in range(n_of_pages):
+            items.extend(extract_disboard_server_items(make_response(html)))
+        gc.collect()
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return (after - before) / max(len(items), 1)
+
+
+def is_redis_available(redis_url: str) -> bool:
+    try:
+        client = redis.Redis.from_url(redis_url)
+        client.ping()
+        client.close()
+        return True
+    except redis.RedisError:
+        return False
+
+
+def run_benchmark(function: Callable[[], object], repeat: int = 5) -> float:
+    """
+    Returns the median time of a call to the function, in seconds.
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    timings = timer.repeat(repeat=repeat, number=number)
+    return statistics.median(timings) / number
+
+
+def compare(
+    timings: Dict[str, float], baselines: Dict[str, dict]
+) -> Dict[str, Optional[float]]:
+    """
+    Returns the ratio of each timing to its baseline, or None for the
+    benchmarks without a baseline.
+    """
+    ratios = {}
+    for name, timing in timings.items():
+        baseline = baselines.get(name)
+        ratios[name] = timing / baseline["seconds"] if baseline else None
+    return ratios
+
+
+def find_regressions(
+    ratios: Dict[str, Optional[float]], baselines: Dict[str, dict], threshold: float
+) -> Dict[str, float]:
+    """
+    Returns the ratio of the benchmarks that are slower than their threshold.
+    A baseline may override the threshold with its own "threshold" key.
+    """
+    return {
+        name: ratio
+        for name, ratio in ratios.items()
+        if ratio is not None and ratio > baselines[name].get("threshold", threshold)
+    }
+
+
+def load_baselines() -> Dict[str, dict]:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, "r") as f:
+        return json.load(f)["benchmarks"]
+
+
+def save_baselines(timings: Dict[str, float], baselines: Dict[str, dict]) -> None:
+    for name, timing in timings.items():
+        baselines.setdefault(name, {})["seconds"] = timing
+    with open(BASELINE_PATH, "w") as f:
+        json.dump(
+            {
+                "machine": f"{platform.machine()} {platform.processor()}".strip(),
+                "python": platform.python_version(),
+                "benchmarks": dict(sorted(baselines.items())),
+            },
+            f,
+            indent=2,
+        )
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_dotenv(find_dotenv())
+
+    args = add_cli_arguments()
+    # Don't time the logging of the warnings, e.g. of the retried requests
+    logging.disable(logging.WARNING)
+    benchmarks = get_benchmarks(args.redis_url or os.getenv("REDIS_URL"))
+
+    timings = {}
+    for name, function in benchmarks.items():
+        if args.filter in name:
+            timings[name] = run_benchmark(function)
+
+    baselines = load_baselines()
+    ratios = compare(timings, baselines)
+    for name, timing in timings.items():
+        ratio = ratios[name]
+        versus = f"{ratio:.2f}x baseline" if ratio is not None else "no baseline"
+        print(f"{name:<75} {timing * 1e6:>12.1f} us  {versus}")
+
+    for page_name, html in load_pages().items():
+        name = f"items.DisboardServerItem[{page_name}]"
+        print(f"{name:<75} {measure_bytes_per_item(html):>12.1f} B/item")
+
+    if args.update_baseline:
+        save_baselines(timings, baselines)
+        print(f"[{datetime.now()}] Saved the baselines to {BASELINE_PATH}")
+        sys.exit(0)
+
+    regressions = find_regressions(ratios, baselines, args.threshold)
+    for name, ratio in regressions.items():
+        print(f"[{datetime.now()}] Regression: {name} is {ratio:.2f}x its baseline")
+    sys.exit(1 if regressions else 0)
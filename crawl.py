@@ -10,19 +10,41 @@ from the command line and override the default settings.
 The default settings are stored in an .env file. The user can override
 the default settings by passing command line arguments.
 """
-import multiprocessing
 import os
 import sys
 import redis
-import time
 
 from datetime import datetime
 from argparse import ArgumentParser, Namespace
-from disboard.commons.constants import DISBOARD_URL, WEBCACHE_URL
+from disboard.commons.constants import (
+    AVAILABLE_LANGUAGES,
+    DISBOARD_URL,
+    WEBCACHE_URL,
+)
 from dotenv import load_dotenv, find_dotenv
-from scrapy.crawler import CrawlerProcess
+from scrapy.crawler import Crawler
+from scrapy.utils.misc import load_object
 from scrapy.utils.project import get_project_settings
+from disboard.cluster import ClusterNode
+from disboard.dupefilters import RecrawlDupeFilter
+from disboard.extensions import (
+    EFFICIENCY_LISTING_KEY,
+    EFFICIENCY_ORIGIN_KEY,
+    read_efficiency,
+)
+from disboard.metrics import read_cluster_histograms, summarize
+from disboard.queues import pending_requests
+from disboard.registry import load_frontier, read_registry, seed_requests
 from disboard.spiders.servers import ServersSpider
+from disboard.workers import (
+    DRAIN,
+    PROFILE,
+    STATUS_KEY,
+    STOP,
+    Supervisor,
+    WorkerPool,
+    send_command,
+)
 
 
 def add_cli_arguments() -> Namespace:
@@ -44,7 +66,9 @@ def add_cli_arguments() -> Namespace:
     parser.add_argument(
         "-l",
         "--language",
-        help="The language to filter all requests by",
+        help="The language to filter all requests by. \
+            Use a comma-separated list of languages, or 'all', to crawl \
+            several languages in the same job",
         type=str,
         required=True,
     )
@@ -96,12 +120,129 @@ def add_cli_arguments() -> Namespace:
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "-seed",
+        "--seed-frontier",
+        help="Push the category and tag pages of the registry, for each \
+            language, to the requests queue. With --restart-job, the frontier \
+            is seeded right after the restart, otherwise the script exits",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-rc",
+        "--recrawl",
+        help="Revisit the crawled listings on an adaptive interval instead of \
+            exiting once the requests queue is empty",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-cache",
+        "--use-cache",
+        help="Cache the pages solved by FlareSolverr on the local disk",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-replay",
+        "--replay",
+        help="Serve the whole crawl from the local cache of FlareSolverr \
+            pages, without using the proxies",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-archive",
+        "--archive",
+        help="Write every listing page to the raw page archive, \
+            so that it can be parsed again with reparse.py",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-metrics",
+        "--metrics",
+        help="Record the latency of the stages of the crawl, and serve it on \
+            a Prometheus endpoint in every worker",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-hedge",
+        "--hedge",
+        help="Send the slow FlareSolverr requests to a second healthy proxy \
+            of the cluster",
+        action="store_true",
+        default=False,
+    )
     parser.add_argument(
         "-url",
         "--start-url",
         help="The URL to start scraping from",
         type=str,
     )
+    parser.add_argument(
+        "-min",
+        "--min-workers",
+        help="The minimum number of workers to keep running",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-max",
+        "--max-workers",
+        help="The maximum number of workers to run. \
+            Defaults to the number of proxies in proxies.txt",
+        type=int,
+    )
+    parser.add_argument(
+        "-rpw",
+        "--requests-per-worker",
+        help="The number of queued requests that justify running one more worker",
+        type=int,
+        default=500,
+    )
+    parser.add_argument(
+        "-node",
+        "--node-id",
+        help="The name of this node in the cluster. Defaults to the hostname",
+        type=str,
+    )
+    parser.add_argument(
+        "-cmd",
+        "--cluster-command",
+        help="Send a command to every node running the spider and exit. \
+            'stop' stops all workers, 'drain' lets the running workers finish \
+            without starting new ones, and 'clear' removes the last command",
+        choices=[STOP, DRAIN, "clear"],
+    )
+    parser.add_argument(
+        "-stats",
+        "--cluster-stats",
+        help="Print the live nodes, the aggregated crawl stats and the latency \
+            of each stage of the crawl, and exit",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "-eff",
+        "--efficiency-report",
+        help="Print the solves, blocks and new guilds of each kind of link, and \
+            of the N listings with the fewest new guilds per solve, and exit",
+        type=int,
+        nargs="?",
+        const=20,
+        metavar="N",
+    )
+    parser.add_argument(
+        "-profile",
+        "--profile-worker",
+        help="Ask a worker, or 'all' the workers, to write a profile of its \
+            CPU time and memory allocations, and exit",
+        type=str,
+        metavar="WORKER_ID",
+    )
     parser.add_argument(
         "-proxy",
         "--proxy-url",
@@ -112,17 +253,34 @@ def add_cli_arguments() -> Namespace:
     return parser.parse_args()
 
 
+def get_languages(language: str) -> list:
+    """
+    Returns the list of languages given in the --language argument.
+    """
+    if language == "all":
+        return AVAILABLE_LANGUAGES
+
+    return [language.strip() for language in language.split(",")]
+
+
 def setup_environment(args: Namespace) -> None:
     """
     Setup environment variables based on command line arguments.
     """
     os.environ["SPIDER_NAME"] = args.spider_name
-    os.environ["LANGUAGE"] = args.language
+    languages = get_languages(args.language)
+    os.environ["LANGUAGE"] = languages[0]
+    if len(languages) > 1:
+        os.environ["LANGUAGES"] = ",".join(languages)
 
     os.environ["USE_WEB_CACHE"] = str(args.use_web_cache)
     os.environ["FOLLOW_PAGINATION_LINKS"] = str(not args.dont_follow_pagination_links)
     os.environ["FOLLOW_CATEGORY_LINKS"] = str(not args.dont_follow_category_links)
     os.environ["FOLLOW_TAG_LINKS"] = str(not args.dont_follow_tag_links)
+    os.environ["MIN_WORKERS"] = str(args.min_workers)
+    os.environ["REQUESTS_PER_WORKER"] = str(args.requests_per_worker)
+    if args.max_workers:
+        os.environ["MAX_WORKERS"] = str(args.max_workers)
     if args.proxy_url:
         os.environ["PROXY_URL"] = args.proxy_url
     if args.redis_url:
@@ -131,43 +289,83 @@ def setup_environment(args: Namespace) -> None:
         os.environ["DB_URL"] = args.db_url
     if args.restart_job:
         os.environ["RESTART_JOB"] = str(args.restart_job)
+    if args.seed_frontier:
+        os.environ["SEED_FRONTIER"] = str(args.seed_frontier)
+    if args.node_id:
+        os.environ["NODE_ID"] = args.node_id
+    os.environ["RECRAWL_ENABLED"] = str(args.recrawl)
+    os.environ["FLARESOLVERR_CACHE_ENABLED"] = str(args.use_cache)
+    os.environ["FLARESOLVERR_CACHE_REPLAY"] = str(args.replay)
+    os.environ["PAGE_ARCHIVE_ENABLED"] = str(args.archive)
+    os.environ["METRICS_ENABLED"] = str(args.metrics)
+    os.environ["HEDGE_ENABLED"] = str(args.hedge)
 
 
 def get_start_urls() -> list:
     """
     This function returns a list of start_urls based on the
-    selected language.
+    selected languages.
     """
     prefix = WEBCACHE_URL if os.getenv("USE_WEB_CACHE") == "True" else ""
 
-    language = os.environ["LANGUAGE"]
+    languages = os.getenv("LANGUAGES", os.environ["LANGUAGE"]).split(",")
     base_url = DISBOARD_URL
 
-    by_language = f"{prefix}{base_url}/servers?fl={language}"
-    by_language_and_members = (
-        f"{prefix}{base_url}/servers?fl={language}&sort=member_count"
-    )
-    return [
-        by_language,
-        by_language_and_members,
-    ]
+    start_urls = []
+    for language in languages:
+        by_language = f"{prefix}{base_url}/servers?fl={language}"
+        by_language_and_members = (
+            f"{prefix}{base_url}/servers?fl={language}&sort=member_count"
+        )
+        start_urls += [by_language, by_language_and_members]
+    return start_urls
 
 
 def restart_job() -> None:
     """
     This function restarts the crawler job. It deletes the
     associated Redis keys {spider_name}:dupefilter, {spider_name}:requests,
-    and sets the {spider_name}::start_urls to the necessary start_urls.
+    the language sub-queues in {spider_name}:requests:*, the cold tier and the
+    staged requests of the frontier in {spider_name}:frontier:*, the leased requests
+    in {spider_name}:processing:*, the tag sketches in
+    {spider_name}:tag_sketch:*, the latency histograms in
+    {spider_name}:metrics, the crawl efficiency counters in
+    {spider_name}:efficiency:*, the end of the execution window in
+    {spider_name}:window, and sets the {spider_name}::start_urls
+    to the necessary start_urls.
+
+    The revisit schedule in {spider_name}:freshness and {spider_name}:revisit
+    is kept, see disboard.extensions.RecrawlScheduler, and so is the negative
+    cache in {spider_name}:negative, see disboard.extensions.NegativeCache.
+    The change stream in {spider_name}:changes and its digests are kept too,
+    see disboard.changes, and so is the registry of categories and tags in
+    {spider_name}:registry:*, see disboard.registry.
     """
     redis_url = os.environ["REDIS_URL"]
     spider_name = os.environ["SPIDER_NAME"]
     start_urls = get_start_urls()
 
     client = redis.Redis.from_url(redis_url)
+    queue_keys = list(client.scan_iter(f"{spider_name}:processing:*"))
+    queue_keys += list(client.scan_iter(f"{spider_name}:requests:*"))
+    queue_keys += list(client.scan_iter(f"{spider_name}:tag_sketch:*"))
+    queue_keys += list(client.scan_iter(f"{spider_name}:frontier:*"))
     with client.pipeline() as pipe:
         pipe.delete(f"{spider_name}:dupefilter")
         pipe.delete(f"{spider_name}:requests")
         pipe.delete(f"{spider_name}:guild_id")
+        pipe.delete(f"{spider_name}:leases")
+        pipe.delete(f"{spider_name}:languages:pass")
+        pipe.delete(f"{spider_name}:languages:served")
+        pipe.delete(f"{spider_name}:languages:vtime")
+        pipe.delete(f"{spider_name}:stats:closed")
+        pipe.delete(f"{spider_name}:cluster_command")
+        pipe.delete(f"{spider_name}:metrics")
+        pipe.delete(f"{spider_name}:efficiency:origin")
+        pipe.delete(f"{spider_name}:efficiency:listing")
+        pipe.delete(f"{spider_name}:window")
+        for key in queue_keys:
+            pipe.delete(key)
         for url in start_urls:
             pipe.lpush(f"{spider_name}:start_urls", url)
         pipe.execute()
@@ -175,99 +373,274 @@ def restart_job() -> None:
     client.close()
 
 
+def seed_frontier() -> int:
+    """
+    Pushes the category and tag pages of the registry, for each language of
+    the job and each postfix of get_url_postfixes, to the requests queue in
+    one pipelined bulk load. The pages in the {spider_name}:dupefilter or
+    in the negative cache are skipped. Returns the number of requests pushed.
+    """
+    spider_name = os.environ["SPIDER_NAME"]
+
+    class NamedSpider(ServersSpider):
+        name = spider_name
+
+    crawler = Crawler(NamedSpider, get_project_settings())
+    spider = crawler._create_spider()
+    settings = crawler.settings
+    keys = {"spider": spider_name}
+
+    client = redis.Redis.from_url(os.environ["REDIS_URL"])
+    serializer = settings.get("SCHEDULER_SERIALIZER") or "scrapy_redis.picklecompat"
+    queue = load_object(settings["SCHEDULER_QUEUE_CLASS"])(
+        server=client,
+        spider=spider,
+        key=settings.get("SCHEDULER_QUEUE_KEY", "%(spider)s:requests") % keys,
+        serializer=load_object(serializer),
+        worker_id="seed",
+    )
+    languages = settings.getlist("LANGUAGES") or [settings.get("LANGUAGE")]
+    categories, tags = read_registry(client, spider_name)
+    requests = seed_requests(spider, languages, categories, tags.values())
+    dupefilter_key = settings.get("SCHEDULER_DUPEFILTER_KEY", "%(spider)s:dupefilter")
+    pushed = load_frontier(
+        client,
+        queue,
+        dupefilter_key=dupefilter_key % keys,
+        negative_key=RecrawlDupeFilter.negative_key % keys,
+        requests=requests,
+    )
+    client.close()
+
+    print(
+        f"[{datetime.now()}] Seeded {pushed} of {len(requests)} requests from "
+        f"{len(categories)} categories and {len(tags)} tags"
+    )
+    return pushed
+
+
 def is_requests_queue_empty() -> bool:
     """
     This function checks if the requests queue is empty.
+
+    Requests still leased in {spider_name}:processing:* count as pending,
+    since they will be put back into the queue when their lease expires,
+    and so do the requests spilled to the cold tier of the frontier. The
+    sub-queues of the languages that reached their LANGUAGE_QUOTAS are never
+    popped again, so they don't count. See disboard.queues.pending_requests.
     """
     redis_url = os.environ["REDIS_URL"]
     spider_name = os.environ["SPIDER_NAME"]
+    quotas = get_project_settings().getdict("LANGUAGE_QUOTAS")
 
     client = redis.Redis.from_url(redis_url)
-    requests_queue_length = client.zcard(f"{spider_name}:requests")
+    requests_queue_length = pending_requests(client, spider_name, quotas, leased=True)
 
     client.close()
     return requests_queue_length == 0
 
 
-def run_spider_with_proxy(proxy_url: str) -> None:
+def read_proxy_urls() -> list:
     """
-    Runs a single spider with the given proxy url.
+    Reads the URLs of the FlareSolverr proxy servers from proxies.txt.
     """
-    os.environ["PROXY_URL"] = proxy_url
+    with open("proxies.txt", "r") as f:
+        return [line.strip() for line in f if line.strip()]
 
-    class NamedSpider(ServersSpider):
-        name = os.environ["SPIDER_NAME"]
 
-    process = CrawlerProcess(get_project_settings())
-    process.crawl(NamedSpider)
-    process.start()
+def get_cluster_node() -> ClusterNode:
+    """
+    Returns this process' node in the cluster of the spider.
+    """
+    return ClusterNode(
+        redis_url=os.environ["REDIS_URL"],
+        spider_name=os.environ["SPIDER_NAME"],
+        node_id=os.getenv("NODE_ID"),
+    )
 
 
-def run_spiders() -> list:
+def send_cluster_command(command: str) -> None:
     """
-    Run multiple spiders in parallel using different proxies.
+    Sends the command to every node running the spider.
     """
-    processes = []
+    node = get_cluster_node()
+    node.send_command(None if command == "clear" else command)
+    node.close()
+    print(f"[{datetime.now()}] Sent '{command}' to the cluster")
 
-    try:
-        with open("proxies.txt", "r") as f:
-            proxy_urls = [line.strip() for line in f]
 
-        for i, proxy_url in enumerate(proxy_urls):
-            process = multiprocessing.Process(
-                target=run_spider_with_proxy, args=(proxy_url,)
-            )
-            process.start()
-            processes.append(process)
-            if i == 0:
-                wait_time = 40
-                print(
-                    f"[{datetime.now()}] Waiting {wait_time} seconds for the first spider..."
-                )
-                time.sleep(wait_time)
-
-        return processes
-    except KeyboardInterrupt:
-        for process in processes:
-            process.terminate()
-        sys.exit(0)
+def print_cluster_stats() -> None:
+    """
+    Prints the live nodes, the crawl stats aggregated over all of them, and
+    the latency of the stages of the crawl, see disboard.metrics.
+    """
+    node = get_cluster_node()
+    print(f"[{datetime.now()}] Live nodes: {', '.join(node.nodes())}")
+    print(f"[{datetime.now()}] Cluster command: {node.command()}")
+    for key, value in sorted(node.stats().items()):
+        print(f"[{datetime.now()}] {key}: {value}")
+
+    spider_name = os.environ["SPIDER_NAME"]
+    served = node.client.hgetall(f"{spider_name}:languages:served")
+    for language, count in sorted(served.items()):
+        language = language.decode()
+        queued = node.client.zcard(f"{spider_name}:requests:{language}")
+        print(
+            f"[{datetime.now()}] language {language}: "
+            f"{int(count)} served, {queued} queued"
+        )
+
+    histograms = read_cluster_histograms(node.client, spider_name)
+    for stage, histogram in sorted(histograms.items()):
+        count, mean, p50, p90, p99 = summarize(histogram)
+        print(
+            f"[{datetime.now()}] latency {stage}: {count} calls, "
+            f"mean {mean * 1000:.1f} ms, p50 {p50 * 1000:.1f} ms, "
+            f"p90 {p90 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms"
+        )
+    node.close()
+
+
+def send_profile_command(worker_id: str) -> None:
+    """
+    Asks the worker, or all the running workers of the spider if worker_id
+    is "all", to write a profile, see disboard.extensions.Profiler.
+    """
+    spider_name = os.environ["SPIDER_NAME"]
+    client = redis.Redis.from_url(os.environ["REDIS_URL"])
+    if worker_id == "all":
+        worker_ids = [
+            worker.decode()
+            for worker in client.hkeys(STATUS_KEY % {"spider": spider_name})
+        ]
+    else:
+        worker_ids = [worker_id]
+
+    for worker in worker_ids:
+        send_command(client, spider_name, worker, PROFILE)
+        print(f"[{datetime.now()}] Asked worker {worker} for a profile")
+    client.close()
+
+
+def format_efficiency(name: str, counters: dict) -> str:
+    solves = counters.get("solves", 0)
+    new_guilds = counters.get("new_guilds", 0)
+    block_rate = counters.get("blocked", 0) / solves if solves else 0
+    yield_per_solve = new_guilds / solves if solves else 0
+    return (
+        f"{name}: {int(solves)} solves ({counters.get('solve_time', 0):.0f} s), "
+        f"{int(counters.get('pages', 0))} pages, {block_rate:.1%} blocked, "
+        f"{int(new_guilds)} new guilds, {yield_per_solve:.2f} new guilds per solve"
+    )
+
+
+def print_efficiency_report(n_of_listings: int) -> None:
+    """
+    Prints the solves, blocks and new guilds of each origin of the requests
+    (seed, registry, pagination, category, tag, retry and recrawl), and of the
+    listings with the fewest new guilds per solve, see
+    disboard.extensions.CrawlEfficiency.
+    """
+    spider_name = os.environ["SPIDER_NAME"]
+    keys = {"spider": spider_name}
+    client = redis.Redis.from_url(os.environ["REDIS_URL"])
+
+    origins = read_efficiency(client, EFFICIENCY_ORIGIN_KEY % keys)
+    for origin, counters in sorted(origins.items()):
+        print(f"[{datetime.now()}] origin {format_efficiency(origin, counters)}")
+
+    listings = read_efficiency(client, EFFICIENCY_LISTING_KEY % keys)
+    worst = sorted(
+        (item for item in listings.items() if item[1].get("solves")),
+        key=lambda item: item[1].get("new_guilds", 0) / item[1]["solves"],
+    )
+    for listing, counters in worst[:n_of_listings]:
+        print(f"[{datetime.now()}] listing {format_efficiency(listing, counters)}")
+
+    client.close()
+
+
+def shutdown(pool: WorkerPool, node: ClusterNode) -> None:
+    pool.close(float(os.getenv("WORKER_STOP_TIMEOUT", 60)))
+    node.leave()
+    node.close()
+    sys.exit(0)
 
 
 def run_scheduled_spiders(execution_time: float, wait_time: float) -> None:
     """
     This function will run the spiders during the execution_time (in seconds),
-    wait for wait_time (in seconds), and then repeat the process.
+    pause them for wait_time (in seconds), and then repeat the process.
+
+    The node registers the proxies in proxies.txt in the cluster's pool, and
+    runs workers on the share of the pool that is assigned to it.
+
+    The worker processes are started one after another as soon as the
+    previous one is ready, and are kept alive between execution windows.
+    During each window, a Supervisor restarts crashed workers and scales
+    the number of workers with the size of the requests queue.
+    The end of each window is published to the workers, which stop starting
+    requests that can't be solved before it, see
+    disboard.scheduler.LeasingScheduler.
 
     If the environment variable RESTART_JOB is set to True, the job will be
-    restarted before running the spiders.
+    restarted before running the spiders, and its frontier seeded from the
+    registry if SEED_FRONTIER is set to True too.
     """
+    node = get_cluster_node()
+    node.register(read_proxy_urls())
+    pool = WorkerPool(
+        redis_url=os.environ["REDIS_URL"],
+        spider_name=os.environ["SPIDER_NAME"],
+        proxy_urls=node.claim_proxies(),
+        ready_timeout=float(os.getenv("WORKER_READY_TIMEOUT", 120)),
+    )
+    supervisor = Supervisor(
+        pool,
+        min_workers=int(os.getenv("MIN_WORKERS", 1)),
+        max_workers=int(os.getenv("MAX_WORKERS", 0)) or None,
+        requests_per_worker=int(os.getenv("REQUESTS_PER_WORKER", 500)),
+        check_proxies=os.getenv("FLARESOLVERR_CACHE_REPLAY") != "True",
+        node=node,
+        quotas=get_project_settings().getdict("LANGUAGE_QUOTAS"),
+    )
+    print(f"[{datetime.now()}] Node {node.node_id} joined the cluster")
+
     try:
         if os.getenv("RESTART_JOB") == "True":
             print(f"[{datetime.now()}] Restarting job...")
             restart_job()
             os.environ["RESTART_JOB"] = "False"
+            if os.getenv("SEED_FRONTIER") == "True":
+                seed_frontier()
 
         while True:
-            processes = run_spiders()
-            print(f"[{datetime.now()}] Running {len(processes)} spiders...")
+            print(f"[{datetime.now()}] Resuming spiders...")
+            pool.resume(execution_time)
 
-            print(f"[{datetime.now()}] Waiting {execution_time} seconds...")
-            time.sleep(execution_time)
+            print(f"[{datetime.now()}] Supervising spiders for {execution_time} seconds...")
+            supervisor.run(execution_time)
 
-            print(f"[{datetime.now()}] Terminating spiders...")
-            for process in processes:
-                process.terminate()
+            if supervisor.finished():
+                print(f"[{datetime.now()}] Cluster asked to {node.command()}. Exiting...")
+                shutdown(pool, node)
+
+            print(f"[{datetime.now()}] Pausing spiders...")
+            pool.pause()
 
             if is_requests_queue_empty():
-                print(f"[{datetime.now()}] Requests queue is empty. Exiting...")
-                sys.exit(0)
+                if os.getenv("RECRAWL_ENABLED") == "True":
+                    print(f"[{datetime.now()}] Requests queue is empty. Waiting for revisits...")
+                else:
+                    print(f"[{datetime.now()}] Requests queue is empty. Exiting...")
+                    shutdown(pool, node)
 
             print(
                 f"[{datetime.now()}] Spider execution finished. Waiting {wait_time} seconds..."
             )
-            time.sleep(wait_time)
+            node.sleep(wait_time)
     except KeyboardInterrupt:
-        sys.exit(0)
+        shutdown(pool, node)
 
 
 if __name__ == "__main__":
@@ -280,6 +653,26 @@ if __name__ == "__main__":
     setup_environment(args)
     print(f"[{datetime.now()}] Parsed command line arguments")
 
+    if args.cluster_command:
+        send_cluster_command(args.cluster_command)
+        sys.exit(0)
+
+    if args.cluster_stats:
+        print_cluster_stats()
+        sys.exit(0)
+
+    if args.profile_worker:
+        send_profile_command(args.profile_worker)
+        sys.exit(0)
+
+    if args.efficiency_report is not None:
+        print_efficiency_report(args.efficiency_report)
+        sys.exit(0)
+
+    if args.seed_frontier and not args.restart_job:
+        seed_frontier()
+        sys.exit(0)
+
     # Start the crawling processes
     print(f"[{datetime.now()}] Starting crawling processes...")
     run_scheduled_spiders(60 * 60 * 1.5, 60 * 15)
@@ -0,0 +1,155 @@
+"""
+This module contains the raw page archive, where the spiders keep every
+listing page they fetch so that it can be parsed again later on, see
+reparse.py.
+
+The archive is a directory of append-only segments. Each segment is a
+sequence of independent zstd frames, one per page, holding a JSON object
+with the url, status, Date header, language and body of the page. Next to
+each segment, an index file has one line per page with the offset and the
+length of its frame in the segment, followed by its url, so that pages can
+be read from a memory-mapped segment without decompressing the others.
+
+Each writer appends to its own segments, so several workers can share the
+same archive directory.
+"""
+
+import json
+import mmap
+import os
+import re
+import time
+import zstandard
+
+from scrapy.http import HtmlResponse, Request
+from typing import Iterator, List, Optional, Tuple
+
+
+SEGMENT_SUFFIX = ".zst"
+INDEX_SUFFIX = ".idx"
+
+# (offset, length) of a page in its segment
+IndexEntry = Tuple[int, int]
+
+
+class PageArchiveWriter:
+    """
+    Appends pages to the segments of a writer in the archive directory.
+
+    A new segment is started once the current one is larger than
+    segment_size bytes.
+    """
+
+    def __init__(
+        self, directory: str, writer_id: str, segment_size: int = 256 * 1024**2
+    ):
+        self.directory = directory
+        # Keep the writer id usable as a file name
+        self.writer_id = re.sub(r"[^\w.-]", "_", writer_id)
+        self.segment_size = segment_size
+        self.compressor = zstandard.ZstdCompressor(level=3)
+        self.segment = None
+        self.index = None
+        self.n_of_segments = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self) -> None:
+        self.close()
+        prefix = f"segment-{self.writer_id}-{int(time.time())}-{self.n_of_segments:05d}"
+        self.n_of_segments += 1
+        path = os.path.join(self.directory, prefix)
+        self.segment = open(f"{path}{SEGMENT_SUFFIX}", "ab")
+        self.index = open(f"{path}{INDEX_SUFFIX}", "a")
+
+    def write(self, page: dict) -> None:
+        """
+        Appends a page to the current segment and to its index.
+        """
+        if self.segment is None or self.segment.tell() >= self.segment_size:
+            self._open_segment()
+
+        frame = self.compressor.compress(json.dumps(page).encode("utf-8"))
+        offset = self.segment.tell()
+        self.segment.write(frame)
+        self.segment.flush()
+        # The index is written after the frame, so that readers never find
+        # an index line whose frame is not complete yet
+        self.index.write(f"{offset}\t{len(frame)}\t{page['url']}\n")
+        self.index.flush()
+
+    def close(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+
+def page_from_response(response, language: Optional[str] = None) -> dict:
+    """
+    Returns the archived form of a response.
+    """
+    date = response.headers.get("Date")
+    return {
+        "url": response.url,
+        "status": response.status,
+        "date": date.decode() if date else None,
+        "language": language,
+        "time": time.time(),
+        "body": response.text,
+    }
+
+
+def response_from_page(page: dict) -> HtmlResponse:
+    """
+    Returns the response of an archived page, as the spider received it.
+    """
+    headers = {"Date": page["date"]} if page.get("date") else {}
+    request = Request(page["url"], meta={"language": page.get("language")})
+    return HtmlResponse(
+        url=page["url"],
+        status=page["status"],
+        headers=headers,
+        body=page["body"],
+        encoding="utf-8",
+        request=request,
+    )
+
+
+def list_segments(directory: str) -> List[str]:
+    """
+    Returns the paths of the segments of the archive, oldest first.
+    """
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def read_index(segment_path: str) -> List[IndexEntry]:
+    """
+    Returns the (offset, length) of every page of the segment.
+    """
+    index_path = segment_path[: -len(SEGMENT_SUFFIX)] + INDEX_SUFFIX
+    entries = []
+    with open(index_path, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t", 2)
+            # Skip a line that is still being written
+            if len(fields) == 3:
+                entries.append((int(fields[0]), int(fields[1])))
+    return entries
+
+
+def read_pages(segment_path: str, entries: List[IndexEntry]) -> Iterator[dict]:
+    """
+    Yields the pages of the segment at the given index entries, reading the
+    segment through a memory map.
+    """
+    decompressor = zstandard.ZstdDecompressor()
+    with open(segment_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as segment:
+            for offset, length in entries:
+                frame = segment[offset : offset + length]
+                yield json.loads(decompressor.decompress(frame))
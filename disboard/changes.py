@@ -0,0 +1,158 @@
+"""
+This module contains the change-data-capture stream of the crawl.
+
+disboard.pipelines.GuildChangeStreamPipeline publishes a compact event to
+the {spider}:changes Redis Stream for each guild that is new or whose
+listing changed, instead of letting the downstream consumers poll
+public.disboard_servers by scrape_time. Each event has the fields:
+- guild_id: the Discord guild ID of the server;
+- kind: "new" or "changed";
+- scrape_time: the scrape_time of the stored row.
+
+The digest of the last published version of each guild is kept in the
+{spider}:changes:digests hash, which is not deleted by restart_job, so that
+a new job only publishes what changed since the previous ones. The stream
+is trimmed to about CHANGE_STREAM_MAXLEN events.
+
+Consumers read the stream incrementally through a consumer group, see
+ChangeStreamConsumer.
+"""
+
+import hashlib
+import redis
+
+from disboard.items import DisboardServerItem
+from typing import Dict, List, Optional, Tuple
+
+
+CHANGES_KEY = "%(spider)s:changes"
+DIGESTS_KEY = "%(spider)s:changes:digests"
+
+# For each (guild_id, digest, scrape_time) triple of ARGV[2:], publishes an
+# event to the stream KEYS[2], trimmed to about ARGV[1] events, if the guild
+# is not in the digests hash KEYS[1] or its digest changed. Returns the kind
+# of each event, or false for the unchanged guilds.
+PUBLISH_SCRIPT = """
+local kinds = {}
+for i = 2, #ARGV, 3 do
+    local guild_id, digest = ARGV[i], ARGV[i + 1]
+    local previous = redis.call('HGET', KEYS[1], guild_id)
+    local kind = false
+    if not previous then
+        kind = 'new'
+    elseif previous ~= digest then
+        kind = 'changed'
+    end
+    if kind then
+        redis.call('HSET', KEYS[1], guild_id, digest)
+        redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], '*',
+            'guild_id', guild_id, 'kind', kind, 'scrape_time', ARGV[i + 2])
+    end
+    table.insert(kinds, kind)
+end
+return kinds
+"""
+
+
+def item_digest(item: DisboardServerItem) -> str:
+    """
+    Returns a short digest of the fields of the item that a downstream
+    consumer cares about. The scrape_time is left out, so that a guild
+    that is scraped again unchanged doesn't publish an event.
+    """
+    fields = [item.server_name, item.server_description, item.category]
+    fields.extend(f"{tag_id}={name}" for tag_id, name in item.tags)
+    return hashlib.blake2b("\0".join(fields).encode(), digest_size=8).hexdigest()
+
+
+class ChangeStreamConsumer:
+    """
+    A consumer of the {spider}:changes stream, in a consumer group.
+
+    Each consumer of a group receives its own share of the events, and the
+    events must be acknowledged once they are processed. The events that a
+    dead consumer read but didn't acknowledge can be claimed by another one.
+
+        consumer = ChangeStreamConsumer(client, "servers", "search-index", "indexer-1")
+        while True:
+            events = consumer.read(block=5000)
+            for event_id, event in events:
+                index(event["guild_id"])
+            consumer.ack([event_id for event_id, _ in events])
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        spider_name: str,
+        group: str,
+        consumer: str,
+        start_id: str = "0",
+    ):
+        self.client = client
+        self.key = CHANGES_KEY % {"spider": spider_name}
+        self.group = group
+        self.consumer = consumer
+        self.create_group(start_id)
+
+    def create_group(self, start_id: str = "0") -> None:
+        """
+        Creates the consumer group if it doesn't exist. A new group reads
+        the stream from start_id: "0" for the oldest event kept, or "$" for
+        the events published from now on.
+        """
+        try:
+            self.client.xgroup_create(self.key, self.group, id=start_id, mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def read(
+        self, count: int = 100, block: Optional[int] = None
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        Returns up to count new events, waiting up to block milliseconds for
+        them if block is given.
+        """
+        response = self.client.xreadgroup(
+            self.group, self.consumer, {self.key: ">"}, count=count, block=block
+        )
+        if not response:
+            return []
+        _, events = response[0]
+        return [self._decode(event_id, fields) for event_id, fields in events]
+
+    def ack(self, event_ids: List[str]) -> int:
+        if not event_ids:
+            return 0
+        return self.client.xack(self.key, self.group, *event_ids)
+
+    def claim_stale(
+        self, min_idle_time: int = 60_000, count: int = 100
+    ) -> List[Tuple[str, Dict[str, str]]]:
+        """
+        Claims and returns up to count events that other consumers of the
+        group read but didn't acknowledge for min_idle_time milliseconds.
+        """
+        pending = self.client.xpending_range(
+            self.key, self.group, min="-", max="+", count=count
+        )
+        event_ids = [
+            entry["message_id"]
+            for entry in pending
+            if entry["time_since_delivered"] >= min_idle_time
+        ]
+        if not event_ids:
+            return []
+        events = self.client.xclaim(
+            self.key, self.group, self.consumer, min_idle_time, event_ids
+        )
+        return [
+            self._decode(event_id, fields) for event_id, fields in events if fields
+        ]
+
+    @staticmethod
+    def _decode(event_id, fields) -> Tuple[str, Dict[str, str]]:
+        return event_id.decode(), {
+            key.decode(): value.decode() for key, value in fields.items()
+        }
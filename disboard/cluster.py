@@ -0,0 +1,253 @@
+"""
+This module coordinates several crawl.py nodes, usually running on
+different hosts, that share the same Redis server.
+
+Each node registers itself in {spider}:nodes and renews its registration
+with heartbeats. The FlareSolverr proxies of all nodes are pooled in
+{spider}:proxies, and each proxy is owned by at most one node at a time in
+{spider}:proxy_owners. Proxies are split evenly between the live nodes,
+and the proxies of dead nodes are handed over to the remaining ones.
+
+A proxy on a loopback address, e.g. http://localhost:8191/v1, can only be
+reached from the host of its node, so it is pooled as "{node_id} {url}"
+and only ever claimed by that node, see pool_member.
+
+Any node (or an operator running crawl.py --cluster-command) can ask the
+whole cluster to stop or drain through {spider}:cluster_command, see
+disboard.workers.STOP and disboard.workers.DRAIN.
+"""
+
+import ipaddress
+import json
+import os
+import socket
+import time
+import redis
+
+from disboard.workers import CLOSED_STATS_KEY, STATUS_KEY
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+
+NODES_KEY = "%(spider)s:nodes"
+PROXIES_KEY = "%(spider)s:proxies"
+PROXY_OWNERS_KEY = "%(spider)s:proxy_owners"
+COMMAND_KEY = "%(spider)s:cluster_command"
+
+# Forgets the dead nodes and their local proxies, and gives the calling node
+# its own local proxies and its fair share of the shared proxies:
+# ceil(shared proxies / live nodes). Returns the proxies owned by the node.
+CLAIM_SCRIPT = """
+local dead = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+for _, node in ipairs(dead) do
+    redis.call('ZREM', KEYS[1], node)
+end
+
+local shared = {}
+local own_local = {}
+for _, proxy in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+    local node = string.match(proxy, '^(.-) ')
+    if node == nil then
+        table.insert(shared, proxy)
+    elseif redis.call('ZSCORE', KEYS[1], node) == false then
+        redis.call('SREM', KEYS[2], proxy)
+    elseif node == ARGV[1] then
+        table.insert(own_local, proxy)
+    end
+end
+
+local owners = redis.call('HGETALL', KEYS[3])
+local owned = {}
+for i = 1, #owners, 2 do
+    local proxy, owner = owners[i], owners[i + 1]
+    if redis.call('ZSCORE', KEYS[1], owner) == false
+        or redis.call('SISMEMBER', KEYS[2], proxy) == 0 then
+        redis.call('HDEL', KEYS[3], proxy)
+    elseif owner == ARGV[1] and string.match(proxy, '^(.-) ') == nil then
+        table.insert(owned, proxy)
+    end
+end
+
+table.sort(shared)
+local n_of_nodes = math.max(redis.call('ZCARD', KEYS[1]), 1)
+local share = math.ceil(#shared / n_of_nodes)
+
+table.sort(owned)
+while #owned > share do
+    redis.call('HDEL', KEYS[3], table.remove(owned))
+end
+for _, proxy in ipairs(shared) do
+    if #owned >= share then
+        break
+    end
+    if redis.call('HSETNX', KEYS[3], proxy, ARGV[1]) == 1 then
+        table.insert(owned, proxy)
+    end
+end
+for _, proxy in ipairs(own_local) do
+    redis.call('HSET', KEYS[3], proxy, ARGV[1])
+    table.insert(owned, proxy)
+end
+return owned
+"""
+
+
+def is_loopback(proxy_url: str) -> bool:
+    """
+    Returns True if the proxy can only be reached from its own host.
+    """
+    host = urlparse(proxy_url).hostname or ""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def pool_member(node_id: str, proxy_url: str) -> str:
+    """
+    Returns the member of {spider}:proxies of a proxy registered by the node.
+    """
+    return f"{node_id} {proxy_url}" if is_loopback(proxy_url) else proxy_url
+
+
+def member_url(member: str) -> str:
+    """
+    Returns the url of a member of {spider}:proxies.
+    """
+    return member.rsplit(" ", 1)[-1]
+
+
+def get_node_id() -> str:
+    """
+    Returns the id of this host's node: NODE_ID, or the hostname.
+    """
+    return os.getenv("NODE_ID") or socket.gethostname()
+
+
+def pooled_proxy_urls(
+    client: redis.Redis, spider_name: str, node_id: str
+) -> List[str]:
+    """
+    Returns the urls of the proxies of the cluster that the node can reach:
+    the shared proxies and its own local proxies.
+    """
+    members = client.smembers(PROXIES_KEY % {"spider": spider_name})
+    return sorted(
+        member_url(member)
+        for member in (member.decode() for member in members)
+        if " " not in member or member.startswith(f"{node_id} ")
+    )
+
+
+class ClusterNode:
+    """
+    A crawl.py process taking part in the cluster.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        spider_name: str,
+        node_id: Optional[str] = None,
+        heartbeat_timeout: float = 120,
+    ):
+        keys = {"spider": spider_name}
+        self.client = redis.Redis.from_url(redis_url)
+        self.spider_name = spider_name
+        self.node_id = node_id or get_node_id()
+        self.heartbeat_timeout = heartbeat_timeout
+        self.nodes_key = NODES_KEY % keys
+        self.proxies_key = PROXIES_KEY % keys
+        self.owners_key = PROXY_OWNERS_KEY % keys
+        self.command_key = COMMAND_KEY % keys
+        self._claim_script = self.client.register_script(CLAIM_SCRIPT)
+
+    def register(self, proxy_urls: List[str]) -> None:
+        """
+        Registers the node and adds its proxies to the cluster's pool.
+        """
+        with self.client.pipeline() as pipe:
+            if proxy_urls:
+                members = [pool_member(self.node_id, url) for url in proxy_urls]
+                pipe.sadd(self.proxies_key, *members)
+            pipe.zadd(self.nodes_key, {self.node_id: self._expiry()})
+            pipe.execute()
+
+    def heartbeat(self) -> None:
+        self.client.zadd(self.nodes_key, {self.node_id: self._expiry()})
+
+    def sleep(self, seconds: float, interval: float = 30) -> None:
+        """
+        Sleeps for the given seconds while keeping the node registered.
+        """
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            self.heartbeat()
+            time.sleep(max(0, min(interval, deadline - time.time())))
+
+    def claim_proxies(self) -> List[str]:
+        """
+        Returns the proxies assigned to this node, claiming or releasing
+        proxies so that each live node owns its fair share.
+        """
+        owned = self._claim_script(
+            keys=[self.nodes_key, self.proxies_key, self.owners_key],
+            args=[self.node_id, time.time()],
+        )
+        return sorted(member_url(proxy.decode()) for proxy in owned)
+
+    def leave(self) -> None:
+        """
+        Unregisters the node and releases its proxies.
+        """
+        owners = self.client.hgetall(self.owners_key)
+        with self.client.pipeline() as pipe:
+            for proxy, owner in owners.items():
+                if owner.decode() == self.node_id:
+                    pipe.hdel(self.owners_key, proxy)
+            pipe.zrem(self.nodes_key, self.node_id)
+            pipe.execute()
+
+    def nodes(self) -> List[str]:
+        """
+        Returns the ids of the live nodes.
+        """
+        nodes = self.client.zrangebyscore(self.nodes_key, time.time(), "+inf")
+        return [node.decode() for node in nodes]
+
+    def command(self) -> Optional[str]:
+        command = self.client.get(self.command_key)
+        return command.decode() if command else None
+
+    def send_command(self, command: Optional[str]) -> None:
+        """
+        Sends the command to every node. Use None to clear the command.
+        """
+        if command is None:
+            self.client.delete(self.command_key)
+        else:
+            self.client.set(self.command_key, command)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the crawl counters aggregated over all the workers of the
+        cluster, both running and closed.
+        """
+        keys = {"spider": self.spider_name}
+        stats = {
+            key.decode(): int(value)
+            for key, value in self.client.hgetall(CLOSED_STATS_KEY % keys).items()
+        }
+        for status in self.client.hvals(STATUS_KEY % keys):
+            for key, value in json.loads(status).items():
+                if key in ("pages", "items", "errors"):
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def close(self) -> None:
+        self.client.close()
+
+    def _expiry(self) -> float:
+        return time.time() + self.heartbeat_timeout
@@ -1,10 +1,30 @@
-from disboard.items import DisboardServerItem
+import os
+import re
+import socket
+import sys
+
+from disboard.items import DisboardServerItem, make_tags
 from datetime import datetime
 from scrapy.http import Response, Request
-from typing import Generator, List
+from scrapy.settings import Settings
+from typing import Generator, List, Optional
 from urllib.parse import urljoin
 
 
+def get_worker_id(settings: Settings) -> str:
+    """
+    Returns the identifier of the current worker process.
+
+    It is taken from the WORKER_ID setting when available, otherwise it
+    defaults to "{hostname}:{pid}".
+    """
+    worker_id = settings.get("WORKER_ID")
+    if worker_id:
+        return worker_id
+
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
 def blocked_by_cloudflare(response: Response) -> bool:
     """
     Given a response from a Disboard server list page, returns True if
@@ -51,17 +71,130 @@ def has_pagination_links(response: Response) -> bool:
     return next_url is not None
 
 
-def get_url_postfixes(self) -> List[str]:
+def get_url_language(url: str) -> Optional[str]:
+    """
+    Returns the language the given Disboard URL is filtered by (the value
+    of its "fl" query parameter), or None if the URL is not filtered.
+    """
+    match = re.search(r"[?&]fl=([^&#]*)", url)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def get_url_tag(url: str) -> Optional[str]:
+    """
+    Returns the tag listed by the given Disboard URL, or None if the URL
+    is not a tag page.
+    """
+    match = re.search(r"/servers/tag/([^/?#]+)", url)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def get_url_category(url: str) -> Optional[str]:
+    """
+    Returns the category listed by the given Disboard URL, or None if the
+    URL is not a category page.
+    """
+    match = re.search(r"/servers/category/([^/?#]+)", url)
+    if match is None:
+        return None
+
+    return match.group(1)
+
+
+def get_url_page(url: str) -> int:
+    """
+    Returns the page number of the given Disboard URL, 1 for the first page
+    of a listing.
+    """
+    match = re.search(r"/servers(?:/(?:tag|category)/[^/?#]+)?/(\d+)(?:[?#]|$)", url)
+    if match is None:
+        return 1
+
+    return int(match.group(1))
+
+
+def get_url_listing(url: str) -> str:
+    """
+    Returns the listing of the given Disboard URL: "tag:{tag}" for tag
+    pages, "category:{category}" for category pages, and "front" otherwise.
+    """
+    match = re.search(r"/servers/(tag|category)/([^/?#]+)", url)
+    if match is None:
+        return "front"
+
+    return f"{match.group(1)}:{match.group(2)}"
+
+
+def get_request_origin(request: Request) -> str:
+    """
+    Returns how the given request was found: "seed", "registry",
+    "pagination", "category", "tag", "retry" or "recrawl".
+
+    It is taken from request.meta["origin"], or from the request redirected
+    to FlareSolverr in request.meta["original_request"]. Requests without
+    an origin were pushed to {spider}:start_urls, and are seeds.
+    """
+    origin = request.meta.get("origin")
+    if origin is not None:
+        return origin
+
+    original_request = request.meta.get("original_request")
+    if original_request is not None:
+        return get_request_origin(original_request)
+
+    return "seed"
+
+
+def get_request_language(request: Request, default: str = "") -> str:
+    """
+    Returns the language of the given request.
+
+    It is taken from request.meta["language"], from the request redirected
+    to FlareSolverr in request.meta["original_request"], or from the URL.
+    """
+    language = request.meta.get("language")
+    if language is not None:
+        return language
+
+    original_request = request.meta.get("original_request")
+    if original_request is not None:
+        return get_request_language(original_request, default)
+
+    language = get_url_language(request.url)
+    return default if language is None else language
+
+
+def get_response_language(self, response: Response) -> str:
+    """
+    Given a response from a Disboard server list page, returns the language
+    that the requests following its links must be filtered by.
+    """
+    language = get_url_language(response.url)
+    return self.language if language is None else language
+
+
+def get_url_postfixes(self, language: Optional[str] = None) -> List[str]:
     """
     Returns a tuple with the postfixes to append to the URLs of the
     category and tag pages.
+
+    By default, the postfixes filter by the language of the spider.
     """
-    if self.language == "":
+    if language is None:
+        language = self.language
+
+    if language == "":
         return ["", "?sort=-member_count"]
 
-    language = f"?fl={self.language}"
-    language_and_member_count = f"?fl={self.language}&sort=-member_count"
-    return [language, language_and_member_count]
+    by_language = f"?fl={language}"
+    by_language_and_member_count = f"?fl={language}&sort=-member_count"
+    return [by_language, by_language_and_member_count]
 
 
 def extract_disboard_server_items(
@@ -95,10 +228,9 @@ def extract_disboard_server_items(
         ).strip()
 
         data_ids = server_body.css(".tag::attr(data-id)").getall()
-        tags = server_body.css(".tag::attr(title)").getall()
-        tags = [{key: value} for key, value in zip(data_ids, tags)]
+        tags = make_tags(data_ids, server_body.css(".tag::attr(title)").getall())
 
-        category = server_info.css(".server-category::text").get().strip()
+        category = sys.intern(server_info.css(".server-category::text").get().strip())
         yield DisboardServerItem(
             scrape_time=scrape_time,
             platform_link=platform_link,
@@ -117,6 +249,9 @@ def request_next_url(self, response: Response) -> Generator[Request, None, None]
 
     This function is meant to be used in a scrapy.Spider.parse method.
 
+    The request is tagged with its origin and source URL in its meta, see
+    get_request_origin. Its depth is set by Scrapy's DepthMiddleware.
+
     The priority of the request is set to the number of servers + 50.
     Higher priority requests are processed earlier.
     """
@@ -124,7 +259,15 @@ def request_next_url(self, response: Response) -> Generator[Request, None, None]
     next_url = response.css(".next a::attr(href)").get()
     if next_url is not None:
         next_url = f"{self.url_prefix}{urljoin(self.base_url, next_url)}"
-        yield Request(url=next_url, priority=n_of_servers + 50)
+        yield Request(
+            url=next_url,
+            priority=n_of_servers + 50,
+            meta={
+                "language": get_response_language(self, response),
+                "origin": "pagination",
+                "source_url": response.url,
+            },
+        )
 
 
 def request_all_category_urls(
@@ -141,12 +284,21 @@ def request_all_category_urls(
     """
     n_of_servers = count_disboard_server_items(response)
     category_urls = response.css(".category::attr(href)").getall()
-    postfixes = get_url_postfixes(self)
+    language = get_response_language(self, response)
+    postfixes = get_url_postfixes(self, language)
 
     for category_url in list(dict.fromkeys(category_urls)):
         for postfix in postfixes:
             url = f"{self.url_prefix}{urljoin(self.base_url, category_url)}{postfix}"
-            yield Request(url=url, priority=n_of_servers + 25)
+            yield Request(
+                url=url,
+                priority=n_of_servers + 25,
+                meta={
+                    "language": language,
+                    "origin": "category",
+                    "source_url": response.url,
+                },
+            )
 
 
 def request_all_tag_urls(self, response: Response) -> Generator[Request, None, None]:
@@ -161,9 +313,18 @@ def request_all_tag_urls(self, response: Response) -> Generator[Request, None, N
     """
     n_of_servers = count_disboard_server_items(response)
     tag_urls = response.css(".tag::attr(href)").getall()
-    postfixes = get_url_postfixes(self)
+    language = get_response_language(self, response)
+    postfixes = get_url_postfixes(self, language)
 
     for tag_url in list(dict.fromkeys(tag_urls)):
         for postfix in postfixes:
             url = f"{self.url_prefix}{urljoin(self.base_url, tag_url)}{postfix}"
-            yield Request(url=url, priority=n_of_servers + 1)
+            yield Request(
+                url=url,
+                priority=n_of_servers + 1,
+                meta={
+                    "language": language,
+                    "origin": "tag",
+                    "source_url": response.url,
+                },
+            )
@@ -0,0 +1,116 @@
+# Define here the duplicates filters used by the scheduler
+#
+# See documentation in:
+# https://github.com/rmax/scrapy-redis/wiki/Usage
+
+import hashlib
+import json
+import time
+
+from scrapy.http import Request
+from scrapy.utils.python import to_unicode
+from scrapy_redis.dupefilter import RFPDupeFilter
+from w3lib.url import canonicalize_url
+
+
+# Returns 2 if the request is in the negative cache and its entry didn't
+# expire yet. Otherwise, returns 0 if the request was not seen before or if
+# its revisit is due, in which case the revisit is postponed by ARGV[3]
+# seconds until the page is fetched and its next revisit is scheduled.
+# Returns 1 otherwise.
+REQUEST_SEEN_SCRIPT = """
+local expiry = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if expiry then
+    if tonumber(expiry) > tonumber(ARGV[2]) then
+        return 2
+    end
+    redis.call('ZREM', KEYS[3], ARGV[1])
+end
+if redis.call('SADD', KEYS[1], ARGV[1]) == 1 then
+    return 0
+end
+local due = redis.call('ZSCORE', KEYS[2], ARGV[1])
+if due and tonumber(due) <= tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[2]) + tonumber(ARGV[3]), ARGV[1])
+    return 0
+end
+return 1
+"""
+
+
+def request_fingerprint(request: Request) -> str:
+    """
+    Returns the fingerprint of the request, as computed by scrapy_redis'
+    RFPDupeFilter.
+    """
+    fingerprint_data = {
+        "method": to_unicode(request.method),
+        "url": canonicalize_url(request.url),
+        "body": (request.body or b"").hex(),
+    }
+    fingerprint_json = json.dumps(fingerprint_data, sort_keys=True)
+    return hashlib.sha1(fingerprint_json.encode()).hexdigest()
+
+
+class RecrawlDupeFilter(RFPDupeFilter):
+    """
+    This duplicates filter lets a request through again once its revisit
+    is due.
+
+    The revisit time of each fingerprint is kept in the {spider}:revisit
+    sorted set, which is maintained by disboard.extensions.RecrawlScheduler.
+    Requests without a revisit time are filtered like RFPDupeFilter does.
+
+    It also filters the requests in the negative cache, the {spider}:negative
+    sorted set of the URLs known to be dead or empty, until their entry
+    expires. See disboard.extensions.NegativeCache. Unlike the duplicates
+    filter, the negative cache is kept when the job is restarted.
+    """
+
+    revisit_key = "%(spider)s:revisit"
+    negative_key = "%(spider)s:negative"
+
+    def __init__(
+        self,
+        server,
+        key,
+        debug=False,
+        revisit_key=None,
+        negative_key=None,
+        grace=3600,
+    ):
+        super().__init__(server, key, debug)
+        self.revisit_key = revisit_key or f"{key}:revisit"
+        self.negative_key = negative_key or f"{key}:negative"
+        self.grace = grace
+        # Whether the last filtered request was in the negative cache
+        self.negative_hit = False
+        self._request_seen_script = server.register_script(REQUEST_SEEN_SCRIPT)
+
+    @classmethod
+    def from_spider(cls, spider):
+        instance = super().from_spider(spider)
+        instance.revisit_key = cls.revisit_key % {"spider": spider.name}
+        instance.negative_key = cls.negative_key % {"spider": spider.name}
+        instance.grace = spider.settings.getfloat("RECRAWL_MIN_INTERVAL", 3600)
+        return instance
+
+    def request_seen(self, request):
+        fp = self.request_fingerprint(request)
+        seen = self._request_seen_script(
+            keys=[self.key, self.revisit_key, self.negative_key],
+            args=[fp, time.time(), self.grace],
+        )
+        self.negative_hit = seen == 2
+        return seen != 0
+
+    def log(self, request, spider):
+        if not self.negative_hit:
+            return super().log(request, spider)
+
+        if self.debug:
+            self.logger.debug(f"Filtered request in the negative cache: {request}")
+        spider.crawler.stats.inc_value("negative_cache/filtered", spider=spider)
+
+    def request_fingerprint(self, request):
+        return request_fingerprint(request)
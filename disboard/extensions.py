@@ -0,0 +1,936 @@
+# Define here the extensions of the project
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+import cProfile
+import hashlib
+import json
+import os
+import pstats
+import random
+import re
+import signal
+import socket
+import time
+import tracemalloc
+import redis
+
+from collections import Counter, defaultdict
+from disboard.archive import PageArchiveWriter, page_from_response
+from disboard.commons.helpers import (
+    blocked_by_cloudflare,
+    count_disboard_server_items,
+    get_request_language,
+    get_request_origin,
+    get_url_listing,
+    get_url_page,
+    get_worker_id,
+    is_server_listing,
+)
+from disboard.dupefilters import request_fingerprint
+from disboard.metrics import (
+    ENDPOINTS_KEY,
+    LATENCY,
+    METRICS_KEY,
+    PROXY_ROUND_TRIP,
+    QUEUE_DWELL,
+    MetricsResource,
+)
+from disboard.workers import (
+    CLOSED_STATS_KEY,
+    CONTROL_KEY,
+    READY_KEY,
+    STATUS_KEY,
+    PAUSE,
+    PROFILE,
+    RESUME,
+    STOP,
+)
+from logging import getLogger
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from twisted.internet import task
+from twisted.internet.error import CannotListenError
+from twisted.web import server
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+# Sent by WorkerControl when the worker receives the "profile" command
+profile_requested = object()
+
+
+class WorkerControl:
+    """
+    This extension lets the crawl.py orchestrator drive a running worker.
+
+    Once the spider is opened (that is, when the reactor is running and the
+    scheduler and item pipelines have connected to Redis and the database),
+    the worker pushes a message to {spider}:ready:{worker_id}.
+
+    Then, every WORKER_CONTROL_POLL_INTERVAL seconds, the worker stores its
+    status (crawled pages, scraped items and download errors) in the
+    {spider}:workers hash, which is added to the {spider}:stats:closed
+    totals when the spider closes, and pops the commands sent to
+    {spider}:control:{worker_id}:
+    - "pause": stop pulling new requests from the scheduler;
+    - "resume": start pulling new requests again;
+    - "stop": close the spider gracefully;
+    - "profile": send the profile_requested signal, see Profiler.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, redis_url, worker_id, poll_interval):
+        self.crawler = crawler
+        self.redis_url = redis_url
+        self.worker_id = worker_id
+        self.poll_interval = poll_interval
+        self.poll_loop = None
+        self.client = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("WorkerControl requires REDIS_URL")
+
+        extension = cls(
+            crawler=crawler,
+            redis_url=settings.get("REDIS_URL"),
+            worker_id=get_worker_id(settings),
+            poll_interval=settings.getfloat("WORKER_CONTROL_POLL_INTERVAL", 2),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_opened(self, spider):
+        keys = {"spider": spider.name, "worker": self.worker_id}
+        self.ready_key = READY_KEY % keys
+        self.control_key = CONTROL_KEY % keys
+        self.status_key = STATUS_KEY % keys
+        self.closed_stats_key = CLOSED_STATS_KEY % keys
+        self.spider = spider
+
+        self.client = redis.Redis.from_url(self.redis_url)
+        with self.client.pipeline() as pipe:
+            pipe.rpush(self.ready_key, time.time())
+            pipe.expire(self.ready_key, 3600)
+            pipe.execute()
+        self.logger.info(f"Worker {self.worker_id} is ready")
+
+        self.poll_loop = task.LoopingCall(self.poll)
+        self.poll_loop.start(self.poll_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.poll_loop and self.poll_loop.running:
+            self.poll_loop.stop()
+        if self.client is not None:
+            # Move the worker's counters to the totals of the closed workers
+            status = self.status()
+            with self.client.pipeline() as pipe:
+                for key in ("pages", "items", "errors"):
+                    pipe.hincrby(self.closed_stats_key, key, status[key])
+                pipe.hdel(self.status_key, self.worker_id)
+                pipe.execute()
+            self.client.close()
+
+    def status(self) -> dict:
+        stats = self.crawler.stats
+        return {
+            "time": time.time(),
+            "pages": stats.get_value("response_received_count", 0),
+            "items": stats.get_value("item_scraped_count", 0),
+            "errors": stats.get_value("downloader/exception_count", 0),
+            "paused": self.crawler.engine.paused,
+        }
+
+    def poll(self) -> None:
+        """
+        Reports the worker's status, and pops and executes the pending commands.
+        """
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.hset(self.status_key, self.worker_id, json.dumps(self.status()))
+                pipe.lrange(self.control_key, 0, -1)
+                _, commands = pipe.execute()
+            if not commands:
+                return
+            self.client.ltrim(self.control_key, len(commands), -1)
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to read commands of {self.worker_id}: {e}")
+            return
+
+        for command in commands:
+            self.execute(command.decode())
+
+    def execute(self, command: str) -> None:
+        engine = self.crawler.engine
+        self.logger.info(f"Worker {self.worker_id} received command: {command}")
+
+        if command == PAUSE:
+            engine.pause()
+        elif command == RESUME:
+            engine.unpause()
+        elif command == STOP:
+            engine.close_spider(self.spider, "shutdown")
+        elif command == PROFILE:
+            self.crawler.signals.send_catch_log(signal=profile_requested)
+        else:
+            self.logger.warning(f"Unknown command: {command}")
+
+
+# Returns up to ARGV[2] fingerprints whose revisit is due at ARGV[1], and
+# postpones their revisit by ARGV[3] seconds so that no other worker
+# schedules them until they are fetched.
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, fp in ipairs(due) do
+    redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + tonumber(ARGV[3]), fp)
+end
+return due
+"""
+
+
+class RecrawlScheduler:
+    """
+    This extension keeps the crawled listings fresh by revisiting each
+    listing URL on an adaptive interval, instead of wiping the job with
+    crawl.py --restart-job.
+
+    For each listing page that is fetched, the {spider}:freshness hash
+    records its URL, when it was last fetched, how many times it was
+    visited and how many times its set of guilds changed. The next revisit
+    is stored in the {spider}:revisit sorted set:
+    - the first interval depends on the kind of page: front pages are
+      revisited every RECRAWL_MIN_INTERVAL seconds, category pages 4 times
+      less often, tag pages 12 times less often, and deeper pages of the
+      pagination proportionally less often;
+    - then the interval is halved when the page changed since the previous
+      visit and doubled when it didn't, within RECRAWL_MIN_INTERVAL and
+      RECRAWL_MAX_INTERVAL.
+
+    Every RECRAWL_CHECK_INTERVAL seconds, the due URLs are scheduled again.
+    disboard.dupefilters.RecrawlDupeFilter lets due URLs through as well.
+    """
+
+    logger = getLogger(__name__)
+
+    category_factor = 4
+    tag_factor = 12
+
+    def __init__(self, crawler, redis_url, min_interval, max_interval, check_interval):
+        self.crawler = crawler
+        self.redis_url = redis_url
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.check_interval = check_interval
+        self.check_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("RECRAWL_ENABLED"):
+            raise NotConfigured("RecrawlScheduler is disabled")
+
+        extension = cls(
+            crawler=crawler,
+            redis_url=settings.get("REDIS_URL"),
+            min_interval=settings.getfloat("RECRAWL_MIN_INTERVAL", 3600),
+            max_interval=settings.getfloat("RECRAWL_MAX_INTERVAL", 7 * 24 * 3600),
+            check_interval=settings.getfloat("RECRAWL_CHECK_INTERVAL", 60),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            extension.response_received, signal=signals.response_received
+        )
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        self.freshness_key = f"{spider.name}:freshness"
+        self.revisit_key = f"{spider.name}:revisit"
+        self.client = redis.Redis.from_url(self.redis_url)
+        self._pop_due_script = self.client.register_script(POP_DUE_SCRIPT)
+
+        self.check_loop = task.LoopingCall(self.schedule_due_requests)
+        self.check_loop.start(self.check_interval, now=True)
+
+    def spider_closed(self, spider):
+        if self.check_loop and self.check_loop.running:
+            self.check_loop.stop()
+        self.client.close()
+
+    def initial_interval(self, url: str) -> float:
+        """
+        Returns the revisit interval of a listing URL visited for the first time.
+        """
+        interval = self.min_interval
+        if "/servers/category/" in url:
+            interval *= self.category_factor
+        elif "/servers/tag/" in url:
+            interval *= self.tag_factor
+
+        interval *= get_url_page(url)
+        return min(interval, self.max_interval)
+
+    def next_interval(self, interval: float, changed: bool) -> float:
+        """
+        Returns the revisit interval of a listing after a new visit.
+        """
+        interval = interval / 2 if changed else interval * 2
+        return max(self.min_interval, min(self.max_interval, interval))
+
+    def response_received(self, response, request, spider):
+        # Responses solved by FlareSolverr carry the original request
+        request = response.request or request
+        if response.status != 200 or not hasattr(response, "css"):
+            return
+        if blocked_by_cloudflare(response) or not is_server_listing(response):
+            return
+
+        guild_ids = sorted(response.css(".server-name a::attr(href)").getall())
+        digest = hashlib.sha1("\n".join(guild_ids).encode()).hexdigest()
+        fp = request_fingerprint(request)
+        now = time.time()
+
+        freshness = self.client.hget(self.freshness_key, fp)
+        if freshness is None:
+            freshness = {
+                "url": request.url,
+                "priority": request.priority,
+                "language": get_request_language(request),
+                "interval": self.initial_interval(request.url),
+                "visits": 0,
+                "changes": 0,
+            }
+        else:
+            freshness = json.loads(freshness)
+            changed = freshness["digest"] != digest
+            freshness["changes"] += int(changed)
+            freshness["interval"] = self.next_interval(freshness["interval"], changed)
+
+        freshness["visits"] += 1
+        freshness["last_fetch"] = now
+        freshness["digest"] = digest
+
+        with self.client.pipeline() as pipe:
+            pipe.hset(self.freshness_key, fp, json.dumps(freshness))
+            pipe.zadd(self.revisit_key, {fp: now + freshness["interval"]})
+            pipe.execute()
+
+    def schedule_due_requests(self) -> None:
+        """
+        Schedules the listings whose revisit is due.
+        """
+        try:
+            due = self._pop_due_script(
+                keys=[self.revisit_key],
+                args=[time.time(), 100, self.min_interval],
+            )
+            if not due:
+                return
+            freshness = self.client.hmget(self.freshness_key, due)
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to read the due revisits: {e}")
+            return
+
+        scheduled = 0
+        for data in freshness:
+            if data is None:
+                continue
+            data = json.loads(data)
+            request = Request(
+                url=data["url"],
+                priority=data["priority"],
+                dont_filter=True,
+                meta={
+                    "language": data["language"],
+                    "recrawl": True,
+                    "origin": "recrawl",
+                },
+            )
+            self.crawler.engine.crawl(request)
+            scheduled += 1
+
+        if scheduled:
+            self.crawler.stats.inc_value("recrawl/scheduled", scheduled)
+            self.logger.info(f"Scheduled {scheduled} due revisits")
+
+
+class NegativeCache:
+    """
+    This extension remembers the listing URLs that are dead or empty, so
+    that they don't waste browser solves every time they are rediscovered.
+
+    A URL is added to the {spider}:negative sorted set when its final
+    response (after all retries) is a 404, a page without servers, or a page
+    whose title is not the one of a server listing. Responses blocked by
+    Cloudflare and pages without a title are not taken into account.
+    disboard.dupefilters.RecrawlDupeFilter filters the URLs of the set before
+    they are scheduled.
+
+    Each entry expires after NEGATIVE_CACHE_TTL seconds, give or take
+    NEGATIVE_CACHE_JITTER, so that the URLs are checked again now and then
+    without all of them coming back at the same time.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, redis_url, ttl, jitter):
+        self.crawler = crawler
+        self.redis_url = redis_url
+        self.ttl = ttl
+        self.jitter = jitter
+        self.client = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("NEGATIVE_CACHE_ENABLED"):
+            raise NotConfigured("NegativeCache is disabled")
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("NegativeCache requires REDIS_URL")
+
+        extension = cls(
+            crawler=crawler,
+            redis_url=settings.get("REDIS_URL"),
+            ttl=settings.getfloat("NEGATIVE_CACHE_TTL", 7 * 24 * 3600),
+            jitter=settings.getfloat("NEGATIVE_CACHE_JITTER", 0.2),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            extension.response_received, signal=signals.response_received
+        )
+        return extension
+
+    def spider_opened(self, spider):
+        self.negative_key = f"{spider.name}:negative"
+        self.client = redis.Redis.from_url(self.redis_url)
+
+    def spider_closed(self, spider):
+        if self.client is not None:
+            self.client.close()
+
+    def expiry(self) -> float:
+        """
+        Returns the expiry time of a new entry.
+        """
+        jitter = random.uniform(-self.jitter, self.jitter)
+        return time.time() + self.ttl * (1 + jitter)
+
+    def negative_reason(self, response) -> Optional[str]:
+        """
+        Returns why the response makes its URL a dead or empty URL,
+        or None if it doesn't.
+        """
+        if response.status == 404:
+            return "not_found"
+        if response.status != 200 or not hasattr(response, "css"):
+            return None
+        # Pages without a title are truncated solutions or transient error
+        # pages, which are worth retrying
+        if response.css("title::text").get() is None:
+            return None
+        if blocked_by_cloudflare(response):
+            return None
+        if not is_server_listing(response):
+            return "not_listing"
+        if count_disboard_server_items(response) == 0:
+            return "empty"
+        return None
+
+    def response_received(self, response, request, spider):
+        request = response.request or request
+        reason = self.negative_reason(response)
+        if reason is None:
+            return
+
+        fp = request_fingerprint(request)
+        self.client.zadd(self.negative_key, {fp: self.expiry()})
+        self.crawler.stats.inc_value(f"negative_cache/added/{reason}")
+        self.logger.debug(f"Added to the negative cache ({reason}): {request.url}")
+
+
+class PageArchiver:
+    """
+    This extension writes every listing page that is fetched to the raw
+    page archive in PAGE_ARCHIVE_DIR, so that the pages can be parsed again
+    with reparse.py when the parser changes, instead of crawling them again.
+    See disboard.archive.
+
+    Pages blocked by Cloudflare and pages that are not server listings are
+    not archived.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, directory, worker_id, segment_size):
+        self.crawler = crawler
+        self.writer = PageArchiveWriter(directory, worker_id, segment_size)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PAGE_ARCHIVE_ENABLED"):
+            raise NotConfigured("PageArchiver is disabled")
+
+        extension = cls(
+            crawler=crawler,
+            directory=settings.get("PAGE_ARCHIVE_DIR", "archive"),
+            worker_id=get_worker_id(settings),
+            segment_size=settings.getint("PAGE_ARCHIVE_SEGMENT_SIZE", 256 * 1024**2),
+        )
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            extension.response_received, signal=signals.response_received
+        )
+        return extension
+
+    def spider_closed(self, spider):
+        self.writer.close()
+
+    def response_received(self, response, request, spider):
+        if response.status != 200 or not hasattr(response, "css"):
+            return
+        if blocked_by_cloudflare(response) or not is_server_listing(response):
+            return
+
+        request = response.request or request
+        page = page_from_response(response, get_request_language(request))
+        try:
+            self.writer.write(page)
+        except OSError as e:
+            self.logger.error(f"Failed to archive {response.url}: {e}")
+            return
+        self.crawler.stats.inc_value("page_archive/pages")
+
+
+class LatencyMetrics:
+    """
+    This extension exports the latency histograms of the worker's stages,
+    see disboard.metrics.
+
+    The histograms are served in the Prometheus text format on
+    http://METRICS_HOST:METRICS_PORT/metrics (a free port when METRICS_PORT
+    is 0), whose URL is published in the {spider}:metrics:endpoints hash.
+    Every METRICS_FLUSH_INTERVAL seconds, and when the spider closes, the
+    latencies observed since the last flush are added to the {spider}:metrics
+    hash, which crawl.py --cluster-stats summarizes for the whole cluster.
+
+    The extension also records the stages that are best seen from signals:
+    the queue dwell, from the first request_scheduled of a request to the
+    request_reached_downloader of its request to the proxy, and the proxy
+    round trip, from the download latency of the requests to FlareSolverr.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, redis_url, worker_id, host, port, flush_interval):
+        self.crawler = crawler
+        self.redis_url = redis_url
+        self.worker_id = worker_id
+        self.host = host
+        self.port = port
+        self.flush_interval = flush_interval
+        self.recorder = LATENCY
+        self.client = None
+        self.listening_port = None
+        self.flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured("LatencyMetrics is disabled")
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("LatencyMetrics requires REDIS_URL")
+
+        extension = cls(
+            crawler=crawler,
+            redis_url=settings.get("REDIS_URL"),
+            worker_id=get_worker_id(settings),
+            host=settings.get("METRICS_HOST", "0.0.0.0"),
+            port=settings.getint("METRICS_PORT", 0),
+            flush_interval=settings.getfloat("METRICS_FLUSH_INTERVAL", 10),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            extension.request_scheduled, signal=signals.request_scheduled
+        )
+        crawler.signals.connect(
+            extension.request_reached_downloader,
+            signal=signals.request_reached_downloader,
+        )
+        crawler.signals.connect(
+            extension.response_downloaded, signal=signals.response_downloaded
+        )
+        extension.recorder.enabled = True
+        return extension
+
+    def spider_opened(self, spider):
+        from twisted.internet import reactor
+
+        keys = {"spider": spider.name}
+        self.metrics_key = METRICS_KEY % keys
+        self.endpoints_key = ENDPOINTS_KEY % keys
+        self.client = redis.Redis.from_url(self.redis_url)
+
+        site = server.Site(MetricsResource(self.recorder, {"worker": self.worker_id}))
+        try:
+            self.listening_port = reactor.listenTCP(self.port, site, interface=self.host)
+        except CannotListenError as e:
+            self.logger.error(f"Failed to serve the metrics: {e}")
+        else:
+            port = self.listening_port.getHost().port
+            url = f"http://{socket.gethostname()}:{port}/metrics"
+            self.client.hset(self.endpoints_key, self.worker_id, url)
+            self.logger.info(f"Serving the metrics on {url}")
+
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.listening_port is not None:
+            self.listening_port.stopListening()
+        if self.client is not None:
+            self.flush()
+            self.client.hdel(self.endpoints_key, self.worker_id)
+            self.client.close()
+
+    def flush(self) -> None:
+        try:
+            self.recorder.flush(self.client, self.metrics_key)
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to flush the metrics: {e}")
+
+    def request_scheduled(self, request, spider):
+        # Requests to the proxy are scheduled again, and keep the time their
+        # original request was scheduled at. Retried requests start over.
+        original_request = request.meta.get("original_request")
+        if original_request is not None and "scheduled_time" not in request.meta:
+            scheduled_time = original_request.meta.get("scheduled_time", time.time())
+        else:
+            scheduled_time = time.time()
+        request.meta["scheduled_time"] = scheduled_time
+
+    def request_reached_downloader(self, request, spider):
+        scheduled_time = request.meta.get("scheduled_time")
+        if scheduled_time is not None:
+            self.recorder.observe(QUEUE_DWELL, max(0.0, time.time() - scheduled_time))
+
+    def response_downloaded(self, response, request, spider):
+        latency = request.meta.get("download_latency")
+        if request.meta.get("redirected_to_flare_solverr") and latency is not None:
+            self.recorder.observe(PROXY_ROUND_TRIP, latency)
+
+
+EFFICIENCY_ORIGIN_KEY = "%(spider)s:efficiency:origin"
+EFFICIENCY_LISTING_KEY = "%(spider)s:efficiency:listing"
+
+
+class CrawlEfficiency:
+    """
+    This extension measures what each kind of link earns, so that the cost
+    of following the pagination, category and tag links can be weighed
+    against the new guilds they find.
+
+    Requests are tagged with their origin ("seed", "registry", "pagination",
+    "category", "tag", "retry" or "recrawl") and their source URL, see
+    disboard.commons.helpers.get_request_origin. For each origin, and for
+    each listing (the front page, a category or a tag), the extension counts:
+    - solves and solve_time: the requests to FlareSolverr and their latency;
+    - pages: the pages received;
+    - blocked: the pages that were retried because they were blocked by
+      Cloudflare or rate limited, counted for the origin of the blocked
+      request (kept in the "retry_of" meta of its retry);
+    - items and new_guilds: the scraped servers, and those that were new.
+
+    The counters are added every EFFICIENCY_FLUSH_INTERVAL seconds, and when
+    the spider closes, to the {spider}:efficiency:origin and
+    {spider}:efficiency:listing hashes, with one {name}:{counter} field per
+    counter, and the counters of each origin to the efficiency/* stats.
+    crawl.py --efficiency-report prints them.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, redis_url, flush_interval):
+        self.crawler = crawler
+        self.redis_url = redis_url
+        self.flush_interval = flush_interval
+        self.origins: Dict[str, Counter] = defaultdict(Counter)
+        self.listings: Dict[str, Counter] = defaultdict(Counter)
+        self.new_guilds = 0
+        self.client = None
+        self.flush_loop = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("EFFICIENCY_ENABLED"):
+            raise NotConfigured("CrawlEfficiency is disabled")
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("CrawlEfficiency requires REDIS_URL")
+
+        extension = cls(
+            crawler=crawler,
+            redis_url=settings.get("REDIS_URL"),
+            flush_interval=settings.getfloat("EFFICIENCY_FLUSH_INTERVAL", 60),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            extension.request_scheduled, signal=signals.request_scheduled
+        )
+        crawler.signals.connect(
+            extension.response_downloaded, signal=signals.response_downloaded
+        )
+        crawler.signals.connect(
+            extension.response_received, signal=signals.response_received
+        )
+        crawler.signals.connect(extension.item_scraped, signal=signals.item_scraped)
+        return extension
+
+    def spider_opened(self, spider):
+        keys = {"spider": spider.name}
+        self.origin_key = EFFICIENCY_ORIGIN_KEY % keys
+        self.listing_key = EFFICIENCY_LISTING_KEY % keys
+        self.client = redis.Redis.from_url(self.redis_url)
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.client is not None:
+            self.flush()
+            self.client.close()
+
+    def count(self, origin: str, url: str, counter: str, value: float = 1) -> None:
+        self.origins[origin][counter] += value
+        self.listings[get_url_listing(url)][counter] += value
+
+    def request_scheduled(self, request, spider):
+        # Pages blocked by Cloudflare are retried by the spider, and rate
+        # limited ones by the retry middlewares
+        if request.meta.get("origin") == "retry" and "retry_of" in request.meta:
+            self.count(request.meta["retry_of"], request.url, "blocked")
+        elif request.meta.pop("solution_status", None) == 429:
+            original_request = request.meta.get("original_request", request)
+            self.count(
+                get_request_origin(original_request), original_request.url, "blocked"
+            )
+
+    def response_downloaded(self, response, request, spider):
+        if request.meta.get("redirected_to_flare_solverr"):
+            url = request.meta["original_request"].url
+            origin = get_request_origin(request)
+            self.count(origin, url, "solves")
+            self.count(origin, url, "solve_time", request.meta.get("download_latency", 0))
+
+    def response_received(self, response, request, spider):
+        request = response.request or request
+        self.count(get_request_origin(request), request.url, "pages")
+
+    def item_scraped(self, item, response, spider):
+        request = response.request
+        origin = get_request_origin(request)
+        self.count(origin, request.url, "items")
+        # ServersGuildIdPipeline counts the new guilds, and item_scraped is
+        # sent right after the item went through the pipelines
+        new_guilds = self.crawler.stats.get_value("item_scraped_count/new", 0)
+        if new_guilds > self.new_guilds:
+            self.count(origin, request.url, "new_guilds", new_guilds - self.new_guilds)
+        self.new_guilds = new_guilds
+
+    def flush(self) -> None:
+        """
+        Adds the counters to the Redis hashes and to the stats, and resets them.
+        """
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for key, counters in (
+                    (self.origin_key, self.origins),
+                    (self.listing_key, self.listings),
+                ):
+                    for name, counter in counters.items():
+                        for field, value in counter.items():
+                            pipe.hincrbyfloat(key, f"{name}:{field}", value)
+                pipe.execute()
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to flush the crawl efficiency: {e}")
+            return
+
+        for origin, counter in self.origins.items():
+            for field, value in counter.items():
+                self.crawler.stats.inc_value(f"efficiency/{origin}/{field}", value)
+        self.origins.clear()
+        self.listings.clear()
+
+
+def read_efficiency(client, key: str) -> Dict[str, Dict[str, float]]:
+    """
+    Returns the counters of each origin or listing of an efficiency hash,
+    see CrawlEfficiency.
+    """
+    efficiency: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for field, value in client.hgetall(key).items():
+        name, _, counter = field.decode().rpartition(":")
+        efficiency[name][counter] = float(value)
+    return dict(efficiency)
+
+
+class Profiler:
+    """
+    This extension profiles a running worker on demand, when the process
+    receives the PROFILER_SIGNAL signal (SIGUSR1 by default), or when the
+    worker receives the "profile" command, see WorkerControl:
+
+        kill -USR1 <pid>
+        python3 crawl.py -n servers -l de --profile-worker <worker_id>
+
+    For PROFILER_DURATION seconds, the reactor thread is profiled with
+    cProfile and the memory allocations are traced with tracemalloc. Then
+    three files named {spider}-{proxy}-{time} are written to PROFILER_DIR:
+    - .prof: the cProfile stats, to be opened with pstats or snakeviz;
+    - .txt: the functions with the highest cumulative time;
+    - .tracemalloc.txt: the lines that allocated the most memory during
+      the profile, from the difference between two tracemalloc snapshots.
+
+    Nothing is traced until a profile is requested.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, crawler, directory, duration, signal_name, frames, top):
+        self.crawler = crawler
+        self.directory = directory
+        self.duration = duration
+        self.signal_number = getattr(signal, signal_name, None)
+        self.frames = frames
+        self.top = top
+        proxy_url = crawler.settings.get("PROXY_URL") or "no-proxy"
+        proxy_name = urlparse(proxy_url).netloc or proxy_url
+        self.proxy_name = re.sub(r"[^\w.-]", "_", proxy_name)
+        self.spider = None
+        self.profile = None
+        self.snapshot = None
+        self.started_tracemalloc = False
+        self.stop_call = None
+        self.previous_handler = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("PROFILER_ENABLED"):
+            raise NotConfigured("Profiler is disabled")
+
+        extension = cls(
+            crawler=crawler,
+            directory=settings.get("PROFILER_DIR", "profiles"),
+            duration=settings.getfloat("PROFILER_DURATION", 30),
+            signal_name=settings.get("PROFILER_SIGNAL", "SIGUSR1"),
+            frames=settings.getint("PROFILER_TRACEMALLOC_FRAMES", 10),
+            top=settings.getint("PROFILER_TOP", 50),
+        )
+        crawler.signals.connect(extension.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(extension.start, signal=profile_requested)
+        return extension
+
+    def spider_opened(self, spider):
+        self.spider = spider
+        if self.signal_number is None:
+            self.logger.warning("PROFILER_SIGNAL is not available on this platform")
+            return
+        try:
+            self.previous_handler = signal.signal(
+                self.signal_number, self.signal_handler
+            )
+        except ValueError:
+            # Signal handlers can only be set from the main thread
+            self.logger.warning("Failed to set the handler of PROFILER_SIGNAL")
+
+    def spider_closed(self, spider):
+        if self.profile is not None:
+            self.stop()
+        if self.previous_handler is not None:
+            signal.signal(self.signal_number, self.previous_handler)
+
+    def signal_handler(self, signum, frame):
+        from twisted.internet import reactor
+
+        # Start from the reactor, not from the middle of the interrupted code
+        reactor.callFromThread(self.start)
+
+    def start(self) -> None:
+        """
+        Starts a profile, that stops after PROFILER_DURATION seconds (or
+        when stop() is called if the duration is 0).
+        """
+        if self.profile is not None:
+            self.logger.warning("A profile is already running")
+            return
+
+        self.logger.info(f"Profiling for {self.duration} seconds")
+        self.started_tracemalloc = not tracemalloc.is_tracing()
+        if self.started_tracemalloc:
+            tracemalloc.start(self.frames)
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+        if self.duration > 0:
+            from twisted.internet import reactor
+
+            self.stop_call = reactor.callLater(self.duration, self.stop)
+
+    def stop(self) -> Optional[str]:
+        """
+        Stops the profile and writes its files. Returns their path, without
+        the extensions.
+        """
+        if self.profile is None:
+            return None
+
+        self.profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        if self.stop_call is not None and self.stop_call.active():
+            self.stop_call.cancel()
+
+        spider_name = self.spider.name if self.spider else "spider"
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(
+            self.directory, f"{spider_name}-{self.proxy_name}-{timestamp}"
+        )
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.profile.dump_stats(f"{path}.prof")
+            with open(f"{path}.txt", "w") as f:
+                stats = pstats.Stats(self.profile, stream=f)
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            with open(f"{path}.tracemalloc.txt", "w") as f:
+                for diff in snapshot.compare_to(self.snapshot, "lineno")[: self.top]:
+                    f.write(f"{diff}\n")
+        except OSError as e:
+            self.logger.error(f"Failed to write the profile: {e}")
+            path = None
+        else:
+            self.crawler.stats.inc_value("profiler/profiles")
+            self.logger.info(f"Wrote the profile to {path}.*")
+        finally:
+            self.profile = None
+            self.snapshot = None
+            self.stop_call = None
+
+        return path
@@ -0,0 +1,208 @@
+"""
+This module contains the capture of failing responses.
+
+Instead of logging the body of every blocked, empty or failed response,
+the spider and the middlewares hand them to a FailureCapture, which keeps
+a sample of them on the local disk, grouped by failure class:
+- blocked: the page was blocked by Cloudflare;
+- not_listing: the page is not a server listing;
+- empty_listing: the server listing has no servers;
+- invalid_json: the FlareSolverr response is not valid JSON;
+- proxy_error: FlareSolverr kept answering with an error status.
+
+Each captured response is stored as a zstd-compressed JSON file with its
+url, status, failure class, capture time and body, in
+FAILURE_CAPTURE_DIR/{failure}/{time in ms}-{n}-{fp[:16]}.zst. The log lines
+refer to that file, which read_capture decodes.
+"""
+
+import json
+import os
+import random
+import time
+import zstandard
+
+from collections import deque
+from itertools import count
+from disboard.commons.helpers import blocked_by_cloudflare, is_server_listing
+from disboard.dupefilters import request_fingerprint
+from logging import getLogger
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from typing import Deque, Dict, Optional, Tuple
+
+
+BLOCKED = "blocked"
+NOT_LISTING = "not_listing"
+EMPTY_LISTING = "empty_listing"
+INVALID_JSON = "invalid_json"
+PROXY_ERROR = "proxy_error"
+
+
+def classify_empty_response(response: Response) -> str:
+    """
+    Returns the failure class of a listing page without servers.
+    """
+    try:
+        if blocked_by_cloudflare(response):
+            return BLOCKED
+        if not is_server_listing(response):
+            return NOT_LISTING
+    except (AttributeError, ValueError):
+        # Not an HTML page, or a page without a title
+        return NOT_LISTING
+    return EMPTY_LISTING
+
+
+def capture_note(path: Optional[str]) -> str:
+    """
+    Returns the reference to a captured response to append to a log line.
+    """
+    return "" if path is None else f" (captured in {path})"
+
+
+def read_capture(path: str) -> dict:
+    """
+    Returns the url, status, failure, time and body of a captured response.
+    """
+    with open(path, "rb") as f:
+        return json.loads(zstandard.ZstdDecompressor().decompress(f.read()))
+
+
+class FailureCapture:
+    """
+    A rate-limited, sampled store of failing responses.
+
+    A failing response is captured with probability FAILURE_CAPTURE_SAMPLE_RATE,
+    and at most FAILURE_CAPTURE_MAX_PER_MINUTE responses of each failure class
+    are captured per minute, so that a block storm costs a few random draws
+    rather than the formatting of every page. When the captures grow over
+    FAILURE_CAPTURE_MAX_SIZE bytes, the oldest ones are deleted.
+
+    The components of a worker share one FailureCapture per directory, see
+    from_settings, so that the size bound holds for the whole process.
+    """
+
+    logger = getLogger(__name__)
+
+    _instances: Dict[str, "FailureCapture"] = {}
+
+    def __init__(
+        self,
+        directory: str,
+        enabled: bool = True,
+        sample_rate: float = 0.1,
+        max_per_minute: float = 6,
+        max_size: int = 100 * 1024**2,
+    ):
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_per_minute = max_per_minute
+        self.max_size = max_size
+        self.compressor = zstandard.ZstdCompressor(level=3)
+        # Token bucket of each failure class: (tokens, time of the last refill)
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.seen: Dict[str, int] = {}
+        self.captured: Dict[str, int] = {}
+        self.files: Optional[Deque[Tuple[str, int]]] = None
+        self.size = 0
+        self._ids = count()
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "FailureCapture":
+        directory = settings.get("FAILURE_CAPTURE_DIR", "failures")
+        if directory not in cls._instances:
+            cls._instances[directory] = cls(
+                directory=directory,
+                enabled=settings.getbool("FAILURE_CAPTURE_ENABLED"),
+                sample_rate=settings.getfloat("FAILURE_CAPTURE_SAMPLE_RATE", 0.1),
+                max_per_minute=settings.getfloat("FAILURE_CAPTURE_MAX_PER_MINUTE", 6),
+                max_size=settings.getint("FAILURE_CAPTURE_MAX_SIZE", 100 * 1024**2),
+            )
+        return cls._instances[directory]
+
+    def _take_token(self, failure: str) -> bool:
+        now = time.monotonic()
+        tokens, last = self.buckets.get(failure, (self.max_per_minute, now))
+        tokens += (now - last) * self.max_per_minute / 60
+        tokens = min(self.max_per_minute, tokens)
+        if tokens < 1:
+            self.buckets[failure] = (tokens, now)
+            return False
+        self.buckets[failure] = (tokens - 1, now)
+        return True
+
+    def _load_files(self) -> Deque[Tuple[str, int]]:
+        """
+        Returns the captured files from the oldest to the newest, with their
+        size, and sums up the size of the store.
+        """
+        entries = []
+        if os.path.isdir(self.directory):
+            entries = [
+                entry
+                for directory in os.scandir(self.directory)
+                if directory.is_dir()
+                for entry in os.scandir(directory.path)
+                if entry.name.endswith(".zst")
+            ]
+        entries.sort(key=lambda entry: entry.name)
+        self.size = sum(entry.stat().st_size for entry in entries)
+        return deque((entry.path, entry.stat().st_size) for entry in entries)
+
+    def _evict(self, size: int) -> None:
+        while self.files and self.size + size > self.max_size:
+            path, file_size = self.files.popleft()
+            self.size -= file_size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def capture(
+        self, failure: str, response: Response, request: Optional[Request] = None
+    ) -> Optional[str]:
+        """
+        Stores the response if it is sampled, and returns the path of the
+        captured file, or None if it was not captured.
+        """
+        self.seen[failure] = self.seen.get(failure, 0) + 1
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._take_token(failure):
+            return None
+
+        request = request or response.request or Request(response.url)
+        now = time.time()
+        fp = request_fingerprint(request)
+        # Sorted by capture time, and unique within the same millisecond
+        name = f"{int(now * 1000)}-{next(self._ids) % 10**6:06d}-{fp[:16]}.zst"
+        path = os.path.join(self.directory, failure, name)
+        data = self.compressor.compress(
+            json.dumps(
+                {
+                    "url": response.url,
+                    "status": response.status,
+                    "failure": failure,
+                    "time": now,
+                    "body": response.body.decode("utf-8", errors="replace"),
+                }
+            ).encode()
+        )
+
+        if self.files is None:
+            self.files = self._load_files()
+        self._evict(len(data))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        except OSError as e:
+            self.logger.warning(f"Failed to capture {response.url}: {e}")
+            return None
+
+        self.files.append((path, len(data)))
+        self.size += len(data)
+        self.captured[failure] = self.captured.get(failure, 0) + 1
+        return path
@@ -0,0 +1,239 @@
+"""
+This module contains the download handler that hedges the requests to the
+FlareSolverr proxy servers.
+
+FlareSolverr solve times have a long tail: a stuck browser can hold a
+download slot until DOWNLOAD_TIMEOUT. When hedging is enabled, a request
+that has not completed after the HEDGE_PERCENTILE percentile of the recent
+solve latencies is sent to a second healthy proxy as well. The first
+response wins and the other download is cancelled.
+"""
+
+import random
+import time
+import redis
+
+from collections import deque
+from disboard.cluster import get_node_id, pooled_proxy_urls
+from disboard.workers import is_proxy_healthy
+from logging import getLogger
+from scrapy import signals
+from scrapy.core.downloader.handlers.http11 import HTTP11DownloadHandler
+from twisted.internet import defer, task, threads
+from twisted.python.failure import Failure
+from typing import Deque, List, Optional
+
+
+class HedgedDownloadHandler(HTTP11DownloadHandler):
+    """
+    This download handler downloads http(s) requests like Scrapy's default
+    handler, and hedges the requests redirected to FlareSolverr (see
+    disboard.middlewares.FlareSolverrRedirectMiddleware) if HEDGE_ENABLED.
+
+    The hedge delay is the HEDGE_PERCENTILE percentile of the last
+    HEDGE_WINDOW solve latencies, and at least HEDGE_MIN_DELAY seconds.
+    Requests are not hedged until HEDGE_MIN_SAMPLES latencies are known, and
+    at most HEDGE_MAX_RATE of the requests are hedged.
+
+    The hedges are sent to the proxies of HEDGE_PROXY_URLS, or to the proxies
+    of the cluster in {spider}:proxies, that answer their health check. The
+    healthy proxies are refreshed every HEDGE_REFRESH_INTERVAL seconds, and
+    a proxy is left out until the next refresh when a hedge to it fails.
+
+    The hedges are reported in the hedge/requests, hedge/wins (the hedge
+    responded first), hedge/losses (the original request responded first)
+    and hedge/capped (not hedged because of HEDGE_MAX_RATE) stats.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, settings, crawler=None):
+        super().__init__(settings, crawler)
+        from twisted.internet import reactor
+
+        self.clock = reactor
+        self.enabled = settings.getbool("HEDGE_ENABLED")
+        self.stats = crawler.stats if crawler else None
+        self.redis_url = settings.get("REDIS_URL")
+        self.proxy_urls = [url for url in settings.getlist("HEDGE_PROXY_URLS") if url]
+        self.percentile = settings.getfloat("HEDGE_PERCENTILE", 95)
+        self.min_delay = settings.getfloat("HEDGE_MIN_DELAY", 5)
+        self.min_samples = settings.getint("HEDGE_MIN_SAMPLES", 20)
+        self.max_rate = settings.getfloat("HEDGE_MAX_RATE", 0.1)
+        self.refresh_interval = settings.getfloat("HEDGE_REFRESH_INTERVAL", 60)
+
+        window = settings.getint("HEDGE_WINDOW", 200)
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.healthy_proxies: List[str] = []
+        self.n_of_requests = 0
+        self.n_of_hedges = 0
+        self.refresh_loop = None
+
+        if self.enabled and crawler is not None:
+            crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+            crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+
+    def spider_opened(self, spider):
+        self.spider_name = spider.name
+        self.refresh_loop = task.LoopingCall(self.refresh_proxies)
+        self.refresh_loop.start(self.refresh_interval, now=True)
+
+    def spider_closed(self, spider):
+        if self.refresh_loop and self.refresh_loop.running:
+            self.refresh_loop.stop()
+
+    def refresh_proxies(self) -> defer.Deferred:
+        """
+        Updates the healthy proxies from a thread, as the health checks block.
+        """
+        d = threads.deferToThread(self.find_healthy_proxies)
+        d.addCallback(self._set_healthy_proxies)
+        d.addErrback(
+            lambda failure: self.logger.error(
+                f"Failed to refresh the hedge proxies: {failure.value}"
+            )
+        )
+        return d
+
+    def _set_healthy_proxies(self, proxy_urls: List[str]) -> None:
+        self.healthy_proxies = proxy_urls
+
+    def find_healthy_proxies(self) -> List[str]:
+        proxy_urls = self.proxy_urls
+        if not proxy_urls and self.redis_url:
+            client = redis.Redis.from_url(self.redis_url)
+            try:
+                proxy_urls = pooled_proxy_urls(
+                    client, self.spider_name, get_node_id()
+                )
+            finally:
+                client.close()
+        return [url for url in proxy_urls if is_proxy_healthy(url, timeout=5)]
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Returns the delay after which a request is hedged, or None if there
+        are not enough latencies yet.
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(self.percentile / 100 * len(latencies)))
+        return max(latencies[index], self.min_delay)
+
+    def pick_hedge_proxy(self, proxy_url: str) -> Optional[str]:
+        candidates = [url for url in self.healthy_proxies if url != proxy_url]
+        return random.choice(candidates) if candidates else None
+
+    def download_request(self, request, spider):
+        if not self.enabled or not request.meta.get("redirected_to_flare_solverr"):
+            return super().download_request(request, spider)
+
+        self.n_of_requests += 1
+        delay = self.hedge_delay()
+        started = time.time()
+        if delay is None:
+            d = super().download_request(request, spider)
+            d.addCallback(self.record_latency, started)
+            return d
+        return HedgedDownload(self, request, spider, started).start(delay)
+
+    def download_attempt(self, request, spider) -> defer.Deferred:
+        return super().download_request(request, spider)
+
+    def record_latency(self, response, started: float):
+        self.latencies.append(time.time() - started)
+        return response
+
+    def hedge_allowed(self) -> bool:
+        if self.n_of_hedges >= self.max_rate * self.n_of_requests:
+            self.inc_stat("hedge/capped")
+            return False
+        return True
+
+    def drop_proxy(self, proxy_url: str) -> None:
+        self.healthy_proxies = [
+            url for url in self.healthy_proxies if url != proxy_url
+        ]
+
+    def inc_stat(self, key: str) -> None:
+        if self.stats is not None:
+            self.stats.inc_value(key)
+
+
+class HedgedDownload:
+    """
+    A request to the FlareSolverr proxy that is sent to a second proxy if
+    it has not completed after a delay. The first response wins, and the
+    other download is cancelled. A failed download waits for the other one,
+    if any, before the failure is returned.
+    """
+
+    def __init__(self, handler: HedgedDownloadHandler, request, spider, started):
+        self.handler = handler
+        self.request = request
+        self.spider = spider
+        self.started = started
+        self.hedge_request = None
+        self.downloads = {}
+        self.timer = None
+        self.done = False
+        self.result = defer.Deferred(self.cancel)
+
+    def start(self, delay: float) -> defer.Deferred:
+        self.timer = self.handler.clock.callLater(delay, self.hedge)
+        self.download(self.request)
+        return self.result
+
+    def download(self, attempt) -> None:
+        d = self.handler.download_attempt(attempt, self.spider)
+        self.downloads[id(attempt)] = d
+        d.addBoth(self.finish, attempt)
+
+    def hedge(self) -> None:
+        if self.done or not self.handler.hedge_allowed():
+            return
+        proxy_url = self.handler.pick_hedge_proxy(self.request.url)
+        if proxy_url is None:
+            return
+
+        self.handler.n_of_hedges += 1
+        self.handler.inc_stat("hedge/requests")
+        self.hedge_request = self.request.replace(url=proxy_url)
+        self.download(self.hedge_request)
+
+    def stop(self) -> None:
+        self.done = True
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        for d in list(self.downloads.values()):
+            d.cancel()
+
+    def cancel(self, _) -> None:
+        self.stop()
+
+    def finish(self, outcome, attempt) -> None:
+        self.downloads.pop(id(attempt), None)
+        if self.done:
+            # The loser, or a download of a cancelled request
+            return None
+
+        is_hedge = attempt is self.hedge_request
+        if isinstance(outcome, Failure):
+            if is_hedge:
+                self.handler.drop_proxy(attempt.url)
+            if self.downloads:
+                return None
+            self.stop()
+            self.result.errback(outcome)
+            return None
+
+        self.stop()
+        self.handler.record_latency(outcome, self.started)
+        if self.hedge_request is not None:
+            self.handler.inc_stat("hedge/wins" if is_hedge else "hedge/losses")
+        if is_hedge:
+            self.request.meta["download_latency"] = time.time() - self.started
+            self.request.meta["hedge_proxy"] = attempt.url
+        self.result.callback(outcome)
+        return None
@@ -3,29 +3,123 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/items.html
 
-from typing import Dict, List
-import scrapy
+import json
+import sys
 
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Tuple
 
-class DisboardServerItem(scrapy.Item):
+
+Tag = Tuple[str, str]
+
+
+@dataclass(frozen=True)
+class DisboardServerItem:
     """
     This item represents a server scraped from Disboard.
 
+    It is a frozen dataclass with __slots__ rather than a scrapy.Item, so
+    that it holds no per-instance dict. Scrapy handles it through
+    itemadapter, and item["field"] is kept for the pipelines. Like a
+    scrapy.Item, it can be copied and pickled.
+
     Attributes:
         scrape_time (float): Timestamp of the response when the item was scraped.
         platform_link (str): The URL of the server on Disboard.
         guild_id (str): The Discord guild ID of the server.
         server_name (str): The name of the server.
         server_description (str): The description of the server.
-        tags (List[Dict[str, str]]): A list of dictionaries associating each
-            data-id (a Disboard's internal key for enumerating tags) to its
-            corresponding tag name.
-    """
-
-    scrape_time: float = scrapy.Field()
-    platform_link: str = scrapy.Field()
-    guild_id: str = scrapy.Field()
-    server_name: str = scrapy.Field()
-    server_description: str = scrapy.Field()
-    tags: List[Dict[str, str]] = scrapy.Field()
-    category: str = scrapy.Field()
+        tags (Tuple[Tuple[str, str], ...]): The (data-id, tag name) pairs of
+            the server, where data-id is a Disboard's internal key for
+            enumerating tags. The pairs are interned, see intern_tag.
+        category (str): The interned category of the server.
+    """
+
+    __slots__ = (
+        "scrape_time",
+        "platform_link",
+        "guild_id",
+        "server_name",
+        "server_description",
+        "tags",
+        "category",
+    )
+
+    scrape_time: float
+    platform_link: str
+    guild_id: str
+    server_name: str
+    server_description: str
+    tags: Tuple[Tag, ...]
+    category: str
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __getstate__(self) -> Tuple[Any, ...]:
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        # The instance is frozen, and the tags and the category of a copy
+        # are interned again
+        state = dict(zip(self.__slots__, state))
+        state["tags"] = tuple(
+            intern_tag(tag_id, name) for tag_id, name in state["tags"]
+        )
+        state["category"] = sys.intern(state["category"])
+        for field, value in state.items():
+            object.__setattr__(self, field, value)
+
+    def tags_as_json(self) -> List[Dict[str, str]]:
+        """
+        Returns the tags in their stored JSON shape: a list of dictionaries
+        associating each data-id to its tag name.
+        """
+        return [{tag_id: name} for tag_id, name in self.tags]
+
+
+# The (data-id, tag name) pairs seen by the process
+_TAGS: Dict[Tag, Tag] = {}
+
+
+class _TagJson(dict):
+    """
+    The JSON text of the interned tags, encoded on the fly for the others.
+    """
+
+    def __missing__(self, tag: Tag) -> str:
+        return json.dumps({tag[0]: tag[1]})
+
+
+_TAG_JSON: Dict[Tag, str] = _TagJson()
+
+
+def intern_tag(tag_id: str, name: str) -> Tag:
+    """
+    Returns the shared instance of the (data-id, tag name) pair. The same few
+    thousand tags are listed by all the servers, so each pair and its strings
+    are kept only once per process.
+    """
+    tag = _TAGS.get((tag_id, name))
+    if tag is None:
+        tag = _TAGS[tag] = (sys.intern(tag_id), sys.intern(name))
+        _TAG_JSON[tag] = json.dumps({tag[0]: tag[1]})
+    return tag
+
+
+def dump_tags(tags: Iterable[Tag]) -> str:
+    """
+    Returns the tags encoded in their stored JSON shape, the same as
+    json.dumps(item.tags_as_json()). The JSON text of each interned tag is
+    encoded only once per process.
+    """
+    return "[" + ", ".join(map(_TAG_JSON.__getitem__, tags)) + "]"
+
+
+def make_tags(data_ids: Iterable[str], names: Iterable[str]) -> Tuple[Tag, ...]:
+    """
+    Returns the interned (data-id, tag name) pairs of a server.
+    """
+    return tuple(intern_tag(tag_id, name) for tag_id, name in zip(data_ids, names))
@@ -0,0 +1,322 @@
+"""
+This module contains the latency histograms of the stages of the crawl:
+- queue_dwell: from the scheduling of a request to its download;
+- proxy_round_trip: the request to the FlareSolverr proxy, solve included;
+- json_decode: the decoding of the proxy's response, see
+  disboard.middlewares.FlareSolverrRedirectMiddleware;
+- parse: the spider's callback, see disboard.middlewares.ParseLatencyMiddleware;
+- pipeline/{name}: the process_item of each item pipeline;
+- redis: each Redis command or pipeline sent through a TimedRedis client.
+
+The components of a worker record their latencies in the process-wide
+LATENCY recorder. The disboard.extensions.LatencyMetrics extension serves
+it on a Prometheus HTTP endpoint and adds it periodically to the
+{spider}:metrics hash, which holds the histograms of the whole cluster.
+
+LATENCY is disabled until LatencyMetrics enables it (METRICS_ENABLED), and
+a disabled recorder doesn't even read the clock, so that the timed
+components cost nothing when the metrics are not exported.
+"""
+
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from redis import Redis
+from redis.client import Pipeline
+from twisted.web import resource
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+METRICS_KEY = "%(spider)s:metrics"
+ENDPOINTS_KEY = "%(spider)s:metrics:endpoints"
+
+QUEUE_DWELL = "queue_dwell"
+PROXY_ROUND_TRIP = "proxy_round_trip"
+JSON_DECODE = "json_decode"
+PARSE = "parse"
+PIPELINE = "pipeline/%s"
+REDIS = "redis"
+
+# Upper bounds of the buckets, in seconds, from Redis calls to proxy solves
+BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+)
+
+
+class Histogram:
+    """
+    A histogram with fixed buckets. counts[i] is the number of values in
+    (BUCKETS[i - 1], BUCKETS[i]], and the last count is the +Inf bucket.
+    """
+
+    def __init__(self, counts: Optional[List[int]] = None, total: float = 0.0):
+        self.counts = counts or [0] * (len(BUCKETS) + 1)
+        self.sum = total
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    def copy(self) -> "Histogram":
+        return Histogram(list(self.counts), self.sum)
+
+    def __sub__(self, other: "Histogram") -> "Histogram":
+        counts = [a - b for a, b in zip(self.counts, other.counts)]
+        return Histogram(counts, self.sum - other.sum)
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns an estimate of the q-quantile, with 0 <= q <= 1, by linear
+        interpolation within its bucket like Prometheus' histogram_quantile.
+        """
+        count = self.count
+        if count == 0:
+            return 0.0
+
+        rank = q * count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-1]
+
+
+class LatencyRecorder:
+    """
+    Keeps one histogram per stage, if it is enabled.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.histograms: Dict[str, Histogram] = {}
+        # Histograms at the last call to flush()
+        self.flushed: Dict[str, Histogram] = {}
+
+    def observe(self, stage: str, seconds: float) -> None:
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def time(self, stage: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._time(stage)
+
+    @contextmanager
+    def _time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def time_iterable(self, stage: str, iterable: Iterable) -> Iterable:
+        """
+        Yields the values of the iterable, timing only the time spent in
+        the iterable, not in the consumer.
+        """
+        if not self.enabled:
+            return iterable
+        return self._time_iterable(stage, iterable)
+
+    def _time_iterable(self, stage: str, iterable: Iterable) -> Iterator:
+        iterator = iter(iterable)
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    value = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield value
+        finally:
+            self.observe(stage, elapsed)
+
+    def pending(self) -> Dict[str, Histogram]:
+        """
+        Returns what was observed since the last call to flush().
+        """
+        pending = {}
+        for stage, histogram in self.histograms.items():
+            flushed = self.flushed.get(stage)
+            delta = histogram - flushed if flushed else histogram.copy()
+            if delta.count:
+                pending[stage] = delta
+        return pending
+
+    def flush(self, client: Redis, key: str) -> None:
+        """
+        Adds what was observed since the last flush to the histograms of the
+        Redis hash, with one {stage}:{bucket index} field per bucket and a
+        {stage}:sum field.
+        """
+        pending = self.pending()
+        if not pending:
+            return
+
+        with client.pipeline(transaction=False) as pipe:
+            for stage, histogram in pending.items():
+                for i, count in enumerate(histogram.counts):
+                    if count:
+                        pipe.hincrby(key, f"{stage}:{i}", count)
+                pipe.hincrbyfloat(key, f"{stage}:sum", histogram.sum)
+            pipe.execute()
+
+        for stage, histogram in pending.items():
+            flushed = self.flushed.get(stage)
+            self.flushed[stage] = (
+                Histogram(
+                    [a + b for a, b in zip(flushed.counts, histogram.counts)],
+                    flushed.sum + histogram.sum,
+                )
+                if flushed
+                else histogram
+            )
+
+    def render(self, labels: Optional[Dict[str, str]] = None) -> str:
+        """
+        Returns the histograms in the Prometheus text exposition format.
+        """
+        name = "disboard_stage_latency_seconds"
+        extra = "".join(f',{key}="{value}"' for key, value in (labels or {}).items())
+        lines = [
+            f"# HELP {name} Latency of the stages of the crawl.",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(
+                    f'{name}_bucket{{stage="{stage}"{extra},le="{bound}"}} {cumulative}'
+                )
+            lines.append(f'{name}_sum{{stage="{stage}"{extra}}} {histogram.sum}')
+            lines.append(f'{name}_count{{stage="{stage}"{extra}}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+# The recorder of the process, shared by all its components, enabled by
+# disboard.extensions.LatencyMetrics
+LATENCY = LatencyRecorder(enabled=False)
+
+
+def observe_latency(stage: str) -> Callable:
+    """
+    Decorates a function to record its latency in the given stage.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not LATENCY.enabled:
+                return function(*args, **kwargs)
+            with LATENCY.time(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def read_cluster_histograms(client: Redis, spider_name: str) -> Dict[str, Histogram]:
+    """
+    Returns the histograms aggregated over all the workers of the spider.
+    """
+    histograms: Dict[str, Histogram] = {}
+    key = METRICS_KEY % {"spider": spider_name}
+    for field, value in client.hgetall(key).items():
+        stage, _, bucket = field.decode().rpartition(":")
+        histogram = histograms.setdefault(stage, Histogram())
+        if bucket == "sum":
+            histogram.sum = float(value)
+        else:
+            histogram.counts[int(bucket)] = int(value)
+    return histograms
+
+
+def summarize(histogram: Histogram) -> Tuple[int, float, float, float, float]:
+    """
+    Returns the count, mean, p50, p90 and p99 of the histogram.
+    """
+    count = histogram.count
+    mean = histogram.sum / count if count else 0.0
+    return (
+        count,
+        mean,
+        histogram.quantile(0.5),
+        histogram.quantile(0.9),
+        histogram.quantile(0.99),
+    )
+
+
+class TimedPipeline(Pipeline):
+    def execute(self, raise_on_error=True):
+        if not LATENCY.enabled:
+            return super().execute(raise_on_error)
+        with LATENCY.time(REDIS):
+            return super().execute(raise_on_error)
+
+
+class TimedRedis(Redis):
+    """
+    A Redis client that records the latency of its commands in the redis
+    stage. A pipeline is recorded once, when it is executed.
+    """
+
+    def execute_command(self, *args, **options):
+        if not LATENCY.enabled:
+            return super().execute_command(*args, **options)
+        with LATENCY.time(REDIS):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None) -> TimedPipeline:
+        return TimedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class MetricsResource(resource.Resource):
+    """
+    Serves the rendered histograms of a recorder over HTTP.
+    """
+
+    isLeaf = True
+
+    def __init__(self, recorder: LatencyRecorder, labels: Dict[str, str]):
+        super().__init__()
+        self.recorder = recorder
+        self.labels = labels
+
+    def render_GET(self, request):
+        request.setHeader(b"Content-Type", b"text/plain; version=0.0.4")
+        return self.recorder.render(self.labels).encode("utf-8")
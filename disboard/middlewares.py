@@ -4,11 +4,30 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 import json
+import os
+import time
+import redis
+import zstandard
+from disboard.commons.helpers import (
+    blocked_by_cloudflare,
+    get_request_origin,
+    get_response_language,
+    get_url_category,
+    get_url_tag,
+)
+from disboard.dupefilters import request_fingerprint
+from disboard.failures import INVALID_JSON, PROXY_ERROR, FailureCapture, capture_note
+from disboard.metrics import JSON_DECODE, LATENCY, PARSE
+from disboard.registry import CATEGORIES_KEY, TAG_NAMES_KEY, TAGS_KEY
+from email.utils import formatdate
+from itemadapter import is_item
 from scrapy import signals
 from scrapy.downloadermiddlewares.retry import RetryMiddleware
-from scrapy.exceptions import IgnoreRequest
+from scrapy.exceptions import IgnoreRequest, NotConfigured
 from scrapy.http import HtmlResponse, Request
 from logging import getLogger
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urljoin
 
 
 class FlareSolverrGetSolutionStatusMiddleware:
@@ -45,6 +64,8 @@ class FlareSolverrGetSolutionStatusMiddleware:
         for status_code in self.retry_http_codes:
             if str(status_code) in response.css("title::text").get():
                 self.logger.warning(f"Non 200 response: <{status_code} {response.url}>")
+                # Kept in the meta of the retries, see CrawlEfficiency
+                request.meta["solution_status"] = status_code
                 return response.replace(status=status_code)
 
         return response
@@ -64,6 +85,7 @@ class FlareSolverrRedirectMiddleware:
         self.retry_http_codes = set(
             int(x) for x in settings.getlist("RETRY_HTTP_CODES")
         )
+        self.failure_capture = FailureCapture.from_settings(settings)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -80,9 +102,13 @@ class FlareSolverrRedirectMiddleware:
         if request.meta.get("redirected_to_flare_solverr"):
             return None
 
+        # The request to the proxy must not be dropped by the offsite
+        # middleware, and the original request already went through the
+        # duplicates filter
         new_request = request.replace(
             url=self.proxy_url,
             method="POST",
+            dont_filter=True,
             headers={"Content-Type": "application/json"},
             body=json.dumps(
                 {
@@ -112,14 +138,18 @@ class FlareSolverrRedirectMiddleware:
             return response
 
         try:
-            solution_response = json.loads(response.body).get("solution")
+            with LATENCY.time(JSON_DECODE):
+                solution_response = json.loads(response.body).get("solution")
             original_request = request.meta["original_request"]
 
         except json.JSONDecodeError:
+            path = self.failure_capture.capture(
+                INVALID_JSON, response, request.meta.get("original_request")
+            )
             self.logger.error(
                 f"Failed to parse JSON response: <{response.status} {response.url}>"
+                f"{capture_note(path)}"
             )
-            self.logger.debug(f"Response body: {response.body}")
             raise IgnoreRequest(
                 f"Failed to parse JSON response: <{response.status} {response.url}>"
             )
@@ -142,6 +172,180 @@ class FlareSolverrRedirectMiddleware:
         return html_response
 
 
+class FlareSolverrCacheMiddleware:
+    """
+    This middleware stores the pages solved by the FlareSolverr proxy server
+    on the local disk, and serves them again instead of solving them.
+
+    Each page is stored as a zstd-compressed JSON file with its url, status,
+    Date header and body, in FLARESOLVERR_CACHE_DIR/{fp[:2]}/{fp}.zst, where
+    fp is the fingerprint of the original request. Only the pages with a 200 status
+    that were not blocked by Cloudflare are stored.
+
+    Cached pages expire after FLARESOLVERR_CACHE_TTL seconds (0 means never).
+    When the cache grows over FLARESOLVERR_CACHE_MAX_SIZE bytes, the least
+    recently used pages are evicted.
+
+    In replay mode (FLARESOLVERR_CACHE_REPLAY), the whole crawl is served
+    from the cache, regardless of the TTL, and the requests for pages that
+    are not cached are ignored, so that no proxy is needed at all.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(self, cache_dir, stats, ttl=0, max_size=0, replay=False):
+        self.cache_dir = cache_dir
+        self.stats = stats
+        self.ttl = ttl
+        self.max_size = max_size
+        self.replay = replay
+        self.size = None
+        self.compressor = zstandard.ZstdCompressor(level=3)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        replay = settings.getbool("FLARESOLVERR_CACHE_REPLAY")
+        if not settings.getbool("FLARESOLVERR_CACHE_ENABLED") and not replay:
+            raise NotConfigured("FlareSolverrCacheMiddleware is disabled")
+
+        return cls(
+            cache_dir=settings.get("FLARESOLVERR_CACHE_DIR", ".flaresolverr_cache"),
+            stats=crawler.stats,
+            ttl=settings.getfloat("FLARESOLVERR_CACHE_TTL", 0),
+            max_size=settings.getint("FLARESOLVERR_CACHE_MAX_SIZE", 0),
+            replay=replay,
+        )
+
+    def _path(self, request) -> str:
+        fp = request_fingerprint(request)
+        return os.path.join(self.cache_dir, fp[:2], f"{fp}.zst")
+
+    def _cached_files(self) -> List[os.DirEntry]:
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [
+            entry
+            for directory in os.scandir(self.cache_dir)
+            if directory.is_dir()
+            for entry in os.scandir(directory.path)
+            if entry.name.endswith(".zst")
+        ]
+
+    def load(self, request) -> Optional[HtmlResponse]:
+        """
+        Returns the cached page of the request, or None if it is not cached
+        or if it expired.
+        """
+        path = self._path(request)
+        try:
+            stored = os.path.getmtime(path)
+            if not self.replay and self.ttl and time.time() - stored > self.ttl:
+                return None
+            with open(path, "rb") as f:
+                page = json.loads(self.decompressor.decompress(f.read()))
+            # Mark the page as recently used for the evictions
+            os.utime(path, (time.time(), stored))
+        except (OSError, ValueError, zstandard.ZstdError):
+            return None
+
+        # The scrape time of the items is read from the Date header. The
+        # pages stored without it were solved when their file was written.
+        date = page.get("date") or formatdate(stored, usegmt=True)
+        return HtmlResponse(
+            url=page["url"],
+            status=page["status"],
+            headers={"Date": date},
+            body=page["body"],
+            request=request,
+            encoding="utf-8",
+            flags=["cached"],
+        )
+
+    def store(self, request, response) -> None:
+        """
+        Stores the solved page of the request.
+        """
+        path = self._path(request)
+        date = response.headers.get("Date")
+        data = self.compressor.compress(
+            json.dumps(
+                {
+                    "url": response.url,
+                    "status": response.status,
+                    "date": date.decode() if date else None,
+                    "body": response.text,
+                }
+            ).encode("utf-8")
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so that readers never see half a page
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.stats.inc_value("flaresolverr_cache/store")
+
+        if self.max_size:
+            if self.size is None:
+                self.size = sum(entry.stat().st_size for entry in self._cached_files())
+            else:
+                self.size += len(data)
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used pages until the cache takes less
+        than 90% of FLARESOLVERR_CACHE_MAX_SIZE.
+        """
+        entries = []
+        for entry in self._cached_files():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.size <= 0.9 * self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.stats.inc_value("flaresolverr_cache/evicted")
+
+    def process_request(self, request, spider):
+        if request.meta.get("redirected_to_flare_solverr"):
+            return None
+
+        response = self.load(request)
+        if response is not None:
+            self.stats.inc_value("flaresolverr_cache/hit")
+            return response
+
+        self.stats.inc_value("flaresolverr_cache/miss")
+        if self.replay:
+            raise IgnoreRequest(f"Not in the FlareSolverr cache: {request.url}")
+        return None
+
+    def process_response(self, request, response, spider):
+        if not request.meta.get("redirected_to_flare_solverr"):
+            return response
+
+        if response.status == 200 and not blocked_by_cloudflare(response):
+            try:
+                self.store(request.meta["original_request"], response)
+            except OSError as e:
+                self.logger.error(f"Failed to cache {response.url}: {e}")
+
+        return response
+
+
 class FlareSolverrRetryMiddleware:
     """
     This middleware retries requests that failed due to a FlareSolverr error.
@@ -154,6 +358,7 @@ class FlareSolverrRetryMiddleware:
         self.retry_http_codes = set(
             int(x) for x in settings.getlist("RETRY_HTTP_CODES")
         )
+        self.failure_capture = FailureCapture.from_settings(settings)
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -188,6 +393,9 @@ class FlareSolverrRetryMiddleware:
                         "dont_filter": True,
                         "redirected_to_flare_solverr": False,
                         "flaresolverr_retry_count": retry_count,
+                        "origin": "retry",
+                        "retry_of": get_request_origin(original_request),
+                        "source_url": original_request.url,
                     }
                 )
                 retry_request = original_request.replace(
@@ -199,12 +407,314 @@ class FlareSolverrRetryMiddleware:
                 )
                 return retry_request
 
+            path = self.failure_capture.capture(PROXY_ERROR, response, original_request)
             self.logger.error(
                 f"Request failed after {retry_count} retries: <{response.status} {request.url}>"
+                f"{capture_note(path)}"
             )
-            self.logger.debug(f"Response body: {response.status} {response.body}")
             raise IgnoreRequest(
                 f"Request failed after {retry_count} retries: <{response.status} {request.url}>"
             )
 
         return response
+
+
+class TagOverlapMiddleware:
+    """
+    This spider middleware prunes the pagination of tags whose servers are
+    mostly listed under another tag that was already crawled, like "chill"
+    and "friendly".
+
+    The guild ids found on the pages of each tag are added to a HyperLogLog
+    in {spider}:tag_sketch:{language}:{tag}, which takes at most 12 kB per
+    tag. On each tag page, the share of the tag's servers that are also
+    listed under the other tags of the page is estimated from the sketches.
+    Only the tags that were crawled at least as far as the current tag are
+    compared, so that two overlapping tags don't prune each other.
+
+    Once the overlap reaches TAG_OVERLAP_THRESHOLD, the request for the next
+    page of the tag is demoted by TAG_OVERLAP_DEMOTE_PRIORITY, or dropped if
+    TAG_OVERLAP_ACTION is "skip". The number of dropped requests is reported
+    in the tag_overlap/requests_saved stat.
+    """
+
+    logger = getLogger(__name__)
+
+    sketch_key = "%(spider)s:tag_sketch:%(language)s:%(tag)s"
+
+    def __init__(
+        self,
+        redis_url,
+        stats,
+        threshold=0.9,
+        action="demote",
+        demote_priority=100,
+        min_guilds=100,
+        max_size_ratio=10,
+    ):
+        self.redis_url = redis_url
+        self.stats = stats
+        self.threshold = threshold
+        self.action = action
+        self.demote_priority = demote_priority
+        # The estimates are too noisy below min_guilds guilds, or when the
+        # other tag is more than max_size_ratio times bigger
+        self.min_guilds = min_guilds
+        self.max_size_ratio = max_size_ratio
+        self.client = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("TagOverlapMiddleware requires REDIS_URL")
+
+        middleware = cls(
+            redis_url=settings.get("REDIS_URL"),
+            stats=crawler.stats,
+            threshold=settings.getfloat("TAG_OVERLAP_THRESHOLD", 0.9),
+            action=settings.get("TAG_OVERLAP_ACTION", "demote"),
+            demote_priority=settings.getint("TAG_OVERLAP_DEMOTE_PRIORITY", 100),
+            min_guilds=settings.getint("TAG_OVERLAP_MIN_GUILDS", 100),
+            max_size_ratio=settings.getfloat("TAG_OVERLAP_MAX_SIZE_RATIO", 10),
+        )
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.client = redis.Redis.from_url(self.redis_url)
+
+    def spider_closed(self, spider):
+        if self.client is not None:
+            self.client.close()
+
+    def _sketch_key(self, spider, language: str, tag: str) -> str:
+        return self.sketch_key % {
+            "spider": spider.name,
+            "language": language or "any",
+            "tag": tag,
+        }
+
+    def estimate_overlap(self, response, spider) -> Tuple[float, Optional[str]]:
+        """
+        Adds the guilds of the tag page to the tag's sketch, and returns the
+        highest estimated share of the tag's guilds that are also listed
+        under another tag, along with that tag.
+        """
+        tag = get_url_tag(response.url)
+        language = get_response_language(spider, response)
+        key = self._sketch_key(spider, language, tag)
+
+        guild_ids = [
+            platform_link.split("/")[-1]
+            for platform_link in response.css(".server-name a::attr(href)").getall()
+        ]
+        other_tags = {
+            get_url_tag(tag_url) for tag_url in response.css(".tag::attr(href)").getall()
+        } - {tag, None}
+        other_tags = sorted(other_tags)
+
+        with self.client.pipeline() as pipe:
+            if guild_ids:
+                pipe.pfadd(key, *guild_ids)
+            pipe.pfcount(key)
+            for other_tag in other_tags:
+                other_key = self._sketch_key(spider, language, other_tag)
+                pipe.pfcount(other_key)
+                pipe.pfcount(key, other_key)
+            counts = pipe.execute()
+        if guild_ids:
+            # Drop the result of PFADD
+            counts = counts[1:]
+
+        n_of_guilds = counts[0]
+        if n_of_guilds < self.min_guilds:
+            return 0.0, None
+
+        best_overlap, best_tag = 0.0, None
+        for i, other_tag in enumerate(other_tags):
+            n_of_other_guilds, n_of_union = counts[1 + 2 * i], counts[2 + 2 * i]
+            if not n_of_guilds <= n_of_other_guilds <= self.max_size_ratio * n_of_guilds:
+                continue
+            overlap = (n_of_guilds + n_of_other_guilds - n_of_union) / n_of_guilds
+            if overlap > best_overlap:
+                best_overlap, best_tag = min(overlap, 1.0), other_tag
+
+        return best_overlap, best_tag
+
+    def process_spider_output(self, response, result, spider):
+        next_url = response.css(".next a::attr(href)").get()
+        if get_url_tag(response.url) is None or next_url is None:
+            yield from result
+            return
+
+        overlap, other_tag = self.estimate_overlap(response, spider)
+        if overlap < self.threshold:
+            yield from result
+            return
+
+        next_url = urljoin(spider.base_url, next_url)
+        for request in result:
+            if not isinstance(request, Request) or not request.url.endswith(next_url):
+                yield request
+            elif self.action == "skip":
+                self.logger.debug(
+                    f"Skipping {request.url}: {overlap:.0%} overlap with {other_tag}"
+                )
+                self.stats.inc_value("tag_overlap/requests_saved")
+            else:
+                self.logger.debug(
+                    f"Demoting {request.url}: {overlap:.0%} overlap with {other_tag}"
+                )
+                self.stats.inc_value("tag_overlap/requests_demoted")
+                yield request.replace(priority=request.priority - self.demote_priority)
+
+
+class RegistryMiddleware:
+    """
+    This spider middleware adds the categories and tags found on each
+    listing page to the registry of disboard.registry, from which a
+    restarted job can seed its frontier.
+
+    The registry already known to the worker is kept in memory, so that
+    only the new categories and tags are written, in one round trip per
+    page. They are reported in the registry/categories and registry/tags
+    stats.
+    """
+
+    def __init__(self, redis_url, stats):
+        self.redis_url = redis_url
+        self.stats = stats
+        self.client = None
+        self.known_categories: Set[str] = set()
+        self.known_tags: Set[str] = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("REGISTRY_ENABLED"):
+            raise NotConfigured("RegistryMiddleware is disabled")
+        if not settings.get("REDIS_URL"):
+            raise NotConfigured("RegistryMiddleware requires REDIS_URL")
+
+        middleware = cls(redis_url=settings.get("REDIS_URL"), stats=crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.client = redis.Redis.from_url(self.redis_url)
+        keys = {"spider": spider.name}
+        self.known_categories = {
+            category.decode()
+            for category in self.client.smembers(CATEGORIES_KEY % keys)
+        }
+        self.known_tags = {
+            tag_id.decode() for tag_id in self.client.hkeys(TAGS_KEY % keys)
+        }
+
+    def spider_closed(self, spider):
+        if self.client is not None:
+            self.client.close()
+
+    def register(self, response, spider) -> None:
+        categories = {
+            get_url_category(url)
+            for url in response.css(".category::attr(href)").getall()
+        } - {None}
+        categories -= self.known_categories
+
+        tag_slugs: Dict[str, str] = {}
+        tag_names: Dict[str, str] = {}
+        for tag in response.css(".tag[data-id]"):
+            tag_id = tag.attrib["data-id"]
+            slug = get_url_tag(tag.attrib.get("href", ""))
+            if tag_id in self.known_tags or slug is None:
+                continue
+            tag_slugs[tag_id] = slug
+            tag_names[tag_id] = tag.attrib.get("title", slug)
+
+        if not categories and not tag_slugs:
+            return
+
+        keys = {"spider": spider.name}
+        with self.client.pipeline(transaction=False) as pipe:
+            if categories:
+                pipe.sadd(CATEGORIES_KEY % keys, *categories)
+            if tag_slugs:
+                pipe.hset(TAGS_KEY % keys, mapping=tag_slugs)
+                pipe.hset(TAG_NAMES_KEY % keys, mapping=tag_names)
+            pipe.execute()
+
+        self.known_categories |= categories
+        self.known_tags |= tag_slugs.keys()
+        self.stats.inc_value("registry/categories", len(categories))
+        self.stats.inc_value("registry/tags", len(tag_slugs))
+
+    def process_spider_output(self, response, result, spider):
+        if isinstance(response, HtmlResponse):
+            self.register(response, spider)
+        return result
+
+
+class ItemBatchMiddleware:
+    """
+    This spider middleware hands all the items of a response to the item
+    pipelines that implement process_items(items, spider), before the items
+    go through the process_item of the pipelines one by one.
+
+    A pipeline can then do the work of a whole page at once, e.g. in one
+    Redis round trip, and look the results up in its process_item. The
+    pipelines must still handle items that were not batched in process_item.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+        self._pipelines = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    @property
+    def pipelines(self) -> list:
+        # The item pipelines are only built when the engine starts
+        if self._pipelines is None:
+            itemproc = self.crawler.engine.scraper.itemproc
+            self._pipelines = [
+                pipeline
+                for pipeline in itemproc.middlewares
+                if hasattr(pipeline, "process_items")
+            ]
+        return self._pipelines
+
+    def process_spider_output(self, response, result, spider):
+        if not self.pipelines:
+            return result
+
+        result = list(result)
+        items = [output for output in result if is_item(output)]
+        if items:
+            for pipeline in self.pipelines:
+                pipeline.process_items(items, spider)
+        return result
+
+
+class ParseLatencyMiddleware:
+    """
+    This spider middleware records the time spent in the spider's callbacks
+    in the parse stage of disboard.metrics.
+
+    It must be the spider middleware closest to the spider, so that it only
+    times the callback and not the other spider middlewares.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured("ParseLatencyMiddleware is disabled")
+        return cls()
+
+    def process_spider_output(self, response, result, spider):
+        return LATENCY.time_iterable(PARSE, result)
@@ -3,9 +3,89 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
-import redis
 import psycopg
+import redis
+import time
+from dataclasses import dataclass, field
+from disboard.changes import CHANGES_KEY, DIGESTS_KEY, PUBLISH_SCRIPT, item_digest
+from disboard.items import dump_tags
+from disboard.metrics import PIPELINE, TimedRedis, observe_latency
+from disboard.recent import RecentWrites
+from logging import getLogger
 from psycopg.types.json import Jsonb
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+from typing import Any, Dict, List, Set, Tuple
+
+
+@dataclass
+class _Batch:
+    deadline: float
+    # The ids of the items of the batch that were not processed yet
+    ids: Set[int] = field(default_factory=set)
+
+
+class PendingBatches:
+    """
+    Tracks the items batched by disboard.middlewares.ItemBatchMiddleware
+    that a pipeline did not process yet, for the pipelines that hold some
+    work until the last item of a batch.
+
+    Each batch is tracked on its own, so that an item that never reaches
+    the pipeline (e.g. dropped by an earlier pipeline) only holds back its
+    own batch, and only for timeout seconds.
+    """
+
+    def __init__(self, timeout: float = 60):
+        self.timeout = timeout
+        # The item and the batch of each pending item, by id(item). The item
+        # is kept so that its id is not reused while it is pending.
+        self._pending: Dict[int, Tuple[Any, _Batch]] = {}
+        # The batches with pending items, from the oldest one
+        self._batches: List[_Batch] = []
+
+    def __contains__(self, item) -> bool:
+        return id(item) in self._pending
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, items) -> None:
+        batch = _Batch(time.monotonic() + self.timeout)
+        for item in items:
+            if id(item) not in self._pending:
+                self._pending[id(item)] = (item, batch)
+                batch.ids.add(id(item))
+        if batch.ids:
+            self._batches.append(batch)
+
+    def done(self, item) -> bool:
+        """
+        Marks the item as processed. Returns True when the held work should
+        be done: the item was not batched, it was the last pending item of
+        its batch, or a batch waited for more than timeout seconds and was
+        given up.
+        """
+        entry = self._pending.pop(id(item), None)
+        if entry is None:
+            complete = True
+        else:
+            batch = entry[1]
+            batch.ids.discard(id(item))
+            complete = not batch.ids
+            if complete:
+                self._batches.remove(batch)
+        return self._expire() or complete
+
+    def _expire(self) -> bool:
+        now = time.monotonic()
+        expired = False
+        while self._batches and self._batches[0].deadline <= now:
+            batch = self._batches.pop(0)
+            for item_id in batch.ids:
+                del self._pending[item_id]
+            expired = True
+        return expired
 
 
 class ServersGuildIdPipeline:
@@ -13,6 +93,11 @@ class ServersGuildIdPipeline:
     This pipeline is used to keep track of the guild_ids that have been scraped
     in the current run. This is used to determine which guild_ids are new and
     which guild_ids are old.
+
+    The items of a page are batched by disboard.middlewares.ItemBatchMiddleware:
+    their guild_ids are added with one pipelined SADD per guild_id, in a
+    single round trip, and whether each one was new is read from the result
+    of its SADD. Items that were not batched are added one by one.
     """
 
     set_name = "guild_id"
@@ -30,18 +115,39 @@ class ServersGuildIdPipeline:
         return cls(spider_name=spider_name, redis_url=redis_url, stats=stats)
 
     def open_spider(self, spider):
-        self.client = redis.Redis.from_url(self.redis_url)
+        self.client = TimedRedis.from_url(self.redis_url)
+        # Whether the batched guild_ids were new, in the order of their items
+        self.batched: Dict[str, List[bool]] = {}
 
     def close_spider(self, spider):
         self.client.close()
 
+    @observe_latency(PIPELINE % "ServersGuildIdPipeline.process_items")
+    def process_items(self, items, spider):
+        guild_ids = [item["guild_id"] for item in items]
+        with self.client.pipeline(transaction=False) as pipe:
+            for guild_id in guild_ids:
+                pipe.sadd(self.key_name, guild_id)
+            results = pipe.execute()
+
+        for guild_id, added in zip(guild_ids, results):
+            self.batched.setdefault(guild_id, []).append(added == 1)
+
+    @observe_latency(PIPELINE % "ServersGuildIdPipeline")
     def process_item(self, item, spider):
         guild_id = item["guild_id"]
-        if self.client.sismember(self.key_name, guild_id):
-            self.stats.inc_value("item_scraped_count/old")
+        batched = self.batched.get(guild_id)
+        if batched:
+            is_new = batched.pop(0)
+            if not batched:
+                del self.batched[guild_id]
         else:
+            is_new = self.client.sadd(self.key_name, guild_id) == 1
+
+        if is_new:
             self.stats.inc_value("item_scraped_count/new")
-            self.client.sadd(self.key_name, guild_id)
+        else:
+            self.stats.inc_value("item_scraped_count/old")
 
         return item
 
@@ -49,45 +155,200 @@ class ServersGuildIdPipeline:
 class PostgresPipeline:
     """
     This pipeline is used to store the scraped data in a Postgres database.
+
+    If RECENT_WRITE_WINDOW is set, the guilds that any worker wrote less
+    than RECENT_WRITE_WINDOW seconds ago are not written again, unless their
+    content changed, see disboard.recent. The guilds of the items batched by
+    disboard.middlewares.ItemBatchMiddleware are looked up in one round trip,
+    and their writes recorded in another one once the batch is stored, or
+    after ITEM_BATCH_TIMEOUT seconds if some of its items never arrive. The
+    skipped and written guilds are reported in the recent_writes/hits and
+    recent_writes/misses stats. The recorded writes are also stored every
+    ITEM_BATCH_TIMEOUT seconds.
     """
 
+    logger = getLogger(__name__)
     table_name = "public.disboard_servers"
+    insert_sql = f"""INSERT INTO {table_name}
+            (scrape_time, platform_link, guild_id, server_name, server_description, tags, category) \
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (guild_id)
+            DO UPDATE SET
+                scrape_time = EXCLUDED.scrape_time,
+                server_name = EXCLUDED.server_name,
+                server_description = EXCLUDED.server_description,
+                tags = EXCLUDED.tags,
+                category = EXCLUDED.category"""
 
-    def __init__(self, db_url):
+    def __init__(
+        self,
+        db_url,
+        spider_name=None,
+        redis_url=None,
+        stats=None,
+        recent_write_window=0,
+        batch_timeout=60,
+    ):
         self.db_url = db_url
+        self.spider_name = spider_name
+        self.redis_url = redis_url
+        self.stats = stats
+        self.recent_write_window = recent_write_window
+        self.recent = None
+        # The batched items that were not stored yet
+        self.batches = PendingBatches(batch_timeout)
+        self.flush_loop = None
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(db_url=crawler.settings.get("DB_URL"))
+        settings = crawler.settings
+        return cls(
+            db_url=settings.get("DB_URL"),
+            spider_name=crawler.spider.name,
+            redis_url=settings.get("REDIS_URL"),
+            stats=crawler.stats,
+            recent_write_window=settings.getfloat("RECENT_WRITE_WINDOW", 0),
+            batch_timeout=settings.getfloat("ITEM_BATCH_TIMEOUT", 60),
+        )
 
     def open_spider(self, spider):
         self.client = psycopg.connect(self.db_url)
         self.client.autocommit = True
         self.cursor = self.client.cursor()
+        if self.recent_write_window > 0 and self.redis_url:
+            self.recent = RecentWrites(
+                TimedRedis.from_url(self.redis_url),
+                self.spider_name,
+                self.recent_write_window,
+            )
+            self.flush_loop = task.LoopingCall(self.flush_recent)
+            self.flush_loop.start(self.batches.timeout, now=False)
 
     def close_spider(self, spider):
         self.cursor.close()
         self.client.close()
+        if self.flush_loop and self.flush_loop.running:
+            self.flush_loop.stop()
+        if self.recent is not None:
+            self.recent.flush()
+            self.recent.client.close()
+
+    def flush_recent(self) -> None:
+        try:
+            self.recent.flush()
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to store the recent writes: {e}")
 
+    def process_items(self, items, spider):
+        if self.recent is None:
+            return
+        self.recent.load(item.guild_id for item in items)
+        self.batches.add(items)
+
+    @observe_latency(PIPELINE % "PostgresPipeline")
     def process_item(self, item, spider):
-        sql = f"""INSERT INTO {self.table_name}
-            (scrape_time, platform_link, guild_id, server_name, server_description, tags, category) \
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (guild_id)
-            DO UPDATE SET
-                scrape_time = EXCLUDED.scrape_time,
-                server_name = EXCLUDED.server_name,
-                server_description = EXCLUDED.server_description,
-                tags = EXCLUDED.tags,
-                category = EXCLUDED.category"""
+        if self.recent is None:
+            self.store(item)
+            return item
+
+        if item not in self.batches:
+            self.recent.load([item.guild_id])
+
+        digest = item_digest(item)
+        if self.recent.is_recent(item.guild_id, digest):
+            self.stats.inc_value("recent_writes/hits")
+        else:
+            self.stats.inc_value("recent_writes/misses")
+            self.store(item)
+            self.recent.record(item.guild_id, digest)
+
+        if self.batches.done(item):
+            self.recent.flush()
+        return item
+
+    def store(self, item) -> None:
         data = (
-            item["scrape_time"],
-            item["platform_link"],
-            item["guild_id"],
-            item["server_name"],
-            item["server_description"],
-            Jsonb(item["tags"]),
-            item["category"],
+            item.scrape_time,
+            item.platform_link,
+            item.guild_id,
+            item.server_name,
+            item.server_description,
+            Jsonb(item.tags, dumps=dump_tags),
+            item.category,
+        )
+        self.cursor.execute(self.insert_sql, data)
+
+
+class GuildChangeStreamPipeline:
+    """
+    This pipeline publishes an event to the {spider}:changes Redis Stream
+    for each new or changed guild, see disboard.changes.
+
+    It runs after PostgresPipeline, so that the row of a guild is stored
+    before its event is published. The events of the items of a page,
+    batched by disboard.middlewares.ItemBatchMiddleware, are published
+    together in one round trip once the last item of the batch was stored,
+    or after ITEM_BATCH_TIMEOUT seconds if some of its items never arrive.
+    """
+
+    def __init__(
+        self, spider_name, redis_url, stats, maxlen=100_000, batch_timeout=60
+    ):
+        keys = {"spider": spider_name}
+        self.changes_key = CHANGES_KEY % keys
+        self.digests_key = DIGESTS_KEY % keys
+        self.redis_url = redis_url
+        self.stats = stats
+        self.maxlen = maxlen
+        self.batch_timeout = batch_timeout
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("CHANGE_STREAM_ENABLED"):
+            raise NotConfigured("GuildChangeStreamPipeline is disabled")
+        return cls(
+            spider_name=crawler.spider.name,
+            redis_url=settings.get("REDIS_URL"),
+            stats=crawler.stats,
+            maxlen=settings.getint("CHANGE_STREAM_MAXLEN", 100_000),
+            batch_timeout=settings.getfloat("ITEM_BATCH_TIMEOUT", 60),
         )
-        self.cursor.execute(sql, data)
+
+    def open_spider(self, spider):
+        self.client = TimedRedis.from_url(self.redis_url)
+        self._publish_script = self.client.register_script(PUBLISH_SCRIPT)
+        # The (guild_id, digest, scrape_time) of the stored items to publish
+        self.pending: List[tuple] = []
+        # The batched items that were not stored yet
+        self.batches = PendingBatches(self.batch_timeout)
+
+    def close_spider(self, spider):
+        self.publish()
+        self.client.close()
+
+    def process_items(self, items, spider):
+        self.batches.add(items)
+
+    @observe_latency(PIPELINE % "GuildChangeStreamPipeline")
+    def process_item(self, item, spider):
+        self.pending.append((item.guild_id, item_digest(item), item.scrape_time))
+        if self.batches.done(item):
+            self.publish()
         return item
+
+    def publish(self) -> None:
+        if not self.pending:
+            return
+
+        args = [self.maxlen]
+        for guild_id, digest, scrape_time in self.pending:
+            args.extend((guild_id, digest, scrape_time))
+        kinds = self._publish_script(
+            keys=[self.digests_key, self.changes_key], args=args
+        )
+        self.pending = []
+
+        for kind in kinds:
+            if kind:
+                self.stats.inc_value(f"change_stream/{kind.decode()}")
@@ -0,0 +1,723 @@
+# Define here the Redis request queues used by the scheduler
+#
+# See documentation in:
+# https://github.com/rmax/scrapy-redis/wiki/Usage
+
+import math
+import os
+import pickle
+import time
+import zstandard
+from disboard.commons.helpers import get_request_language
+from itertools import count
+from logging import getLogger
+from scrapy.http import Request
+from scrapy_redis.queue import PriorityQueue
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Pops the ARGV[3] highest priority requests from the queue and moves them
+# to the worker's processing hash. The hash values keep the original score
+# and the queue key so that the requests can be put back where they came
+# from.
+LEASE_POP_SCRIPT = """
+local items = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[3]) - 1, 'WITHSCORES')
+local popped = {}
+if #items == 0 then
+    return popped
+end
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, #items / 2 - 1)
+for i = 1, #items, 2 do
+    redis.call('HSET', KEYS[2], items[i], items[i + 1] .. ' ' .. KEYS[1])
+    table.insert(popped, items[i])
+end
+redis.call('ZADD', KEYS[3], ARGV[2], ARGV[1])
+return popped
+"""
+
+# Pops up to ARGV[4] requests, choosing the language to serve next with
+# stride scheduling for each of them: among the languages with queued
+# requests, the one with the lowest pass is served, and its pass then grows
+# by 1 / weight. Passes never fall behind the shared virtual time, so that a
+# language that was empty for a while doesn't monopolize the workers when it
+# gets requests again. ARGV[6..] holds (language, weight, quota) triples, a
+# negative quota meaning unlimited. The follow-ups of the requests already
+# served (the sub-queue of the language with the ARGV[5] suffix) are popped
+# first and don't count toward the quota, the other requests of a language
+# are only popped below its quota.
+FAIR_POP_SCRIPT = """
+local popped = {}
+local vtime = tonumber(redis.call('GET', KEYS[5]) or '0')
+for _ = 1, tonumber(ARGV[4]) do
+    local best, best_pass, best_key
+    for i = 6, #ARGV, 3 do
+        local language, quota = ARGV[i], tonumber(ARGV[i + 2])
+        local queue_key = ARGV[3] .. language
+        local key
+        if redis.call('ZCARD', queue_key .. ARGV[5]) > 0 then
+            key = queue_key .. ARGV[5]
+        else
+            local served = tonumber(redis.call('HGET', KEYS[4], language) or '0')
+            if (quota < 0 or served < quota)
+                and redis.call('ZCARD', queue_key) > 0 then
+                key = queue_key
+            end
+        end
+        if key then
+            local pass = tonumber(redis.call('HGET', KEYS[3], language) or '0')
+            pass = math.max(pass, vtime)
+            if best == nil or pass < best_pass then
+                best, best_pass, best_key = i, pass, key
+            end
+        end
+    end
+    if best == nil then
+        break
+    end
+
+    local language, weight = ARGV[best], tonumber(ARGV[best + 1])
+    local items = redis.call('ZRANGE', best_key, 0, 0, 'WITHSCORES')
+    redis.call('ZREM', best_key, items[1])
+    redis.call('HSET', KEYS[1], items[1], items[2] .. ' ' .. best_key)
+    redis.call('HSET', KEYS[3], language, tostring(best_pass + 1 / weight))
+    if best_key == ARGV[3] .. language then
+        redis.call('HINCRBY', KEYS[4], language, 1)
+    end
+    vtime = best_pass
+    table.insert(popped, items[1])
+end
+if #popped > 0 then
+    redis.call('ZADD', KEYS[2], ARGV[2], ARGV[1])
+    redis.call('SET', KEYS[5], tostring(vtime))
+end
+return popped
+"""
+
+# Puts every request leased by the workers whose lease expired before
+# ARGV[1], or staged by them while being spilled, back into their original
+# queue at their original priority.
+REAP_SCRIPT = """
+local workers = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local requeued = 0
+for _, worker in ipairs(workers) do
+    for _, prefix in ipairs({ARGV[2], ARGV[3]}) do
+        local processing_key = prefix .. worker
+        local entries = redis.call('HGETALL', processing_key)
+        for i = 1, #entries, 2 do
+            local score, queue_key = string.match(entries[i + 1], '^(%S+) (.+)$')
+            redis.call('ZADD', queue_key, score, entries[i])
+            requeued = requeued + 1
+        end
+        redis.call('DEL', processing_key)
+    end
+    redis.call('ZREM', KEYS[1], worker)
+end
+return requeued
+"""
+
+# Puts the requests of ARGV, leased in the processing hash KEYS[1], back
+# into their original queue at their original priority. Returns the number
+# of requests that were put back.
+UNLEASE_SCRIPT = """
+local requeued = 0
+for i = 1, #ARGV do
+    local value = redis.call('HGET', KEYS[1], ARGV[i])
+    if value then
+        local score, queue_key = string.match(value, '^(%S+) (.+)$')
+        redis.call('ZADD', queue_key, score, ARGV[i])
+        redis.call('HDEL', KEYS[1], ARGV[i])
+        requeued = requeued + 1
+    end
+end
+return requeued
+"""
+
+# Moves up to ARGV[2] of the lowest priority requests of the hot queue
+# KEYS[1] beyond its first ARGV[1] to the worker's staging hash KEYS[2], in
+# the format of the processing hashes, and returns them with their scores.
+# The worker ARGV[3] holds a lease until ARGV[4] in KEYS[3], so that the
+# staged requests are put back into the queue by REAP_SCRIPT if it dies
+# before they reach the cold tier.
+SPILL_SCRIPT = """
+local n = math.min(redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[1]), tonumber(ARGV[2]))
+if n <= 0 then
+    return {}
+end
+local entries = redis.call('ZRANGE', KEYS[1], -n, -1, 'WITHSCORES')
+redis.call('ZREMRANGEBYRANK', KEYS[1], -n, -1)
+for i = 1, #entries, 2 do
+    redis.call('HSET', KEYS[2], entries[i], entries[i + 1] .. ' ' .. KEYS[1])
+end
+redis.call('ZADD', KEYS[3], ARGV[4], ARGV[3])
+return entries
+"""
+
+# If the hot queue KEYS[1] holds less than ARGV[1] requests, returns up to
+# ARGV[2] of the highest priority chunks of its cold tier KEYS[2], which
+# stay there until REFILL_MOVE_SCRIPT moves their requests.
+REFILL_SCRIPT = """
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return {}
+end
+return redis.call('ZRANGE', KEYS[2], 0, tonumber(ARGV[2]) - 1)
+"""
+
+# Moves the requests of chunks of the cold tier KEYS[2] to the hot queue
+# KEYS[1]. ARGV[2..] holds, for each chunk, the chunk, its number of
+# requests n and the n (score, request) pairs it holds. The chunks already
+# moved by another worker are skipped. The requests moved are subtracted
+# from the field ARGV[1] of the cold tier counts KEYS[3], and their number
+# is returned.
+REFILL_MOVE_SCRIPT = """
+local i, moved = 2, 0
+while i <= #ARGV do
+    local n = tonumber(ARGV[i + 1])
+    if redis.call('ZREM', KEYS[2], ARGV[i]) == 1 then
+        for j = i + 2, i + 2 * n, 2 do
+            redis.call('ZADD', KEYS[1], ARGV[j], ARGV[j + 1])
+        end
+        moved = moved + n
+    end
+    i = i + 2 + 2 * n
+end
+if moved > 0 then
+    redis.call('HINCRBY', KEYS[3], ARGV[1], -moved)
+end
+return moved
+"""
+
+
+def is_follow_up(request: Request) -> bool:
+    """
+    Returns True if the request follows up on a request that was already
+    popped: its request to FlareSolverr, or a retry.
+    """
+    return bool(request.meta.get("redirected_to_flare_solverr")) or (
+        "retry_of" in request.meta
+    )
+
+
+def quota_reached(quota, served) -> bool:
+    """
+    Returns True if the language served its LANGUAGE_QUOTAS quota, a negative
+    or missing quota meaning unlimited.
+    """
+    return quota is not None and int(quota) >= 0 and int(served or 0) >= int(quota)
+
+
+class LeasedPriorityQueue(PriorityQueue):
+    """
+    This queue is a drop-in replacement for scrapy_redis' PriorityQueue
+    that doesn't lose requests when a worker dies.
+
+    Popped requests are moved atomically from {spider}:requests to the
+    {spider}:processing:{worker_id} hash, and the worker holds a lease on
+    them in the {spider}:leases sorted set. The lease must be renewed with
+    heartbeat() before lease_timeout seconds pass. Requests are removed from
+    the processing hash once they are acknowledged with ack().
+
+    When a worker crashes, its lease expires and any other worker (or the
+    crawl.py orchestrator) calling reap() puts the leased requests back into
+    the queue with their original priority.
+
+    Requests can be popped in batches with pop_batch(), in one round trip,
+    and the ones that won't be started can be put back with unlease().
+
+    If FRONTIER_HOT_SIZE is set, the frontier is tiered: only the
+    FRONTIER_HOT_SIZE highest priority requests are kept in the hot sorted
+    set, and the others are spilled to its cold tier, the
+    {spider}:frontier:cold sorted set of zstd-compressed chunks of
+    FRONTIER_CHUNK_SIZE requests, scored by their highest priority. When the
+    hot set falls below half of its size, it is refilled with the highest
+    priority chunks, so the priority order is kept within a chunk. The number
+    of requests in each cold tier is kept in the {spider}:frontier:counts
+    hash. See rebalance().
+
+    The spilled requests are staged in the worker's
+    {spider}:frontier:staging:{worker_id} hash until their chunks are stored,
+    and reap() puts them back into the queue if the worker dies before. The
+    refilled chunks are only removed from the cold tier along with the
+    addition of their requests to the hot set.
+    """
+
+    logger = getLogger(__name__)
+
+    processing_key = "%(spider)s:processing:"
+    staging_key = "%(spider)s:frontier:staging:"
+    leases_key = "%(spider)s:leases"
+    cold_key = "%(spider)s:frontier:cold"
+    cold_counts_key = "%(spider)s:frontier:counts"
+    # Maximum number of chunks spilled or refilled in one round trip
+    max_chunks = 50
+
+    def __init__(
+        self,
+        server,
+        spider,
+        key,
+        serializer=None,
+        worker_id: Optional[str] = None,
+        lease_timeout: float = 60,
+    ):
+        super().__init__(server, spider, key, serializer)
+        self.worker_id = worker_id or f"{spider.name}:{id(self)}"
+        self.lease_timeout = lease_timeout
+        self.processing_prefix = self.processing_key % {"spider": spider.name}
+        self.processing = f"{self.processing_prefix}{self.worker_id}"
+        self.staging_prefix = self.staging_key % {"spider": spider.name}
+        self.staging = f"{self.staging_prefix}{self.worker_id}"
+        self.leases = self.leases_key % {"spider": spider.name}
+        # Maps the lease_id stored in request.meta to the encoded request
+        # that is held in the processing hash.
+        self.leased: Dict[str, bytes] = {}
+        self._lease_ids = count()
+        self._pop_script = server.register_script(LEASE_POP_SCRIPT)
+        self._reap_script = server.register_script(REAP_SCRIPT)
+        self._unlease_script = server.register_script(UNLEASE_SCRIPT)
+
+        settings = spider.settings
+        self.hot_size = settings.getint("FRONTIER_HOT_SIZE", 0)
+        self.chunk_size = settings.getint("FRONTIER_CHUNK_SIZE", 1000)
+        self.cold_prefix = self.cold_key % {"spider": spider.name}
+        self.cold_counts = self.cold_counts_key % {"spider": spider.name}
+        self.compressor = zstandard.ZstdCompressor(level=3)
+        self.decompressor = zstandard.ZstdDecompressor()
+        self._spill_script = server.register_script(SPILL_SCRIPT)
+        self._refill_script = server.register_script(REFILL_SCRIPT)
+        self._refill_move_script = server.register_script(REFILL_MOVE_SCRIPT)
+
+    def _lease_expiry(self) -> float:
+        return time.time() + self.lease_timeout
+
+    def _lease_request(self, data: bytes) -> Request:
+        """
+        Decodes a request popped from the queue and tags it with a lease_id
+        so that it can be acknowledged later on.
+        """
+        request = self._decode_request(data)
+        lease_id = f"{self.worker_id}:{next(self._lease_ids)}"
+        request.meta["lease_id"] = lease_id
+        self.leased[lease_id] = data
+        return request
+
+    def queue_key(self, request) -> str:
+        """
+        Returns the key of the sorted set that the request is pushed to.
+        """
+        return self.key
+
+    def entry(self, request) -> Tuple[str, int, bytes]:
+        """
+        Returns the key, score and data with which the request is pushed,
+        for the bulk loads of disboard.registry.seed_frontier.
+        """
+        return self.queue_key(request), -request.priority, self._encode_request(request)
+
+    def __len__(self):
+        """Return the length of the queue, including its cold tier"""
+        return self.server.zcard(self.key) + self.cold_len()
+
+    def hot_keys(self) -> List[str]:
+        """
+        Returns the keys of the sorted sets that requests are popped from.
+        """
+        return [self.key]
+
+    def _cold_key(self, hot_key: str) -> str:
+        return f"{self.cold_prefix}{hot_key[len(self.key):]}"
+
+    def cold_len(self, hot_keys: Optional[List[str]] = None) -> int:
+        """
+        Returns the number of requests in the cold tiers of the given hot
+        sets, by default all the hot sets of the queue.
+        """
+        if not self.hot_size:
+            return 0
+        if hot_keys is None:
+            hot_keys = self.hot_keys()
+        fields = [self._cold_key(hot_key) for hot_key in hot_keys]
+        return sum(int(n or 0) for n in self.server.hmget(self.cold_counts, fields))
+
+    def spill(self, hot_key: str) -> int:
+        """
+        Moves the lowest priority requests beyond the first hot_size of the
+        hot set to its cold tier. Returns the number of requests moved.
+        """
+        cold_key = self._cold_key(hot_key)
+        spilled = 0
+        while True:
+            entries = self._spill_script(
+                keys=[hot_key, self.staging, self.leases],
+                args=[
+                    self.hot_size,
+                    self.max_chunks * self.chunk_size,
+                    self.worker_id,
+                    self._lease_expiry(),
+                ],
+            )
+            if not entries:
+                return spilled
+
+            # From the highest to the lowest priority
+            entries = list(zip(entries[::2], map(float, entries[1::2])))
+            chunks = {}
+            for start in range(0, len(entries), self.chunk_size):
+                chunk = entries[start : start + self.chunk_size]
+                header = b"%d:" % len(chunk) + os.urandom(8)
+                data = self.compressor.compress(pickle.dumps(chunk))
+                chunks[header + data] = chunk[0][1]
+            with self.server.pipeline() as pipe:
+                pipe.zadd(cold_key, chunks)
+                pipe.hincrby(self.cold_counts, cold_key, len(entries))
+                pipe.hdel(self.staging, *[data for data, _ in entries])
+                pipe.execute()
+            spilled += len(entries)
+
+    def refill(self, hot_key: str) -> int:
+        """
+        Moves the highest priority chunks of the cold tier back to the hot
+        set, if it holds less than half of hot_size requests. Returns the
+        number of requests moved.
+        """
+        cold_key = self._cold_key(hot_key)
+        low_watermark = max(1, self.hot_size // 2)
+        max_chunks = min(self.max_chunks, math.ceil(self.hot_size / self.chunk_size))
+        chunks = self._refill_script(
+            keys=[hot_key, cold_key], args=[low_watermark, max_chunks]
+        )
+        if not chunks:
+            return 0
+
+        args = [cold_key]
+        for chunk in chunks:
+            # Skip the header: the number of requests, ":" and 8 random bytes
+            data = chunk[chunk.index(b":") + 9 :]
+            entries = pickle.loads(self.decompressor.decompress(data))
+            args += [chunk, len(entries)]
+            for data, score in entries:
+                args += [score, data]
+        return self._refill_move_script(
+            keys=[hot_key, cold_key, self.cold_counts], args=args
+        )
+
+    def rebalance(self) -> int:
+        """
+        Spills the hot sets over hot_size to their cold tier, and refills
+        the ones below half of hot_size from it. Returns the number of
+        requests refilled.
+        """
+        if not self.hot_size:
+            return 0
+        refilled = 0
+        for hot_key in self.hot_keys():
+            spilled = self.spill(hot_key)
+            if spilled:
+                self.logger.debug(f"Spilled {spilled} requests of {hot_key}")
+            refilled += self.refill(hot_key)
+        return refilled
+
+    def _pop_entries(self, count: int) -> List[bytes]:
+        """
+        Pops up to count encoded requests and moves them to the processing
+        hash, atomically.
+        """
+        return self._pop_script(
+            keys=[self.key, self.processing, self.leases],
+            args=[self.worker_id, self._lease_expiry(), count],
+        )
+
+    def pop_batch(self, count: int) -> List[Request]:
+        """
+        Pops up to count requests, from the highest priority, and leases
+        them to this worker.
+        """
+        entries = self._pop_entries(count)
+        # The hot set may be empty while its cold tier is not
+        if not entries and self.rebalance():
+            entries = self._pop_entries(count)
+        return [self._lease_request(data) for data in entries]
+
+    def pop(self, timeout=0):
+        """
+        Pop a request and lease it to this worker.
+        timeout not support in this queue class
+        """
+        requests = self.pop_batch(1)
+        return requests[0] if requests else None
+
+    def ack(self, lease_id: str) -> None:
+        """
+        Acknowledges that the leased request doesn't need to be recovered
+        anymore, either because it was processed or because a follow-up
+        request was pushed back into the queue.
+        """
+        data = self.leased.pop(lease_id, None)
+        if data is not None:
+            self.server.hdel(self.processing, data)
+
+    def unlease(self, lease_ids: Iterable[str]) -> int:
+        """
+        Puts the leased requests that this worker won't start back into the
+        queue at their original priority, in one round trip. Returns the
+        number of requests that were put back.
+        """
+        entries = [
+            self.leased.pop(lease_id)
+            for lease_id in lease_ids
+            if lease_id in self.leased
+        ]
+        if not entries:
+            return 0
+        return self._unlease_script(keys=[self.processing], args=entries)
+
+    def heartbeat(self) -> None:
+        """
+        Renews the lease of this worker on all of its processing requests.
+        """
+        self.server.zadd(self.leases, {self.worker_id: self._lease_expiry()})
+
+    def reap(self) -> int:
+        """
+        Puts the requests of all expired leases back into the queue.
+        Returns the number of requests that were recovered.
+        """
+        requeued = self._reap_script(
+            keys=[self.leases],
+            args=[time.time(), self.processing_prefix, self.staging_prefix],
+        )
+        if requeued:
+            self.logger.info(f"Recovered {requeued} requests from expired leases")
+        return requeued
+
+    def release(self) -> int:
+        """
+        Puts all the requests leased by this worker back into the queue.
+        This is meant to be called when the worker shuts down gracefully.
+        """
+        self.leased.clear()
+        # Expiring our own lease lets the reaper do the work atomically.
+        self.server.zadd(self.leases, {self.worker_id: 0})
+        return self._reap_script(
+            keys=[self.leases], args=[0, self.processing_prefix, self.staging_prefix]
+        )
+
+    def clear(self):
+        """Clear queue, its cold tiers and all the processing requests"""
+        super().clear()
+        self.leased.clear()
+        for prefix in [self.processing_prefix, self.staging_prefix]:
+            for key in self.server.scan_iter(f"{prefix}*"):
+                self.server.delete(key)
+        cold_keys = [self._cold_key(hot_key) for hot_key in self.hot_keys()]
+        self.server.delete(self.leases, *cold_keys)
+        self.server.hdel(self.cold_counts, *cold_keys)
+
+
+class LanguageFairQueue(LeasedPriorityQueue):
+    """
+    This queue lets a single job crawl several languages at once.
+
+    Requests are pushed to one sub-queue per language,
+    {spider}:requests:{language}, and popped with weighted fair scheduling
+    across languages, so that small languages are not starved by big ones.
+    Like LeasedPriorityQueue, popped requests are leased to the worker.
+
+    Settings:
+    - LANGUAGES: the languages of the job;
+    - LANGUAGE_WEIGHTS: a dict with the share of each language (default 1);
+    - LANGUAGE_QUOTAS: a dict with the maximum number of requests to pop
+      for each language (default: unlimited).
+
+    The follow-ups of the requests already popped, i.e. their requests to
+    FlareSolverr and their retries, are pushed to the
+    {spider}:requests:{language}:follow_up sub-queue instead. They are popped
+    before the other requests of the language and don't count toward its
+    quota, so that the pages already started are finished even once the
+    quota is reached.
+
+    The number of requests served for each language is kept in the
+    {spider}:languages:served hash, see progress().
+    """
+
+    # Name of the sub-queue of the requests that are not filtered by language
+    any_language = "any"
+    # Suffix of the sub-queues of the follow-ups of the popped requests
+    follow_up_suffix = ":follow_up"
+
+    def __init__(self, server, spider, key, serializer=None, **kwargs):
+        super().__init__(server, spider, key, serializer, **kwargs)
+        settings = spider.settings
+        self.languages: List[str] = settings.getlist("LANGUAGES") or [
+            settings.get("LANGUAGE") or ""
+        ]
+        self.weights = settings.getdict("LANGUAGE_WEIGHTS")
+        self.quotas = settings.getdict("LANGUAGE_QUOTAS")
+        self.pass_key = f"{spider.name}:languages:pass"
+        self.served_key = f"{spider.name}:languages:served"
+        self.vtime_key = f"{spider.name}:languages:vtime"
+        self._fair_pop_script = server.register_script(FAIR_POP_SCRIPT)
+
+    def _language_name(self, language: str) -> str:
+        return language or self.any_language
+
+    def _language_key(self, language: str) -> str:
+        return f"{self.key}:{self._language_name(language)}"
+
+    def __len__(self):
+        """
+        Return the length of the sub-queues of the languages below their
+        quota and of the follow-ups of all the languages, including their
+        cold tiers
+        """
+        hot_keys = [self._language_key(language) for language in self.open_languages()]
+        hot_keys += [
+            f"{self._language_key(language)}{self.follow_up_suffix}"
+            for language in self.languages
+        ]
+        with self.server.pipeline() as pipe:
+            for hot_key in hot_keys:
+                pipe.zcard(hot_key)
+            return sum(pipe.execute()) + self.cold_len(hot_keys)
+
+    def open_languages(self) -> List[str]:
+        """
+        Returns the languages that didn't reach their quota. The requests of
+        the other languages are never popped again.
+        """
+        served = self.server.hgetall(self.served_key)
+        return [
+            language
+            for language in self.languages
+            if not quota_reached(
+                self.quotas.get(language),
+                served.get(self._language_name(language).encode()),
+            )
+        ]
+
+    def hot_keys(self) -> List[str]:
+        return [
+            f"{self._language_key(language)}{suffix}"
+            for language in self.languages
+            for suffix in ["", self.follow_up_suffix]
+        ]
+
+    def queue_key(self, request) -> str:
+        """
+        Returns the key of the sub-queue of the request's language, or of its
+        follow-ups.
+        """
+        language = get_request_language(request, default=self.languages[0])
+        if language not in self.languages:
+            language = self.languages[0]
+        if is_follow_up(request):
+            return f"{self._language_key(language)}{self.follow_up_suffix}"
+        return self._language_key(language)
+
+    def push(self, request):
+        """Push a request to the sub-queue of its language"""
+        key, score, data = self.entry(request)
+        self.server.execute_command("ZADD", key, score, data)
+
+    def _pop_entries(self, count: int) -> List[bytes]:
+        """
+        Pops up to count encoded requests, each from the language with the
+        lowest pass at the time.
+        """
+        args = [
+            self.worker_id,
+            self._lease_expiry(),
+            f"{self.key}:",
+            count,
+            self.follow_up_suffix,
+        ]
+        for language in self.languages:
+            args += [
+                self._language_name(language),
+                float(self.weights.get(language, 1)),
+                int(self.quotas.get(language, -1)),
+            ]
+
+        return self._fair_pop_script(
+            keys=[
+                self.processing,
+                self.leases,
+                self.pass_key,
+                self.served_key,
+                self.vtime_key,
+            ],
+            args=args,
+        )
+
+    def progress(self) -> Dict[str, dict]:
+        """
+        Returns the number of queued and served requests of each language.
+        """
+        served = self.server.hgetall(self.served_key)
+        progress = {}
+        for language in self.languages:
+            name = self._language_name(language)
+            progress[name] = {
+                "queued": self.server.zcard(self._language_key(language)),
+                "served": int(served.get(name.encode(), 0)),
+                "quota": self.quotas.get(language),
+            }
+        return progress
+
+    def clear(self):
+        """Clear all the sub-queues and the scheduling state"""
+        super().clear()
+        self.server.delete(
+            *self.hot_keys(),
+            self.pass_key,
+            self.served_key,
+            self.vtime_key,
+        )
+
+
+def pending_requests(
+    client, spider_name: str, quotas: Optional[dict] = None, leased: bool = False
+) -> int:
+    """
+    Returns the number of requests of the spider that can still be popped,
+    from {spider}:requests, the language sub-queues {spider}:requests:* and
+    their cold tiers. The sub-queues of the languages that reached their
+    quota are left out, since LanguageFairQueue never pops them again. If
+    leased is True, the requests leased in {spider}:processing:* and staged
+    in {spider}:frontier:staging:* are counted too, since they are put back
+    into the queue if their worker dies.
+    """
+    quotas = quotas or {}
+    keys = {"spider": spider_name}
+    queue_key = f"{spider_name}:requests"
+    cold_prefix = LeasedPriorityQueue.cold_key % keys
+    served = client.hgetall(f"{spider_name}:languages:served")
+
+    def is_open(language: str) -> bool:
+        if language.endswith(LanguageFairQueue.follow_up_suffix):
+            return True
+        return not language or not quota_reached(
+            quotas.get(language), served.get(language.encode())
+        )
+
+    hot_keys = [queue_key] + [
+        key.decode() for key in client.scan_iter(f"{queue_key}:*")
+    ]
+    with client.pipeline() as pipe:
+        for key in hot_keys:
+            if is_open(key[len(queue_key) + 1 :]):
+                pipe.zcard(key)
+        depth = sum(pipe.execute())
+
+    cold_counts = client.hgetall(LeasedPriorityQueue.cold_counts_key % keys)
+    for field, count in cold_counts.items():
+        if is_open(field.decode()[len(cold_prefix) + 1 :]):
+            depth += int(count)
+
+    if leased:
+        for prefix in [
+            LeasedPriorityQueue.processing_key % keys,
+            LeasedPriorityQueue.staging_key % keys,
+        ]:
+            for key in client.scan_iter(f"{prefix}*"):
+                depth += client.hlen(key)
+    return depth
@@ -0,0 +1,113 @@
+"""
+This module contains the suppression window of the storage pipelines.
+
+Popular guilds are listed on the front page, in their category and under
+each of their tags, in both sort orders, so the same guild is scraped many
+times within minutes. disboard.pipelines.PostgresPipeline skips the guilds
+that were written less than RECENT_WRITE_WINDOW seconds ago, by any worker,
+unless their content changed.
+
+The last write of each guild is kept in the {spider}:recent:{guild_id} key
+as "{digest}:{time}", which expires with the window, and in a bounded
+in-process cache, see RecentWrites.
+"""
+
+import math
+import time
+import redis
+
+from collections import OrderedDict
+from typing import Dict, Iterable, Tuple
+
+
+RECENT_KEY = "%(spider)s:recent:%(guild_id)s"
+
+
+class RecentWrites:
+    """
+    The guilds written by the workers during the last window seconds, along
+    with the digest of their content, see disboard.changes.item_digest.
+
+    The guilds of a page are looked up with load in one MGET, and the
+    writes recorded with record are stored with flush in one pipeline. At
+    most max_size guilds are kept in memory, the least recently used ones
+    are evicted first.
+    """
+
+    def __init__(
+        self,
+        client: redis.Redis,
+        spider_name: str,
+        window: float,
+        max_size: int = 100_000,
+    ):
+        self.client = client
+        self.spider_name = spider_name
+        self.window = window
+        self.max_size = max_size
+        # The (digest, write time) of each guild, from the least recently used
+        self.cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        # The values of the writes that were not stored in Redis yet
+        self.pending: Dict[str, str] = {}
+
+    def _key(self, guild_id: str) -> str:
+        return RECENT_KEY % {"spider": self.spider_name, "guild_id": guild_id}
+
+    def _cache(self, guild_id: str, digest: str, written: float) -> None:
+        self.cache[guild_id] = (digest, written)
+        self.cache.move_to_end(guild_id)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def _is_fresh(self, guild_id: str, now: float) -> bool:
+        entry = self.cache.get(guild_id)
+        return entry is not None and now - entry[1] < self.window
+
+    def load(self, guild_ids: Iterable[str]) -> None:
+        """
+        Reads the last writes of the guilds that are not fresh in memory.
+        """
+        now = time.time()
+        missing = [
+            guild_id
+            for guild_id in dict.fromkeys(guild_ids)
+            if not self._is_fresh(guild_id, now)
+        ]
+        if not missing:
+            return
+
+        values = self.client.mget([self._key(guild_id) for guild_id in missing])
+        for guild_id, value in zip(missing, values):
+            if value is not None:
+                digest, written = value.decode().rsplit(":", 1)
+                self._cache(guild_id, digest, float(written))
+
+    def is_recent(self, guild_id: str, digest: str) -> bool:
+        """
+        Returns True if the guild was written with the same digest less than
+        window seconds ago. Only the guilds in memory are considered, see
+        load.
+        """
+        if not self._is_fresh(guild_id, time.time()):
+            return False
+        self.cache.move_to_end(guild_id)
+        return self.cache[guild_id][0] == digest
+
+    def record(self, guild_id: str, digest: str) -> None:
+        now = time.time()
+        self._cache(guild_id, digest, now)
+        self.pending[guild_id] = f"{digest}:{now}"
+
+    def flush(self) -> None:
+        """
+        Stores the recorded writes, which expire after the window.
+        """
+        if not self.pending:
+            return
+
+        ttl = max(1, math.ceil(self.window))
+        with self.client.pipeline(transaction=False) as pipe:
+            for guild_id, value in self.pending.items():
+                pipe.set(self._key(guild_id), value, ex=ttl)
+            pipe.execute()
+        self.pending = {}
@@ -0,0 +1,137 @@
+"""
+This module contains the registry of the categories and tags of Disboard,
+and the seeding of the frontier from it.
+
+disboard.middlewares.RegistryMiddleware adds every category slug and tag
+seen on a listing page to the registry while the spider parses:
+- {spider}:registry:categories: the set of the category slugs;
+- {spider}:registry:tags: a hash of the tag slug of each tag data-id;
+- {spider}:registry:tag_names: a hash of the tag name of each tag data-id.
+
+The registry is not deleted by restart_job. A restarted job can seed the
+frontier with the category and tag pages of the registry, for each language
+of the job and each postfix of get_url_postfixes, instead of finding them
+again link by link, see seed_requests and load_frontier.
+"""
+
+import time
+import redis
+
+from disboard.commons.constants import DISBOARD_URL
+from disboard.commons.helpers import get_url_postfixes
+from disboard.dupefilters import request_fingerprint
+from scrapy.http import Request
+from typing import Dict, Iterable, List, Set, Tuple
+
+
+CATEGORIES_KEY = "%(spider)s:registry:categories"
+TAGS_KEY = "%(spider)s:registry:tags"
+TAG_NAMES_KEY = "%(spider)s:registry:tag_names"
+
+# Priorities of the seeded requests, as if they were found on a full page
+# of 24 servers, see request_all_category_urls and request_all_tag_urls
+CATEGORY_PRIORITY = 24 + 25
+TAG_PRIORITY = 24 + 1
+
+# Pushes the requests of ARGV[2:], given as (fingerprint, index of the queue
+# in KEYS, score, data) groups, to their queue if the fingerprint is not in
+# the duplicates filter KEYS[1] yet, nor in the negative cache KEYS[2] with
+# an expiry after ARGV[1]. Like RecrawlDupeFilter, the fingerprints are added
+# to the duplicates filter. Returns the number of requests pushed.
+SEED_SCRIPT = """
+local pushed = 0
+for i = 2, #ARGV, 4 do
+    local fingerprint = ARGV[i]
+    local expiry = redis.call('ZSCORE', KEYS[2], fingerprint)
+    if not (expiry and tonumber(expiry) > tonumber(ARGV[1])) then
+        if redis.call('SADD', KEYS[1], fingerprint) == 1 then
+            local key = KEYS[tonumber(ARGV[i + 1])]
+            redis.call('ZADD', key, ARGV[i + 2], ARGV[i + 3])
+            pushed = pushed + 1
+        end
+    end
+end
+return pushed
+"""
+
+
+def read_registry(
+    client: redis.Redis, spider_name: str
+) -> Tuple[Set[str], Dict[str, str]]:
+    """
+    Returns the category slugs and the tag slug of each tag data-id of the
+    registry.
+    """
+    keys = {"spider": spider_name}
+    with client.pipeline(transaction=False) as pipe:
+        pipe.smembers(CATEGORIES_KEY % keys)
+        pipe.hgetall(TAGS_KEY % keys)
+        categories, tags = pipe.execute()
+
+    return (
+        {category.decode() for category in categories},
+        {tag_id.decode(): slug.decode() for tag_id, slug in tags.items()},
+    )
+
+
+def seed_requests(
+    spider, languages: List[str], categories: Iterable[str], tags: Iterable[str]
+) -> List[Request]:
+    """
+    Returns the requests for the category and tag pages of the given slugs,
+    for each of the languages and each postfix of get_url_postfixes. They
+    are tagged with the "registry" origin, so that CrawlEfficiency tells them
+    apart from the front pages seeded by --restart-job.
+    """
+    prefix = f"{spider.url_prefix}{DISBOARD_URL}"
+    requests = []
+    for language in languages:
+        postfixes = get_url_postfixes(spider, language)
+        for listing, slugs, priority in [
+            ("category", sorted(categories), CATEGORY_PRIORITY),
+            ("tag", sorted(set(tags)), TAG_PRIORITY),
+        ]:
+            for slug in slugs:
+                for postfix in postfixes:
+                    requests.append(
+                        Request(
+                            url=f"{prefix}/servers/{listing}/{slug}{postfix}",
+                            priority=priority,
+                            meta={"language": language, "origin": "registry"},
+                        )
+                    )
+    return requests
+
+
+def load_frontier(
+    client: redis.Redis,
+    queue,
+    dupefilter_key: str,
+    negative_key: str,
+    requests: List[Request],
+    chunk_size: int = 500,
+) -> int:
+    """
+    Pushes the requests that were not seen yet to the queue, a
+    disboard.queues.LeasedPriorityQueue, in one pipeline of SEED_SCRIPT
+    calls of chunk_size requests. Returns the number of requests pushed.
+    """
+    script = client.register_script(SEED_SCRIPT)
+    now = time.time()
+    with client.pipeline(transaction=False) as pipe:
+        for start in range(0, len(requests), chunk_size):
+            queue_keys: List[str] = []
+            args: list = [now]
+            for request in requests[start : start + chunk_size]:
+                key, score, data = queue.entry(request)
+                if key not in queue_keys:
+                    queue_keys.append(key)
+                # KEYS[1] and KEYS[2] are the filters, and Lua is 1-indexed
+                index = queue_keys.index(key) + 3
+                args.extend([request_fingerprint(request), index, score, data])
+            script(
+                keys=[dupefilter_key, negative_key, *queue_keys],
+                args=args,
+                client=pipe,
+            )
+        return sum(pipe.execute())
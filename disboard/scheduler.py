@@ -0,0 +1,366 @@
+# Define here the scheduler used by the spiders
+#
+# See documentation in:
+# https://github.com/rmax/scrapy-redis/wiki/Usage
+
+import time
+
+from collections import deque
+from disboard.commons.helpers import get_url_page, get_worker_id
+from disboard.workers import WINDOW_KEY
+from logging import getLogger
+from scrapy import signals
+from scrapy.http import Request
+from scrapy.utils.misc import load_object
+from scrapy_redis.scheduler import Scheduler
+from twisted.internet import task
+from typing import Deque, Generator, List, Optional
+
+
+class LeasingScheduler(Scheduler):
+    """
+    This scheduler extends scrapy_redis' Scheduler to lease the requests
+    it pops from Redis using a disboard.queues.LeasedPriorityQueue.
+
+    A leased request is acknowledged when:
+    - it leaves the downloader, either with a response or with an error;
+    - a follow-up request carrying it in meta["original_request"] (see
+      FlareSolverrRedirectMiddleware) is pushed back into the queue;
+    - it is dropped by the scheduler.
+
+    While the spider is running, the lease is renewed every
+    LEASE_HEARTBEAT_INTERVAL seconds and expired leases of other workers
+    are reaped. When the spider closes, the requests still leased by this
+    worker are put back into the queue.
+
+    Requests are popped from Redis in batches, into a local prefetch buffer,
+    so that a worker doesn't pay a round trip to Redis for each request it
+    starts. A batch holds as many requests as the downloader can run at once,
+    at most SCHEDULER_PREFETCH_MAX. The requests of the buffer are leased
+    like the others, and put back into the queue when the worker stops
+    starting requests or closes.
+
+    The scheduler also spends the execution windows of crawl.py wisely. The
+    end of the current window is read from {spider}:window (see
+    disboard.workers.WorkerPool.resume), and the solve time of the worker's
+    proxy is estimated as the WINDOW_SOLVE_PERCENTILE percentile of its last
+    solves (WINDOW_DEFAULT_SOLVE_TIME seconds until enough are known), so a
+    worker on a slow proxy winds down earlier than one on a fast proxy:
+    - once less than WINDOW_ENDGAME_SOLVES solve times are left, only the
+      requests with a priority of at least WINDOW_ENDGAME_MIN_PRIORITY that
+      are not deeper than page WINDOW_ENDGAME_MAX_PAGE of a listing are
+      started. The others stay leased to the worker, so that the next polls
+      look further down the queue, and are put back into the queue at their
+      priority when the endgame ends;
+    - once less than one solve time is left, no request is started.
+
+    The solve time of the window that went to solves completed before the
+    window ended is reported in the window/solve_time/completed stat, and
+    the one of the solves that failed or completed too late in the
+    window/solve_time/wasted stat. The requests skipped in the endgame are
+    counted in window/deferred and the polls without any request started in
+    window/idle_polls.
+    """
+
+    logger = getLogger(__name__)
+
+    def __init__(
+        self,
+        server,
+        worker_id=None,
+        lease_timeout=60,
+        heartbeat_interval=15,
+        **kwargs,
+    ):
+        super().__init__(server, **kwargs)
+        self.worker_id = worker_id
+        self.lease_timeout = lease_timeout
+        self.heartbeat_interval = heartbeat_interval
+        self.heartbeat_loop = None
+        self.crawler = None
+        self.prefetch_max = 16
+        self.prefetched: Deque[Request] = deque()
+        # The requests skipped in the endgame, leased until it ends
+        self.deferred: List[Request] = []
+
+        self.solve_percentile = 90
+        self.default_solve_time = 30.0
+        self.min_solves = 10
+        self.endgame_solves = 5.0
+        self.endgame_min_priority = 40
+        self.endgame_max_page = 10
+        self.endgame_max_skips = 5
+        self.window_refresh_interval = 5.0
+        self.solve_times: Deque[float] = deque(maxlen=100)
+        self.window_end: Optional[float] = None
+        self.window_read_at = 0.0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        instance = super().from_crawler(crawler)
+        instance.crawler = crawler
+        settings = crawler.settings
+        instance.worker_id = get_worker_id(settings)
+        instance.lease_timeout = settings.getfloat("LEASE_TIMEOUT", 60)
+        instance.heartbeat_interval = settings.getfloat("LEASE_HEARTBEAT_INTERVAL", 15)
+        instance.prefetch_max = settings.getint("SCHEDULER_PREFETCH_MAX", 16)
+
+        crawler.signals.connect(
+            instance.request_left_downloader, signal=signals.request_left_downloader
+        )
+        crawler.signals.connect(
+            instance.request_dropped, signal=signals.request_dropped
+        )
+
+        instance.solve_percentile = settings.getfloat("WINDOW_SOLVE_PERCENTILE", 90)
+        instance.default_solve_time = settings.getfloat("WINDOW_DEFAULT_SOLVE_TIME", 30)
+        instance.endgame_solves = settings.getfloat("WINDOW_ENDGAME_SOLVES", 5)
+        instance.endgame_min_priority = settings.getint(
+            "WINDOW_ENDGAME_MIN_PRIORITY", 40
+        )
+        instance.endgame_max_page = settings.getint("WINDOW_ENDGAME_MAX_PAGE", 10)
+        crawler.signals.connect(
+            instance.request_reached_downloader,
+            signal=signals.request_reached_downloader,
+        )
+        return instance
+
+    def open(self, spider):
+        self.spider = spider
+
+        try:
+            self.queue = load_object(self.queue_cls)(
+                server=self.server,
+                spider=spider,
+                key=self.queue_key % {"spider": spider.name},
+                serializer=self.serializer,
+                worker_id=self.worker_id,
+                lease_timeout=self.lease_timeout,
+            )
+        except TypeError as e:
+            raise ValueError(
+                f"Failed to instantiate queue class '{self.queue_cls}': {e}"
+            )
+
+        if not self.df:
+            self.df = load_object(self.dupefilter_cls).from_spider(spider)
+
+        if self.flush_on_start:
+            self.flush()
+
+        # Requests left by a previous process with the same worker id can
+        # be put back right away, this process hasn't leased anything yet.
+        self.queue.release()
+        self.queue.reap()
+        self.heartbeat_loop = task.LoopingCall(self.heartbeat)
+        self.heartbeat_loop.start(self.heartbeat_interval, now=True)
+
+        # notice if there are requests already in the queue to resume the crawl
+        if len(self.queue):
+            spider.log(f"Resuming crawl ({len(self.queue)} requests scheduled)")
+
+    def __len__(self):
+        return len(self.queue) + len(self.prefetched) + len(self.deferred)
+
+    def close(self, reason):
+        if self.heartbeat_loop and self.heartbeat_loop.running:
+            self.heartbeat_loop.stop()
+
+        returned = self.release_prefetched() + self.release_deferred()
+        if returned:
+            self.logger.info(f"Returned {returned} prefetched requests to the queue")
+        released = self.queue.release()
+        if released:
+            self.logger.info(f"Released {released} leased requests back to the queue")
+
+        super().close(reason)
+
+    def heartbeat(self) -> None:
+        """
+        Renews this worker's lease, recovers the requests of dead workers,
+        and moves requests between the tiers of the frontier.
+        """
+        try:
+            self.queue.heartbeat()
+            self.queue.reap()
+            self.queue.rebalance()
+        except Exception as e:
+            self.logger.error(f"Failed to renew the lease of {self.worker_id}: {e}")
+
+    def enqueue_request(self, request):
+        enqueued = super().enqueue_request(request)
+        # The follow-up request is safe in Redis now, so the original
+        # request can be released from the processing hash.
+        original_request = request.meta.get("original_request")
+        if enqueued and original_request is not None:
+            self._ack(original_request)
+        return enqueued
+
+    def prefetch_size(self) -> int:
+        """
+        Returns the number of requests to pop from Redis at once: the
+        concurrency of the downloader, at most prefetch_max.
+        """
+        engine = getattr(self.crawler, "engine", None)
+        concurrency = engine.downloader.total_concurrency if engine else 1
+        return max(1, min(self.prefetch_max, concurrency))
+
+    def pop_request(self) -> Optional[Request]:
+        """
+        Returns the next request of the prefetch buffer, which is refilled
+        from Redis when it is empty.
+        """
+        if not self.prefetched:
+            self.prefetched.extend(self.queue.pop_batch(self.prefetch_size()))
+            if self.prefetched and self.stats:
+                self.stats.inc_value("scheduler/prefetch/batches", spider=self.spider)
+        if not self.prefetched:
+            return None
+
+        if self.stats:
+            self.stats.inc_value("scheduler/dequeued/redis", spider=self.spider)
+        return self.prefetched.popleft()
+
+    def release_prefetched(self) -> int:
+        """
+        Puts the requests of the prefetch buffer back into the queue, so
+        that other workers can start them. Returns the number of requests
+        that were put back.
+        """
+        lease_ids = [request.meta.get("lease_id") for request in self.prefetched]
+        self.prefetched.clear()
+        return self.queue.unlease(lease_ids)
+
+    def release_deferred(self) -> int:
+        """
+        Puts the requests skipped in the endgame back into the queue at their
+        priority. Returns the number of requests that were put back.
+        """
+        if not self.deferred:
+            return 0
+        lease_ids = [request.meta.get("lease_id") for request in self.deferred]
+        self.deferred = []
+        return self.queue.unlease(lease_ids)
+
+    def window_remaining(self) -> Optional[float]:
+        """
+        Returns the seconds left in the current execution window, or None
+        if the worker doesn't run in a window or if it already ended.
+        """
+        now = time.time()
+        if now - self.window_read_at >= self.window_refresh_interval:
+            self.window_read_at = now
+            window_end = self.server.get(WINDOW_KEY % {"spider": self.spider.name})
+            self.window_end = float(window_end) if window_end else None
+
+        if self.window_end is None or self.window_end <= now:
+            return None
+        return self.window_end - now
+
+    def solve_time(self) -> float:
+        """
+        Returns the estimated time of a solve by the worker's proxy.
+        """
+        if len(self.solve_times) < self.min_solves:
+            return self.default_solve_time
+        solve_times = sorted(self.solve_times)
+        index = int(self.solve_percentile / 100 * len(solve_times))
+        return solve_times[min(len(solve_times) - 1, index)]
+
+    def next_request(self):
+        remaining = self.window_remaining()
+        if remaining is None:
+            self.release_deferred()
+            return self.pop_request()
+
+        solve_time = self.solve_time()
+        if remaining < solve_time:
+            # Nothing started now would be solved before the window ends,
+            # the other workers may still start the prefetched requests
+            self.release_prefetched()
+            self.release_deferred()
+            self.stats.inc_value("window/idle_polls", spider=self.spider)
+            return None
+        if remaining >= self.endgame_solves * solve_time:
+            self.release_deferred()
+            return self.pop_request()
+        return self.next_endgame_request()
+
+    def is_endgame_request(self, request: Request) -> bool:
+        """
+        Returns True if the request is worth starting at the end of a window:
+        it is likely to yield servers, and not deep in a pagination chain.
+        The page of a request to FlareSolverr is the one of its original
+        request.
+        """
+        original_request = request.meta.get("original_request", request)
+        return (
+            request.priority >= self.endgame_min_priority
+            and get_url_page(original_request.url) <= self.endgame_max_page
+        )
+
+    def next_endgame_request(self) -> Optional[Request]:
+        """
+        Pops up to endgame_max_skips requests, and returns the first one
+        worth starting. The skipped requests are kept leased in deferred
+        until the endgame ends, otherwise the next polls would pop them again
+        and never reach the requests worth starting behind them.
+        """
+        skipped = 0
+        request = None
+        for _ in range(self.endgame_max_skips):
+            request = self.pop_request()
+            if request is None or self.is_endgame_request(request):
+                break
+            self.deferred.append(request)
+            skipped += 1
+            request = None
+
+        if skipped:
+            self.stats.inc_value("window/deferred", skipped, spider=self.spider)
+        if request is None:
+            self.stats.inc_value("window/idle_polls", spider=self.spider)
+        return request
+
+    def request_reached_downloader(self, request, spider):
+        if request.meta.get("redirected_to_flare_solverr"):
+            request.meta["window_started"] = time.time()
+
+    def request_left_downloader(self, request, spider):
+        self._ack(request)
+
+        started = request.meta.get("window_started")
+        if started is None:
+            return
+        now = time.time()
+        solve_time = now - started
+        solved = "download_latency" in request.meta
+        if solved:
+            self.solve_times.append(solve_time)
+
+        # Only the solves that started in a window are accounted for
+        if self.window_end is None or started > self.window_end:
+            return
+        if solved and now <= self.window_end:
+            self.stats.inc_value(
+                "window/solve_time/completed", solve_time, spider=self.spider
+            )
+        else:
+            wasted = min(now, self.window_end) - started
+            self.stats.inc_value("window/solve_time/wasted", wasted, spider=self.spider)
+
+    def request_dropped(self, request, spider):
+        self._ack(request)
+
+    def _ack(self, request: Request) -> None:
+        for lease_id in self._lease_ids(request):
+            self.queue.ack(lease_id)
+
+    def _lease_ids(self, request: Request) -> Generator[str, None, None]:
+        lease_id = request.meta.get("lease_id")
+        if lease_id is not None:
+            yield lease_id
+
+        original_request = request.meta.get("original_request")
+        if original_request is not None:
+            yield from self._lease_ids(original_request)
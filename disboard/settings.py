@@ -46,13 +46,17 @@ DOWNLOAD_DELAY = 7
 
 # Enable or disable spider middlewares
 # See https://docs.scrapy.org/en/latest/topics/spider-middleware.html
-# SPIDER_MIDDLEWARES = {
-#    "disboard.middlewares.DisboardSpiderMiddleware": 543,
-# }
+SPIDER_MIDDLEWARES = {
+    "disboard.middlewares.TagOverlapMiddleware": 543,
+    "disboard.middlewares.RegistryMiddleware": 545,
+    "disboard.middlewares.ItemBatchMiddleware": 900,
+    "disboard.middlewares.ParseLatencyMiddleware": 950,
+}
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 DOWNLOADER_MIDDLEWARES = {
+    "disboard.middlewares.FlareSolverrCacheMiddleware": 540,
     "disboard.middlewares.FlareSolverrRetryMiddleware": 543,
     "disboard.middlewares.FlareSolverrRedirectMiddleware": 542,
     "disboard.middlewares.FlareSolverrGetSolutionStatusMiddleware": 541,
@@ -63,6 +67,13 @@ DOWNLOADER_MIDDLEWARES = {
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 EXTENSIONS = {
     "scrapy.extensions.telnet.TelnetConsole": None,
+    "disboard.extensions.WorkerControl": 500,
+    "disboard.extensions.RecrawlScheduler": 510,
+    "disboard.extensions.NegativeCache": 520,
+    "disboard.extensions.PageArchiver": 530,
+    "disboard.extensions.LatencyMetrics": 540,
+    "disboard.extensions.CrawlEfficiency": 550,
+    "disboard.extensions.Profiler": 560,
     # "scrapy.extensions.throttle.AutoThrottle": None,
 }
 
@@ -72,6 +83,7 @@ EXTENSIONS = {
 ITEM_PIPELINES = {
     "disboard.pipelines.ServersGuildIdPipeline": 299,
     "disboard.pipelines.PostgresPipeline": 300,
+    "disboard.pipelines.GuildChangeStreamPipeline": 310,
 }
 
 # Custom Delay Throttle settings
@@ -114,6 +126,41 @@ DOWNLOAD_TIMEOUT = 300
 # HTTPCACHE_IGNORE_HTTP_CODES = []
 # HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
 
+# FlareSolverr cache settings
+# If True, the pages solved by FlareSolverr are cached on the local disk
+FLARESOLVERR_CACHE_ENABLED = os.getenv("FLARESOLVERR_CACHE_ENABLED") == "True"
+# If True, the crawl is served from the cache only, without any proxy
+FLARESOLVERR_CACHE_REPLAY = os.getenv("FLARESOLVERR_CACHE_REPLAY") == "True"
+FLARESOLVERR_CACHE_DIR = os.getenv("FLARESOLVERR_CACHE_DIR", ".flaresolverr_cache")
+# Seconds before a cached page expires (0 means never)
+FLARESOLVERR_CACHE_TTL = 0
+# Maximum size of the cache in bytes (0 means unlimited)
+FLARESOLVERR_CACHE_MAX_SIZE = 5 * 1024**3
+
+# Hedged requests settings
+# The http(s) downloads go through disboard.handlers.HedgedDownloadHandler,
+# which behaves like Scrapy's default handler unless HEDGE_ENABLED
+DOWNLOAD_HANDLERS = {
+    "http": "disboard.handlers.HedgedDownloadHandler",
+    "https": "disboard.handlers.HedgedDownloadHandler",
+}
+# If True, the slow requests to FlareSolverr are sent to a second proxy
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED") == "True"
+# Comma-separated proxies of the hedges. Defaults to the {spider}:proxies
+# of the cluster
+HEDGE_PROXY_URLS = os.getenv("HEDGE_PROXY_URLS", "")
+# A request is hedged after this percentile of the recent solve latencies,
+# and at least after HEDGE_MIN_DELAY seconds
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_DELAY = 5
+# Number of recent solve latencies, and the number needed before hedging
+HEDGE_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+# Maximum share of the requests that are hedged
+HEDGE_MAX_RATE = 0.1
+# Seconds between two health checks of the hedge proxies
+HEDGE_REFRESH_INTERVAL = 60
+
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
@@ -142,20 +189,166 @@ LOG_STDOUT = True
 
 # Scrapy-Redis settings
 # See https://github.com/rmax/scrapy-redis/wiki/Usage
-# Enables scheduling storing requests queue in redis
-SCHEDULER = "scrapy_redis.scheduler.Scheduler"
-# Ensure all spiders share same duplicates filter through redis
-DUPEFILTER_CLASS = "scrapy_redis.dupefilter.RFPDupeFilter"
+# Enables scheduling storing requests queue in redis.
+# The LeasingScheduler leases popped requests so that they are recovered
+# if the worker dies before processing them.
+SCHEDULER = "disboard.scheduler.LeasingScheduler"
+# Ensure all spiders share same duplicates filter through redis.
+# The RecrawlDupeFilter also lets a request through once its revisit is due.
+DUPEFILTER_CLASS = "disboard.dupefilters.RecrawlDupeFilter"
 # If True, it will show information about duplicate filters
 DUPEFILTER_DEBUG = False
 # Scheduler queue class:
 # - Use LifoQueue to process requests in Depth-first order
 # - Use FifoQueue to process requests in Breadth-first order
 # - Use PriorityQueue to process requests by priority
-SCHEDULER_QUEUE_CLASS = "scrapy_redis.queue.PriorityQueue"
+# - Use disboard.queues.LeasedPriorityQueue to process requests by priority
+#   and recover the requests of crashed workers (requires LeasingScheduler)
+# - Use disboard.queues.LanguageFairQueue to do the same with one sub-queue
+#   per language, for jobs crawling several LANGUAGES at once
+SCHEDULER_QUEUE_CLASS = "disboard.queues.LeasedPriorityQueue"
+if os.getenv("LANGUAGES"):
+    SCHEDULER_QUEUE_CLASS = "disboard.queues.LanguageFairQueue"
 # Don't cleanup Redis queues. Allows to pause/resume crawls.
 SCHEDULER_PERSIST = True
 
+# Request leasing settings
+# Seconds after which the requests leased by a silent worker are put back
+# into the {spider}:requests queue
+LEASE_TIMEOUT = 60
+# Seconds between two renewals of the worker's lease
+LEASE_HEARTBEAT_INTERVAL = 15
+# Maximum number of requests popped from Redis at once into the worker's
+# prefetch buffer, which is sized from CONCURRENT_REQUESTS (1 disables it)
+SCHEDULER_PREFETCH_MAX = 16
+
+# Tiered frontier settings, see disboard.queues.LeasedPriorityQueue
+# Number of the highest priority requests kept in each Redis sorted set of
+# the queue, the others are spilled to compressed chunks (0 disables it)
+FRONTIER_HOT_SIZE = 50_000
+# Number of requests per compressed chunk of the cold tier
+FRONTIER_CHUNK_SIZE = 1000
+
+# Execution window settings, see disboard.scheduler.LeasingScheduler
+# Percentile of the last solve times of the worker's proxy used as its
+# estimated solve time, and the estimate until 10 solves are known
+WINDOW_SOLVE_PERCENTILE = 90
+WINDOW_DEFAULT_SOLVE_TIME = 30
+# Number of solve times left in the window from which only the requests
+# with at least WINDOW_ENDGAME_MIN_PRIORITY, and not deeper than page
+# WINDOW_ENDGAME_MAX_PAGE of a listing, are started
+WINDOW_ENDGAME_SOLVES = 5
+WINDOW_ENDGAME_MIN_PRIORITY = 40
+WINDOW_ENDGAME_MAX_PAGE = 10
+
+# Tag overlap settings
+# Share of a tag's servers already listed under another crawled tag from
+# which the pagination of the tag is demoted, or skipped
+TAG_OVERLAP_THRESHOLD = 0.9
+# Either "demote" or "skip"
+TAG_OVERLAP_ACTION = os.getenv("TAG_OVERLAP_ACTION", "demote")
+TAG_OVERLAP_DEMOTE_PRIORITY = 100
+# Number of servers of a tag from which its overlap is estimated
+TAG_OVERLAP_MIN_GUILDS = 100
+# Maximum ratio between the servers of another tag and the servers of the
+# tag for the overlap to be estimated, the estimate is too noisy beyond it
+TAG_OVERLAP_MAX_SIZE_RATIO = 10
+
+# Recrawl settings
+# If True, the listings are revisited on an adaptive interval
+RECRAWL_ENABLED = os.getenv("RECRAWL_ENABLED") == "True"
+# Minimum and maximum seconds between two visits of the same listing
+RECRAWL_MIN_INTERVAL = 60 * 60
+RECRAWL_MAX_INTERVAL = 60 * 60 * 24 * 7
+# Seconds between two checks of the due revisits
+RECRAWL_CHECK_INTERVAL = 60
+
+# Negative cache settings
+# If True, dead and empty listing URLs are not requested again until
+# their entry in the negative cache expires
+NEGATIVE_CACHE_ENABLED = True
+# Seconds before an entry expires, randomized by +/- NEGATIVE_CACHE_JITTER
+NEGATIVE_CACHE_TTL = 60 * 60 * 24 * 7
+NEGATIVE_CACHE_JITTER = 0.2
+
+# Page archive settings
+# If True, every listing page is written to the archive, see reparse.py
+PAGE_ARCHIVE_ENABLED = os.getenv("PAGE_ARCHIVE_ENABLED") == "True"
+PAGE_ARCHIVE_DIR = os.getenv("PAGE_ARCHIVE_DIR", "archive")
+# Size in bytes from which the archive starts a new segment
+PAGE_ARCHIVE_SEGMENT_SIZE = 256 * 1024**2
+
+# Latency metrics settings
+# If True, the latency of the stages of the crawl is recorded and exported,
+# see disboard.metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED") == "True"
+# Address of the Prometheus endpoint of each worker, a free port if 0
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+# Seconds between two flushes of the histograms to {spider}:metrics
+METRICS_FLUSH_INTERVAL = 10
+
+# Crawl efficiency settings
+# If True, the solves, blocks and new guilds of each kind of link and of each
+# listing are counted, see crawl.py --efficiency-report
+EFFICIENCY_ENABLED = True
+# Seconds between two flushes of the counters to {spider}:efficiency:*
+EFFICIENCY_FLUSH_INTERVAL = 60
+
+# Profiler settings
+# If True, a worker can be profiled on demand with the "profile" command or
+# PROFILER_SIGNAL, see disboard.extensions.Profiler
+PROFILER_ENABLED = True
+PROFILER_SIGNAL = "SIGUSR1"
+PROFILER_DIR = os.getenv("PROFILER_DIR", "profiles")
+# Seconds of each profile
+PROFILER_DURATION = 30
+# Frames kept in the traceback of each memory allocation
+PROFILER_TRACEMALLOC_FRAMES = 10
+# Number of functions and lines written to the summaries
+PROFILER_TOP = 50
+
+# Item batch settings
+# Seconds after which the pipelines that hold some work until the last item
+# of a batch stop waiting for its items that never arrived (e.g. dropped by
+# an earlier pipeline), see disboard.pipelines.PendingBatches
+ITEM_BATCH_TIMEOUT = 60
+
+# Recent writes settings
+# Seconds during which a guild written by any worker is not written to the
+# database again unless its content changed (0 disables it), see
+# disboard.recent
+RECENT_WRITE_WINDOW = 15 * 60
+
+# Change stream settings
+# If True, an event is published to the {spider}:changes Redis Stream for
+# each new or changed guild, see disboard.changes
+CHANGE_STREAM_ENABLED = os.getenv("CHANGE_STREAM_ENABLED") == "True"
+# Approximate maximum number of events kept in the stream
+CHANGE_STREAM_MAXLEN = 100_000
+
+# Registry settings
+# If True, the categories and tags seen while parsing are added to the
+# {spider}:registry:* keys, from which crawl.py --seed-frontier seeds the
+# frontier, see disboard.registry
+REGISTRY_ENABLED = True
+
+# Failure capture settings
+# If True, a sample of the blocked, empty and failed responses is stored in
+# FAILURE_CAPTURE_DIR instead of logging their body, see disboard.failures
+FAILURE_CAPTURE_ENABLED = os.getenv("FAILURE_CAPTURE_ENABLED", "True") == "True"
+FAILURE_CAPTURE_DIR = os.getenv("FAILURE_CAPTURE_DIR", "failures")
+# Share of the failing responses that are captured
+FAILURE_CAPTURE_SAMPLE_RATE = 0.1
+# Maximum number of captures per minute of each failure class
+FAILURE_CAPTURE_MAX_PER_MINUTE = 6
+# Size in bytes from which the oldest captures are deleted
+FAILURE_CAPTURE_MAX_SIZE = 100 * 1024**2
+
+# Worker control settings
+# Seconds between two reads of the worker's {spider}:control:{worker_id} list
+WORKER_CONTROL_POLL_INTERVAL = 2
+
 # Custom settings
 # Sensible settings must be stored in environment variables
 
@@ -169,12 +362,24 @@ FOLLOW_CATEGORY_LINKS = os.getenv("FOLLOW_CATEGORY_LINKS")
 FOLLOW_TAG_LINKS = os.getenv("FOLLOW_TAG_LINKS")
 # The language to filter all requests by
 LANGUAGE = os.getenv("LANGUAGE")
+# Comma-separated languages crawled by a multi-language job
+LANGUAGES = os.getenv("LANGUAGES")
+# JSON object with the scheduling weight of each language (default: 1)
+LANGUAGE_WEIGHTS = os.getenv("LANGUAGE_WEIGHTS", "{}")
+# JSON object with the maximum number of requests of each language
+LANGUAGE_QUOTAS = os.getenv("LANGUAGE_QUOTAS", "{}")
 # URL of the FlareSolverr proxy server
 PROXY_URL = os.getenv("PROXY_URL")
+# Identifier of the worker process. Defaults to "{hostname}:{pid}"
+WORKER_ID = os.getenv("WORKER_ID")
 
 # Database settings
 # Redis database environment variables
 REDIS_URL = os.getenv("REDIS_URL")
+# With metrics, the scheduler and the duplicates filter record the latency
+# of their Redis calls
+if METRICS_ENABLED:
+    REDIS_PARAMS = {"redis_cls": "disboard.metrics.TimedRedis"}
 
 # Postgres environment variables
 DB_URL = os.getenv("DB_URL")
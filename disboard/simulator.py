@@ -0,0 +1,294 @@
+"""
+This module contains a local stand-in for Disboard behind a fake
+FlareSolverr proxy server, used to load-test the crawler without hammering
+the real site, see loadtest.py.
+
+The simulator generates synthetic server listings with the structure of
+the real ones (see tests/sample_files/disboard.org_servers_fl=de.html):
+the front listing /servers, one listing per category and one per tag, each
+with n_of_pages pages of servers_per_page servers. Tags form a ring where
+each tag lists servers that are also listed under its neighbour tags, and
+every server card links to its tags. Pages are generated deterministically
+from their URL, except for the 429 and Cloudflare-blocked responses, which
+are returned at random with the given rates.
+
+The fake FlareSolverr /v1 endpoint solves {"cmd": "request.get", "url": ...}
+requests for any Disboard URL after a random solve latency, and /health
+answers the health checks of the orchestrator.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+from disboard.commons.constants import DISBOARD_URL
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+
+CATEGORIES = [
+    "gaming",
+    "community",
+    "anime-manga",
+    "music",
+    "technology",
+    "language",
+    "movies",
+    "other",
+]
+
+LISTING_TITLE = "Public Discord Servers | DISBOARD: Discord Server List"
+BLOCKED_TITLE = "Access denied | disboard.org used Cloudflare to restrict access"
+TOO_MANY_REQUESTS_TITLE = "429 Too Many Requests"
+NOT_FOUND_TITLE = "404 Not Found"
+
+
+class DisboardSimulator:
+    """
+    Generates the synthetic Disboard pages.
+    """
+
+    def __init__(
+        self,
+        n_of_pages: int = 10,
+        n_of_tags: int = 100,
+        servers_per_page: int = 24,
+        tags_per_server: int = 5,
+        n_of_servers: int = 100_000,
+        rate_429: float = 0.0,
+        block_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.n_of_pages = n_of_pages
+        self.n_of_tags = n_of_tags
+        self.servers_per_page = servers_per_page
+        self.tags_per_server = tags_per_server
+        self.n_of_servers = n_of_servers
+        self.rate_429 = rate_429
+        self.block_rate = block_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+
+    def _pool(self, kind: str, name: str) -> Tuple[int, int]:
+        """
+        Returns the (start, size) of the range of servers listed by a listing.
+        Consecutive tags share half of their servers.
+        """
+        pool_size = self.servers_per_page * self.n_of_pages
+        if kind == "tag":
+            index = int(name.rsplit("-", 1)[-1]) if name.startswith("tag-") else 0
+            return index * pool_size // 2 % self.n_of_servers, pool_size
+        if kind == "category":
+            index = CATEGORIES.index(name) if name in CATEGORIES else 0
+            return index * pool_size % self.n_of_servers, pool_size
+        return 0, self.n_of_servers
+
+    def _server_tags(self, server: int) -> List[int]:
+        # The tags whose pool contains the server, and their neighbours
+        pool_size = self.servers_per_page * self.n_of_pages
+        first = server * 2 // pool_size - 1
+        return [(first + i) % self.n_of_tags for i in range(self.tags_per_server)]
+
+    def listing_servers(
+        self, kind: str, name: str, language: str, page: int
+    ) -> List[int]:
+        """
+        Returns the servers listed on a page.
+        """
+        start, size = self._pool(kind, name)
+        # Each listing starts at a different place of its range
+        key = f"{self.seed}:{kind}:{name}:{language}"
+        offset = random.Random(zlib.crc32(key.encode())).randrange(size)
+        first = (page - 1) * self.servers_per_page
+        return [
+            (start + (offset + first + i) % size) % self.n_of_servers
+            for i in range(self.servers_per_page)
+        ]
+
+    def _server_card(self, server: int) -> str:
+        guild_id = 10**17 + server
+        category = CATEGORIES[server % len(CATEGORIES)]
+        tags = "".join(
+            f'<li><a class="tag" href="{DISBOARD_URL}/servers/tag/tag-{tag}" '
+            f'title="tag-{tag}" data-id="{tag}">'
+            f'<span class="name">\ntag-{tag} </span></a></li>'
+            for tag in self._server_tags(server)
+        )
+        return (
+            '<div class="column is-one-third-desktop is-half-tablet">'
+            '<div class="listing-card">'
+            '<div class="server-header"><div class="server-info">'
+            '<div class="server-name">'
+            f'<a href="{DISBOARD_URL}/server/{guild_id}">\nServer {server} </a>'
+            "</div>"
+            '<div class="server-misc">'
+            f'<span class="server-category category">\n{category} </span>'
+            "</div></div></div>"
+            '<div class="server-body card-body">'
+            f'<div class="server-tags"><ul class="tags">{tags}</ul></div>'
+            '<div class="server-description is-elastic-text">\n'
+            f"Synthetic server number {server}, listed for load tests.</div>"
+            "</div></div></div>"
+        )
+
+    def listing(self, kind: str, name: str, language: str, page: int) -> str:
+        """
+        Returns the HTML of a listing page.
+        """
+        path = "/servers" if kind == "front" else f"/servers/{kind}/{name}"
+        query = f"?fl={language}" if language else ""
+        categories = "".join(
+            f'<a href="{DISBOARD_URL}/servers/category/{category}" class="category">'
+            f"{category}</a>"
+            for category in CATEGORIES
+        )
+        cards = "".join(
+            self._server_card(server)
+            for server in self.listing_servers(kind, name, language, page)
+        )
+        if page < self.n_of_pages:
+            next_page = (
+                f'<li class="next"><a href="{DISBOARD_URL}{path}/{page + 1}{query}" '
+                f'data-page="{page}">»</a></li>'
+            )
+        else:
+            next_page = '<li class="next disabled"><span>»</span></li>'
+        return (
+            f"<html><head><title>{LISTING_TITLE}</title></head><body>"
+            f'<div class="categories">{categories}</div>'
+            f'<div class="columns is-multiline">{cards}</div>'
+            f'<ul class="pagination">{next_page}</ul>'
+            "</body></html>"
+        )
+
+    def error_page(self, title: str) -> str:
+        return f"<html><head><title>{title}</title></head><body></body></html>"
+
+    def page(self, url: str) -> Tuple[int, str]:
+        """
+        Returns the status and the HTML of the Disboard page at the URL.
+        """
+        roll = self.random.random()
+        if roll < self.rate_429:
+            return 429, self.error_page(TOO_MANY_REQUESTS_TITLE)
+        if roll < self.rate_429 + self.block_rate:
+            # Like FlareSolverr, blocked pages have a 200 status
+            return 200, self.error_page(BLOCKED_TITLE)
+
+        parsed = urlparse(url)
+        language = parse_qs(parsed.query).get("fl", [""])[0]
+        match = re.fullmatch(
+            r"/servers(?:/(category|tag)/([^/]+))?(?:/(\d+))?/?", parsed.path
+        )
+        page = int(match.group(3) or 1) if match else 0
+        if not match or not 1 <= page <= self.n_of_pages:
+            return 404, self.error_page(NOT_FOUND_TITLE)
+
+        kind, name = match.group(1) or "front", match.group(2) or ""
+        return 200, self.listing(kind, name, language, page)
+
+
+class FlareSolverrSimulator(ThreadingHTTPServer):
+    """
+    A fake FlareSolverr proxy server in front of a DisboardSimulator.
+
+    The solve latency of each request is drawn from a normal distribution
+    with the given mean and standard deviation, in seconds. A share
+    slow_rate of the solves get stuck for slow_latency seconds instead, like
+    the long tail of the real FlareSolverr browsers.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        disboard: DisboardSimulator,
+        solve_latency: float = 0.0,
+        solve_latency_jitter: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_latency: float = 30.0,
+    ):
+        super().__init__(address, FlareSolverrRequestHandler)
+        self.disboard = disboard
+        self.solve_latency = solve_latency
+        self.solve_latency_jitter = solve_latency_jitter
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def solve(self, url: str) -> dict:
+        if random.random() < self.slow_rate:
+            latency = self.slow_latency
+        else:
+            latency = random.gauss(self.solve_latency, self.solve_latency_jitter)
+        time.sleep(max(0.0, latency))
+        status, html = self.disboard.page(url)
+        return {
+            "status": "ok",
+            "message": "Challenge not detected!",
+            "solution": {
+                "url": url,
+                "status": status,
+                "headers": {},
+                "response": html,
+            },
+        }
+
+    def start(self) -> None:
+        """
+        Serves the requests from a background thread.
+        """
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class FlareSolverrRequestHandler(BaseHTTPRequestHandler):
+    server: FlareSolverrSimulator
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: str, content_type: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, json.dumps({"status": "ok"}), "application/json")
+            return
+
+        status, html = self.server.disboard.page(self.path)
+        self._send(status, html, "text/html; charset=utf-8")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._send(500, json.dumps({"status": "error"}), "application/json")
+            return
+
+        if self.path != "/v1" or payload.get("cmd") != "request.get":
+            self._send(500, json.dumps({"status": "error"}), "application/json")
+            return
+
+        solution = self.server.solve(payload["url"])
+        self._send(200, json.dumps(solution), "application/json")
@@ -10,10 +10,12 @@ from disboard.commons.helpers import (
     count_disboard_server_items,
     has_pagination_links,
     extract_disboard_server_items,
+    get_request_origin,
     request_next_url,
     request_all_tag_urls,
     request_all_category_urls,
 )
+from disboard.failures import FailureCapture, capture_note, classify_empty_response
 from disboard.items import DisboardServerItem
 from logging import getLogger, INFO, DEBUG, WARNING
 from scrapy.http import Request, Response
@@ -46,6 +48,10 @@ class ServersSpider(RedisSpider):
     def language(self) -> str:
         return self.settings.get("LANGUAGE")
 
+    @property
+    def failure_capture(self) -> FailureCapture:
+        return FailureCapture.from_settings(self.settings)
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         getLogger("scrapy.core.scraper").setLevel(INFO)
@@ -89,7 +95,14 @@ class ServersSpider(RedisSpider):
             )
             self.logger.debug(f"Retrying: {response.url}")
             request = response.request.replace(
-                dont_filter=True, priority=response.request.priority - 10
+                dont_filter=True,
+                priority=response.request.priority - 10,
+                meta={
+                    **response.request.meta,
+                    "origin": "retry",
+                    "retry_of": get_request_origin(response.request),
+                    "source_url": response.url,
+                },
             )
             yield request
         
@@ -97,7 +110,6 @@ class ServersSpider(RedisSpider):
             self.logger.debug(
                 f"Response is not a server listing: <{response.status} {response.url}>"
             )
-            self.logger.debug(f"Response body: {response.body}")
 
 
     def _handle_pagination_links(
@@ -141,9 +153,13 @@ class ServersSpider(RedisSpider):
     def _log_disboard_server_items(
         self, n_of_server_items: int, response: Response, log_level: int = DEBUG
     ) -> None:
+        path = None
+        if n_of_server_items == 0:
+            path = self.failure_capture.capture(
+                classify_empty_response(response), response
+            )
         self.logger.log(
             log_level,
-            f"Found {n_of_server_items} DisboardServerItems in {response.url}",
+            f"Found {n_of_server_items} DisboardServerItems in {response.url}"
+            f"{capture_note(path)}",
         )
-        if n_of_server_items == 0:
-            self.logger.debug(f"Response body: {response.body}")
@@ -0,0 +1,445 @@
+"""
+This module contains the tools used by crawl.py to orchestrate the
+worker processes that run the spiders.
+
+Each worker runs a single spider with its own FlareSolverr proxy. Workers
+report when they are ready to crawl and receive commands through Redis,
+see disboard.extensions.WorkerControl.
+"""
+
+import json
+import math
+import multiprocessing
+import os
+import socket
+import time
+import zlib
+import redis
+import requests
+
+from datetime import datetime
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from disboard.queues import pending_requests
+from disboard.spiders.servers import ServersSpider
+from typing import Dict, List, Optional
+from urllib.parse import urljoin
+
+
+# Redis list where a worker pushes a message once it is ready to crawl
+READY_KEY = "%(spider)s:ready:%(worker)s"
+# Redis list from which a worker pops the commands sent to it
+CONTROL_KEY = "%(spider)s:control:%(worker)s"
+# Redis hash where each worker periodically stores its status
+STATUS_KEY = "%(spider)s:workers"
+# Redis hash with the counters of the workers that already closed
+CLOSED_STATS_KEY = "%(spider)s:stats:closed"
+# Redis key with the end time of the current execution window, see
+# disboard.scheduler.LeasingScheduler
+WINDOW_KEY = "%(spider)s:window"
+
+# Commands understood by disboard.extensions.WorkerControl
+PAUSE = "pause"
+RESUME = "resume"
+STOP = "stop"
+# Take a timed profile of the worker, see disboard.extensions.Profiler
+PROFILE = "profile"
+# Cluster command (see disboard.cluster): don't start any new worker
+# and exit once all the running workers finished
+DRAIN = "drain"
+
+
+def get_worker_ids(proxy_urls: List[str]) -> Dict[str, str]:
+    """
+    Returns a dictionary associating a stable worker id with each proxy.
+    The id only depends on the host and the proxy url, so it doesn't change
+    when proxies are assigned to or taken from this host.
+    """
+    hostname = socket.gethostname()
+    return {
+        f"{hostname}:{zlib.crc32(proxy_url.encode()):08x}": proxy_url
+        for proxy_url in proxy_urls
+    }
+
+
+def wait_until_ready(
+    client: redis.Redis, spider_name: str, worker_id: str, timeout: float
+) -> bool:
+    """
+    Blocks until the worker reports that it is ready or until timeout
+    seconds have passed. Returns True if the worker is ready.
+    """
+    key = READY_KEY % {"spider": spider_name, "worker": worker_id}
+    return client.blpop(key, timeout=int(timeout)) is not None
+
+
+def is_proxy_healthy(proxy_url: str, timeout: float = 10) -> bool:
+    """
+    Returns True if the FlareSolverr proxy server answers its health check.
+    """
+    try:
+        response = requests.get(urljoin(proxy_url, "/health"), timeout=timeout)
+        return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def send_command(
+    client: redis.Redis, spider_name: str, worker_id: str, command: str
+) -> None:
+    """
+    Sends a command to the worker.
+    """
+    key = CONTROL_KEY % {"spider": spider_name, "worker": worker_id}
+    client.rpush(key, command)
+
+
+def run_worker(proxy_url: str, worker_id: str) -> None:
+    """
+    Runs a single spider with the given proxy url and worker id.
+    """
+    os.environ["PROXY_URL"] = proxy_url
+    os.environ["WORKER_ID"] = worker_id
+
+    class NamedSpider(ServersSpider):
+        name = os.environ["SPIDER_NAME"]
+
+    process = CrawlerProcess(get_project_settings())
+    process.crawl(NamedSpider)
+    process.start()
+
+
+class WorkerPool:
+    """
+    A pool of long-lived worker processes, one per proxy.
+
+    Workers are started one after another, as soon as the previous one
+    reports that it is ready. Between execution windows the workers are
+    paused instead of terminated, so that the next window doesn't pay
+    for process startup, imports and connections again.
+    """
+
+    def __init__(
+        self,
+        redis_url: str,
+        spider_name: str,
+        proxy_urls: List[str],
+        ready_timeout: float = 120,
+    ):
+        self.redis_url = redis_url
+        self.spider_name = spider_name
+        self.worker_proxies = get_worker_ids(proxy_urls)
+        self.ready_timeout = ready_timeout
+        self.processes: Dict[str, multiprocessing.Process] = {}
+        # Workers that were asked to stop but haven't exited yet
+        self.stopping = set()
+
+    def __len__(self) -> int:
+        return len(self.alive())
+
+    def alive(self) -> List[str]:
+        """
+        Returns the ids of the workers whose process is running.
+        """
+        return [
+            worker_id
+            for worker_id, process in self.processes.items()
+            if process.is_alive()
+        ]
+
+    def active(self) -> List[str]:
+        """
+        Returns the ids of the running workers that were not asked to stop.
+        """
+        return [
+            worker_id for worker_id in self.alive() if worker_id not in self.stopping
+        ]
+
+    def crashed(self) -> List[str]:
+        """
+        Returns the ids of the workers that exited on their own
+        with a non-zero exit code.
+        """
+        return [
+            worker_id
+            for worker_id, process in self.processes.items()
+            if process.exitcode not in (None, 0) and worker_id not in self.stopping
+        ]
+
+    def start(self, worker_ids: Optional[List[str]] = None) -> None:
+        """
+        Starts the given workers, or every worker that is not running.
+        Each worker is started once the previous one is ready.
+        """
+        if worker_ids is None:
+            worker_ids = list(self.worker_proxies)
+
+        client = redis.Redis.from_url(self.redis_url)
+        for worker_id in worker_ids:
+            if worker_id in self.alive():
+                continue
+
+            self.stopping.discard(worker_id)
+            self.start_worker(client, worker_id)
+
+        client.close()
+
+    def start_worker(self, client: redis.Redis, worker_id: str) -> bool:
+        """
+        Starts a single worker and waits until it is ready.
+        Returns True if the worker reported that it is ready in time.
+        """
+        # Discard messages left by a previous process with the same id
+        client.delete(
+            READY_KEY % {"spider": self.spider_name, "worker": worker_id},
+            CONTROL_KEY % {"spider": self.spider_name, "worker": worker_id},
+        )
+
+        process = multiprocessing.Process(
+            target=run_worker, args=(self.worker_proxies[worker_id], worker_id)
+        )
+        process.start()
+        self.processes[worker_id] = process
+
+        # Wait in short slices to give up early if the worker dies
+        ready = False
+        deadline = time.time() + self.ready_timeout
+        while not ready and process.is_alive() and time.time() < deadline:
+            ready = wait_until_ready(client, self.spider_name, worker_id, 1)
+
+        if ready:
+            print(f"[{datetime.now()}] Worker {worker_id} is ready")
+        else:
+            print(f"[{datetime.now()}] Worker {worker_id} did not report readiness")
+        return ready
+
+    def broadcast(self, command: str) -> None:
+        """
+        Sends the command to every running worker.
+        """
+        client = redis.Redis.from_url(self.redis_url)
+        for worker_id in self.alive():
+            send_command(client, self.spider_name, worker_id, command)
+        client.close()
+
+    def assign(self, proxy_urls: List[str]) -> None:
+        """
+        Replaces the proxies of the pool. The workers whose proxy was
+        taken away are asked to stop.
+        """
+        worker_proxies = get_worker_ids(proxy_urls)
+        for worker_id in self.active():
+            if worker_id not in worker_proxies:
+                self.stop(worker_id)
+        self.worker_proxies = worker_proxies
+
+    def stop(self, worker_id: str) -> None:
+        """
+        Asks the worker to close its spider gracefully, so that its
+        leased requests are put back into the queue.
+        """
+        client = redis.Redis.from_url(self.redis_url)
+        send_command(client, self.spider_name, worker_id, STOP)
+        client.close()
+        self.stopping.add(worker_id)
+
+    def pause(self) -> None:
+        client = redis.Redis.from_url(self.redis_url)
+        client.delete(WINDOW_KEY % {"spider": self.spider_name})
+        client.close()
+        self.broadcast(PAUSE)
+
+    def resume(self, duration: Optional[float] = None) -> None:
+        """
+        Resumes the workers. If the workers are going to be paused again
+        after duration seconds, the end of the window is published so that
+        they don't start requests that can't finish in time.
+        """
+        if duration is not None:
+            client = redis.Redis.from_url(self.redis_url)
+            client.set(
+                WINDOW_KEY % {"spider": self.spider_name},
+                time.time() + duration,
+                ex=math.ceil(duration),
+            )
+            client.close()
+        self.broadcast(RESUME)
+
+    def close(self, timeout: float = 60) -> None:
+        """
+        Asks the running workers to stop gracefully, so that their leased
+        requests are put back into the queue, and waits up to timeout
+        seconds for them to exit before terminating the others.
+        """
+        for worker_id in self.active():
+            self.stop(worker_id)
+
+        deadline = time.time() + timeout
+        for process in self.processes.values():
+            process.join(max(0, deadline - time.time()))
+        left = self.alive()
+        if left:
+            print(f"[{datetime.now()}] Terminating {len(left)} workers still running")
+        self.terminate()
+
+    def terminate(self) -> None:
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        self.processes.clear()
+        self.stopping.clear()
+
+
+class Supervisor:
+    """
+    Watches the requests queue, the throughput of each worker and the health
+    of each proxy, and scales the WorkerPool accordingly.
+
+    The desired number of workers is one per requests_per_worker requests
+    that can still be popped, see disboard.queues.pending_requests, bounded
+    by min_workers and max_workers and by the number of healthy proxies.
+    On each check, the supervisor:
+    - stops the workers whose proxy is not healthy;
+    - starts workers on idle healthy proxies, including the ones whose
+      worker crashed, until the desired number is reached;
+    - stops the workers with the lowest throughput when there are too many.
+
+    Proxies are not checked when check_proxies is False, e.g. when the
+    workers replay a crawl from the FlareSolverr cache.
+
+    When a disboard.cluster.ClusterNode is given, the supervisor also renews
+    the node's registration, takes the proxies assigned to the node, and
+    follows the cluster commands: on "drain" it stops starting workers, and
+    on "stop" it stops every worker.
+    """
+
+    def __init__(
+        self,
+        pool: WorkerPool,
+        min_workers: int = 1,
+        max_workers: Optional[int] = None,
+        requests_per_worker: int = 500,
+        check_interval: float = 30,
+        check_proxies: bool = True,
+        node=None,
+        quotas: Optional[dict] = None,
+    ):
+        self.pool = pool
+        self.node = node
+        self.check_proxies = check_proxies
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.requests_per_worker = requests_per_worker
+        self.check_interval = check_interval
+        # LANGUAGE_QUOTAS of the job
+        self.quotas = quotas or {}
+        self.status_key = STATUS_KEY % {"spider": pool.spider_name}
+        # Last status seen for each worker, used to compute throughput
+        self.last_status: Dict[str, dict] = {}
+
+    def desired_workers(self, queue_depth: int, n_of_healthy_proxies: int) -> int:
+        """
+        Returns the number of workers needed for the given queue depth.
+        """
+        max_workers = self.max_workers or len(self.pool.worker_proxies)
+        desired = math.ceil(queue_depth / self.requests_per_worker)
+        desired = max(self.min_workers, min(max_workers, desired))
+        return min(desired, n_of_healthy_proxies)
+
+    def finished(self) -> bool:
+        """
+        Returns True if the cluster asked this node to stop, or to drain
+        and all of its workers are done.
+        """
+        if self.node is None:
+            return False
+
+        command = self.node.command()
+        return command == STOP or (command == DRAIN and not self.pool.alive())
+
+    def throughput(self, client: redis.Redis) -> Dict[str, float]:
+        """
+        Returns the pages per second crawled by each worker since the
+        previous check, as reported in {spider}:workers.
+        """
+        throughput = {}
+        for worker_id, status in client.hgetall(self.status_key).items():
+            worker_id = worker_id.decode()
+            status = json.loads(status)
+            last_status = self.last_status.get(worker_id)
+            if last_status and status["time"] > last_status["time"]:
+                throughput[worker_id] = (status["pages"] - last_status["pages"]) / (
+                    status["time"] - last_status["time"]
+                )
+            self.last_status[worker_id] = status
+        return throughput
+
+    def queue_depth(self, client: redis.Redis) -> int:
+        """
+        Returns the number of queued requests that the workers can still pop,
+        in every language sub-queue and cold tier.
+        """
+        return pending_requests(client, self.pool.spider_name, self.quotas)
+
+    def check(self) -> None:
+        """
+        Runs a single supervision step.
+        """
+        command = None
+        if self.node is not None:
+            self.node.heartbeat()
+            self.pool.assign(self.node.claim_proxies())
+            command = self.node.command()
+
+        if command == STOP:
+            print(f"[{datetime.now()}] Cluster asked to stop")
+            for worker_id in self.pool.active():
+                self.pool.stop(worker_id)
+            return
+
+        client = redis.Redis.from_url(self.pool.redis_url)
+        queue_depth = self.queue_depth(client)
+        throughput = self.throughput(client)
+        client.close()
+
+        for worker_id in self.pool.crashed():
+            print(f"[{datetime.now()}] Worker {worker_id} crashed")
+
+        healthy = [
+            worker_id
+            for worker_id, proxy_url in self.pool.worker_proxies.items()
+            if not self.check_proxies or is_proxy_healthy(proxy_url)
+        ]
+        active = self.pool.active()
+        for worker_id in active:
+            if worker_id not in healthy:
+                print(f"[{datetime.now()}] Stopping {worker_id}: unhealthy proxy")
+                self.pool.stop(worker_id)
+        active = [worker_id for worker_id in active if worker_id in healthy]
+
+        desired = self.desired_workers(queue_depth, len(healthy))
+        print(
+            f"[{datetime.now()}] {queue_depth} requests queued, "
+            f"{len(active)} active workers, {desired} desired"
+        )
+
+        if command == DRAIN:
+            print(f"[{datetime.now()}] Cluster is draining, not starting workers")
+        elif len(active) < desired:
+            idle = [worker_id for worker_id in healthy if worker_id not in active]
+            self.pool.start(idle[: desired - len(active)])
+        elif len(active) > desired:
+            slowest = sorted(active, key=lambda worker_id: throughput.get(worker_id, 0))
+            for worker_id in slowest[: len(active) - desired]:
+                print(f"[{datetime.now()}] Stopping {worker_id}: scaling down")
+                self.pool.stop(worker_id)
+
+    def run(self, duration: float) -> None:
+        """
+        Supervises the pool during duration seconds.
+        """
+        deadline = time.time() + duration
+        while time.time() < deadline and not self.finished():
+            self.check()
+            time.sleep(max(0, min(self.check_interval, deadline - time.time())))
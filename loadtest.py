@@ -0,0 +1,300 @@
+"""
+This is the entry point of the end-to-end load test of the crawler.
+
+It starts the Disboard and FlareSolverr simulator of disboard.simulator on a
+local port, runs the ServersSpider against it with the project settings,
+and reports the pages and items per second, the p50 and p99 latency of the
+proxy requests, and the peak RSS of the process. With --hedge, a second
+proxy is started and the slow requests are hedged to it.
+
+The load test uses its own spider name, so that it doesn't touch the Redis
+keys of the real jobs, and doesn't store the items in Postgres.
+"""
+import json
+import os
+import resource
+import sys
+import time
+import redis
+
+from argparse import ArgumentParser, Namespace
+from datetime import datetime
+from disboard.simulator import DisboardSimulator, FlareSolverrSimulator
+from disboard.spiders.servers import ServersSpider
+from dotenv import load_dotenv, find_dotenv
+from scrapy import signals
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from typing import List
+
+
+def add_cli_arguments() -> Namespace:
+    """
+    Add command line arguments and return the parser.
+    """
+    parser = ArgumentParser(description="Load-test the crawler against a simulator")
+
+    parser.add_argument(
+        "-n",
+        "--spider-name",
+        help="The name of the spider, used as the prefix of its Redis keys",
+        type=str,
+        default="loadtest",
+    )
+    parser.add_argument(
+        "-redis",
+        "--redis-url",
+        help="Redis URL. Defaults to REDIS_URL",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        help="Maximum duration of the load test, in seconds",
+        type=int,
+        default=60,
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        help="The number of concurrent requests of the spider",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--pages",
+        help="The number of pages of each listing",
+        type=int,
+        default=10,
+    )
+    parser.add_argument(
+        "--tags",
+        help="The number of tags of the tag graph",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--rate-429",
+        help="The share of the solves that return a 429 page",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--block-rate",
+        help="The share of the solves that are blocked by Cloudflare",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--solve-latency",
+        help="The mean solve latency of the proxy, in seconds",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument(
+        "--solve-latency-jitter",
+        help="The standard deviation of the solve latency, in seconds",
+        type=float,
+        default=0.1,
+    )
+    parser.add_argument(
+        "--slow-rate",
+        help="The share of the solves that get stuck for --slow-latency seconds",
+        type=float,
+        default=0.0,
+    )
+    parser.add_argument(
+        "--slow-latency",
+        help="The latency of the stuck solves, in seconds",
+        type=float,
+        default=30.0,
+    )
+    parser.add_argument(
+        "--hedge",
+        help="Start a second proxy and hedge the slow requests to it",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--json",
+        help="Print the report as JSON",
+        action="store_true",
+        default=False,
+    )
+
+    return parser.parse_args()
+
+
+def percentile(values: List[float], q: float) -> float:
+    """
+    Returns the q-th percentile of the values, with 0 <= q <= 100.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def get_peak_rss() -> int:
+    """
+    Returns the peak resident set size of the process in bytes.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+class LoadTestMonitor:
+    """
+    Collects the throughput and latency of the crawl.
+    """
+
+    def __init__(self):
+        self.pages = 0
+        self.items = 0
+        self.latencies: List[float] = []
+        self.start_time = None
+        self.end_time = None
+
+    def connect(self, crawler) -> None:
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            self.response_downloaded, signal=signals.response_downloaded
+        )
+        crawler.signals.connect(
+            self.response_received, signal=signals.response_received
+        )
+        crawler.signals.connect(self.item_scraped, signal=signals.item_scraped)
+
+    def spider_opened(self, spider):
+        self.start_time = time.time()
+
+    def spider_closed(self, spider):
+        self.end_time = time.time()
+
+    def response_downloaded(self, response, request, spider):
+        # Round trip of the request to the proxy, including the solve
+        latency = request.meta.get("download_latency")
+        if latency is not None:
+            self.latencies.append(latency)
+
+    def response_received(self, response, request, spider):
+        self.pages += 1
+
+    def item_scraped(self, item, response, spider):
+        self.items += 1
+
+    def report(self) -> dict:
+        elapsed = (self.end_time or time.time()) - (self.start_time or time.time())
+        elapsed = max(elapsed, 1e-9)
+        return {
+            "elapsed": round(elapsed, 3),
+            "pages": self.pages,
+            "items": self.items,
+            "pages_per_second": round(self.pages / elapsed, 3),
+            "items_per_second": round(self.items / elapsed, 3),
+            "latency_p50": round(percentile(self.latencies, 50), 4),
+            "latency_p99": round(percentile(self.latencies, 99), 4),
+            "peak_rss_mb": round(get_peak_rss() / 1024**2, 1),
+        }
+
+
+def reset_redis_keys(redis_url: str, spider_name: str, start_url: str) -> None:
+    """
+    Deletes the Redis keys of the load test and pushes its start URL.
+    """
+    client = redis.Redis.from_url(redis_url)
+    keys = list(client.scan_iter(f"{spider_name}:*"))
+    if keys:
+        client.delete(*keys)
+    client.lpush(f"{spider_name}:start_urls", start_url)
+    client.close()
+
+
+def run_load_test(args: Namespace) -> dict:
+    """
+    Runs the spider against the simulator and returns the report.
+    """
+    disboard = DisboardSimulator(
+        n_of_pages=args.pages,
+        n_of_tags=args.tags,
+        rate_429=args.rate_429,
+        block_rate=args.block_rate,
+    )
+    proxies = [
+        FlareSolverrSimulator(
+            ("127.0.0.1", 0),
+            disboard,
+            solve_latency=args.solve_latency,
+            solve_latency_jitter=args.solve_latency_jitter,
+            slow_rate=args.slow_rate,
+            slow_latency=args.slow_latency,
+        )
+        for _ in range(2 if args.hedge else 1)
+    ]
+    for proxy in proxies:
+        proxy.start()
+
+    redis_url = args.redis_url or os.environ["REDIS_URL"]
+    reset_redis_keys(redis_url, args.spider_name, "https://disboard.org/servers?fl=de")
+
+    settings = get_project_settings()
+    settings.setdict(
+        {
+            "PROXY_URL": f"{proxies[0].url}/v1",
+            "HEDGE_ENABLED": args.hedge,
+            "HEDGE_PROXY_URLS": [f"{proxy.url}/v1" for proxy in proxies],
+            "HEDGE_MIN_DELAY": 0,
+            "REDIS_URL": redis_url,
+            "LANGUAGE": "de",
+            "FOLLOW_PAGINATION_LINKS": True,
+            "FOLLOW_CATEGORY_LINKS": True,
+            "FOLLOW_TAG_LINKS": True,
+            "ITEM_PIPELINES": {"disboard.pipelines.ServersGuildIdPipeline": 299},
+            "CONCURRENT_REQUESTS": args.concurrency,
+            "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+            "DOWNLOAD_DELAY": 0,
+            "AUTOTHROTTLE_ENABLED": False,
+            "CLOSESPIDER_TIMEOUT": args.duration,
+            "LOG_FILE": None,
+            "LOG_STDOUT": False,
+            "LOG_LEVEL": "WARNING",
+        },
+        priority="cmdline",
+    )
+
+    class NamedSpider(ServersSpider):
+        name = args.spider_name
+        # Close as soon as the crawl is over
+        max_idle_time = 5
+
+    monitor = LoadTestMonitor()
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(NamedSpider)
+    monitor.connect(crawler)
+    process.crawl(crawler)
+    process.start()
+
+    for proxy in proxies:
+        proxy.stop()
+    report = monitor.report()
+    if args.hedge:
+        for key in ("requests", "wins", "losses", "capped"):
+            report[f"hedge_{key}"] = crawler.stats.get_value(f"hedge/{key}", 0)
+    return report
+
+
+if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_dotenv(find_dotenv())
+
+    args = add_cli_arguments()
+    print(f"[{datetime.now()}] Running the load test for {args.duration} seconds...")
+    report = run_load_test(args)
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"[{datetime.now()}] {key}: {value}")
@@ -0,0 +1,193 @@
+"""
+This is the entry point to parse the raw page archive again.
+
+When the parser changes, e.g. when a field is added to DisboardServerItem,
+this script runs the spider's parse method and the item pipelines over
+the pages archived by disboard.extensions.PageArchiver, instead of crawling
+them again.
+
+The archive is split into chunks of pages that are parsed by a pool of
+processes, each one reading its chunks from the memory-mapped segments.
+"""
+import os
+import sys
+
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from dotenv import load_dotenv, find_dotenv
+from disboard.archive import list_segments, read_index, read_pages, response_from_page
+from disboard.items import DisboardServerItem
+from disboard.spiders.servers import ServersSpider
+from scrapy.crawler import Crawler
+from scrapy.exceptions import NotConfigured
+from scrapy.utils.conf import build_component_list
+from scrapy.utils.misc import create_instance, load_object
+from scrapy.utils.project import get_project_settings
+from typing import Dict, List, Tuple
+
+
+def add_cli_arguments() -> Namespace:
+    """
+    Add command line arguments and return the parser.
+    """
+    parser = ArgumentParser(description="Parse the raw page archive again")
+
+    parser.add_argument(
+        "-n",
+        "--spider-name",
+        help="The name of the spider, used by the item pipelines' Redis keys",
+        type=str,
+        required=True,
+    )
+    parser.add_argument(
+        "-a",
+        "--archive-dir",
+        help="The directory of the archive. Defaults to PAGE_ARCHIVE_DIR",
+        type=str,
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        help="The number of parsing processes. Defaults to the number of CPUs",
+        type=int,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "-c",
+        "--chunk-size",
+        help="The number of pages parsed by a process at a time",
+        type=int,
+        default=1000,
+    )
+    parser.add_argument(
+        "-redis",
+        "--redis-url",
+        help="Redis URL",
+        type=str,
+    )
+    parser.add_argument(
+        "-db",
+        "--db-url",
+        help="Database URL",
+        type=str,
+    )
+
+    return parser.parse_args()
+
+
+def setup_environment(args: Namespace) -> None:
+    """
+    Setup environment variables based on command line arguments.
+    """
+    os.environ["SPIDER_NAME"] = args.spider_name
+    if args.archive_dir:
+        os.environ["PAGE_ARCHIVE_DIR"] = args.archive_dir
+    if args.redis_url:
+        os.environ["REDIS_URL"] = args.redis_url
+    if args.db_url:
+        os.environ["DB_URL"] = args.db_url
+
+
+def get_chunks(directory: str, chunk_size: int) -> List[Tuple[str, list]]:
+    """
+    Splits the pages of the archive into (segment path, index entries) chunks.
+    """
+    chunks = []
+    for segment_path in list_segments(directory):
+        entries = read_index(segment_path)
+        for start in range(0, len(entries), chunk_size):
+            chunks.append((segment_path, entries[start : start + chunk_size]))
+    return chunks
+
+
+def reparse_chunk(segment_path: str, entries: list) -> Dict[str, int]:
+    """
+    Parses a chunk of archived pages and sends the items through the item
+    pipelines. Returns the stats of the chunk.
+    """
+
+    class NamedSpider(ServersSpider):
+        name = os.environ["SPIDER_NAME"]
+
+    crawler = Crawler(NamedSpider, get_project_settings())
+    crawler.stats = load_object(crawler.settings["STATS_CLASS"])(crawler)
+    spider = crawler._create_spider()
+    crawler.spider = spider
+
+    pipelines = []
+    for path in build_component_list(crawler.settings.getwithbase("ITEM_PIPELINES")):
+        try:
+            pipeline = create_instance(load_object(path), crawler.settings, crawler)
+        except NotConfigured:
+            continue
+        pipelines.append(pipeline)
+    for pipeline in pipelines:
+        if hasattr(pipeline, "open_spider"):
+            pipeline.open_spider(spider)
+
+    try:
+        for page in read_pages(segment_path, entries):
+            crawler.stats.inc_value("reparse/pages")
+            items = [
+                result
+                for result in spider.parse(response_from_page(page))
+                if isinstance(result, DisboardServerItem)
+            ]
+            # Like disboard.middlewares.ItemBatchMiddleware
+            for pipeline in pipelines:
+                if items and hasattr(pipeline, "process_items"):
+                    pipeline.process_items(items, spider)
+            for item in items:
+                for pipeline in pipelines:
+                    item = pipeline.process_item(item, spider)
+                crawler.stats.inc_value("reparse/items")
+    finally:
+        for pipeline in pipelines:
+            if hasattr(pipeline, "close_spider"):
+                pipeline.close_spider(spider)
+
+    return {
+        key: value
+        for key, value in crawler.stats.get_stats().items()
+        if isinstance(value, int)
+    }
+
+
+def reparse_archive(directory: str, processes: int, chunk_size: int) -> Counter:
+    """
+    Parses the whole archive with a pool of processes.
+    Returns the stats aggregated over all chunks.
+    """
+    chunks = get_chunks(directory, chunk_size)
+    print(f"[{datetime.now()}] Parsing {len(chunks)} chunks of the archive...")
+
+    stats = Counter()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(reparse_chunk, *chunk) for chunk in chunks]
+        for i, future in enumerate(as_completed(futures), start=1):
+            stats.update(future.result())
+            print(
+                f"[{datetime.now()}] {i}/{len(chunks)} chunks parsed, "
+                f"{stats['reparse/pages']} pages, {stats['reparse/items']} items"
+            )
+    return stats
+
+
+if __name__ == "__main__":
+    # Load environment variables from .env file
+    load_dotenv(find_dotenv())
+    print(f"[{datetime.now()}] Loaded environment variables from .env file")
+
+    args = add_cli_arguments()
+    setup_environment(args)
+
+    directory = os.getenv("PAGE_ARCHIVE_DIR", "archive")
+    if not os.path.isdir(directory):
+        print(f"[{datetime.now()}] No archive found in {directory}")
+        sys.exit(1)
+
+    stats = reparse_archive(directory, args.processes, args.chunk_size)
+    for key, value in sorted(stats.items()):
+        print(f"[{datetime.now()}] {key}: {value}")
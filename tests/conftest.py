@@ -1,5 +1,6 @@
 import os
 import pytest
+import redis
 from scrapy.http import HtmlResponse
 from scrapy.settings import Settings
 
@@ -15,6 +16,22 @@ def settings():
     )
 
 
+@pytest.fixture
+def redis_client():
+    client = redis.Redis.from_url(
+        os.getenv("TEST_REDIS_URL", "redis://localhost:6379/15")
+    )
+    try:
+        client.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis server is not available")
+
+    client.flushdb()
+    yield client
+    client.flushdb()
+    client.close()
+
+
 @pytest.fixture
 def spider_mock():
     class SpiderMock:
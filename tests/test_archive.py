@@ -0,0 +1,56 @@
+import pytest
+import reparse
+from disboard.archive import (
+    PageArchiveWriter,
+    list_segments,
+    page_from_response,
+    read_index,
+    read_pages,
+    response_from_page,
+)
+from disboard.commons.helpers import count_disboard_server_items
+from scrapy.settings import Settings
+
+
+@pytest.fixture
+def archive_dir(tmp_path, sample_response):
+    writer = PageArchiveWriter(str(tmp_path), "host:1234", segment_size=1)
+    for _ in range(3):
+        writer.write(page_from_response(sample_response, "de"))
+    writer.close()
+    return str(tmp_path)
+
+
+def test_write_and_read_pages(archive_dir, sample_response):
+    segments = list_segments(archive_dir)
+    # A new segment is started once the current one is over segment_size
+    assert len(segments) == 3
+
+    entries = read_index(segments[0])
+    pages = list(read_pages(segments[0], entries))
+
+    assert len(pages) == 1
+    assert pages[0]["url"] == sample_response.url
+    assert pages[0]["language"] == "de"
+
+
+def test_response_from_page(sample_response):
+    response = response_from_page(page_from_response(sample_response, "de"))
+
+    assert response.headers.get("Date") == sample_response.headers.get("Date")
+    assert response.request.meta["language"] == "de"
+    assert count_disboard_server_items(response) == count_disboard_server_items(
+        sample_response
+    )
+
+
+def test_reparse_chunk(archive_dir, sample_response, monkeypatch):
+    settings = Settings({"LANGUAGE": "de", "ITEM_PIPELINES": {}})
+    monkeypatch.setenv("SPIDER_NAME", "test")
+    monkeypatch.setattr(reparse, "get_project_settings", lambda: settings)
+
+    segment_path, entries = reparse.get_chunks(archive_dir, chunk_size=10)[0]
+    stats = reparse.reparse_chunk(segment_path, entries)
+
+    assert stats["reparse/pages"] == 1
+    assert stats["reparse/items"] == count_disboard_server_items(sample_response)
@@ -0,0 +1,19 @@
+from benchmark import compare, find_regressions, run_benchmark
+
+
+class TestBenchmark:
+    def test_run_benchmark(self):
+        assert run_benchmark(lambda: sum(range(100)), repeat=1) > 0
+
+    def test_find_regressions(self):
+        timings = {"fast": 1.0, "slow": 2.0, "tolerant": 2.0, "new": 1.0}
+        baselines = {
+            "fast": {"seconds": 1.0},
+            "slow": {"seconds": 1.0},
+            "tolerant": {"seconds": 1.0, "threshold": 3.0},
+        }
+
+        ratios = compare(timings, baselines)
+
+        assert ratios == {"fast": 1.0, "slow": 2.0, "tolerant": 2.0, "new": None}
+        assert find_regressions(ratios, baselines, threshold=1.25) == {"slow": 2.0}
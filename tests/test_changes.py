@@ -0,0 +1,133 @@
+import dataclasses
+import time
+import pytest
+from disboard.changes import ChangeStreamConsumer, item_digest
+from disboard.commons.helpers import extract_disboard_server_items
+from disboard.pipelines import GuildChangeStreamPipeline
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+
+
+@pytest.fixture
+def items(sample_response):
+    return list(extract_disboard_server_items(sample_response))
+
+
+@pytest.fixture
+def pipeline(redis_client, spider_mock):
+    pipeline = GuildChangeStreamPipeline(
+        spider_name="test",
+        redis_url="redis://localhost:6379/15",
+        stats=StatsCollector(get_crawler()),
+        maxlen=1000,
+    )
+    pipeline.open_spider(spider_mock)
+    yield pipeline
+    pipeline.close_spider(spider_mock)
+
+
+def test_item_digest(items):
+    item = items[0]
+    assert item_digest(item) == item_digest(dataclasses.replace(item, scrape_time=0))
+    assert item_digest(item) != item_digest(
+        dataclasses.replace(item, server_description="Another description")
+    )
+
+
+class TestGuildChangeStreamPipeline:
+    def _events(self, redis_client):
+        return [
+            {key.decode(): value.decode() for key, value in fields.items()}
+            for _, fields in redis_client.xrange("test:changes")
+        ]
+
+    def test_publishes_new_and_changed_guilds(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        item = items[0]
+        pipeline.process_item(item, spider_mock)
+        pipeline.process_item(item, spider_mock)
+        pipeline.process_item(
+            dataclasses.replace(item, server_name="Renamed"), spider_mock
+        )
+
+        events = self._events(redis_client)
+        assert [event["kind"] for event in events] == ["new", "changed"]
+        assert events[0]["guild_id"] == item.guild_id
+        assert float(events[0]["scrape_time"]) == item.scrape_time
+        assert pipeline.stats.get_value("change_stream/new") == 1
+        assert pipeline.stats.get_value("change_stream/changed") == 1
+
+    def test_publishes_a_batch_after_its_last_item(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        pipeline.process_items(items, spider_mock)
+        for item in items[:-1]:
+            pipeline.process_item(item, spider_mock)
+        assert self._events(redis_client) == []
+
+        pipeline.process_item(items[-1], spider_mock)
+        assert len(self._events(redis_client)) == len(items)
+        assert pipeline.pending == []
+
+    def test_a_lost_item_only_holds_back_its_batch(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        first, second = items[:5], items[5:10]
+        pipeline.process_items(first, spider_mock)
+        pipeline.process_items(second, spider_mock)
+        # The last item of the first batch never reaches the pipeline
+        for item in first[:-1]:
+            pipeline.process_item(item, spider_mock)
+        for item in second:
+            pipeline.process_item(item, spider_mock)
+
+        assert len(self._events(redis_client)) == 9
+        assert len(pipeline.batches) == 1
+
+    def test_gives_up_on_a_batch_after_the_timeout(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        pipeline.batches.timeout = 0.01
+        pipeline.process_items(items[:2], spider_mock)
+        time.sleep(0.02)
+        pipeline.process_item(items[0], spider_mock)
+
+        assert len(self._events(redis_client)) == 1
+        assert len(pipeline.batches) == 0
+
+
+class TestChangeStreamConsumer:
+    def _publish(self, redis_client, n_of_events):
+        for i in range(n_of_events):
+            redis_client.xadd("test:changes", {"guild_id": i, "kind": "new"})
+
+    def test_reads_incrementally(self, redis_client):
+        self._publish(redis_client, 3)
+        consumer = ChangeStreamConsumer(redis_client, "test", "indexer", "indexer-1")
+
+        events = consumer.read(count=2)
+        assert [event["guild_id"] for _, event in events] == ["0", "1"]
+        assert consumer.ack([event_id for event_id, _ in events]) == 2
+
+        events = consumer.read(count=2)
+        assert [event["guild_id"] for _, event in events] == ["2"]
+        assert consumer.read() == []
+
+    def test_groups_read_independently(self, redis_client):
+        self._publish(redis_client, 2)
+        indexer = ChangeStreamConsumer(redis_client, "test", "indexer", "indexer-1")
+        mailer = ChangeStreamConsumer(redis_client, "test", "mailer", "mailer-1")
+
+        assert len(indexer.read()) == 2
+        assert len(mailer.read()) == 2
+
+    def test_claims_stale_events(self, redis_client):
+        self._publish(redis_client, 2)
+        dead = ChangeStreamConsumer(redis_client, "test", "indexer", "indexer-1")
+        alive = ChangeStreamConsumer(redis_client, "test", "indexer", "indexer-2")
+        dead.read()
+
+        assert alive.claim_stale(min_idle_time=60_000) == []
+        events = alive.claim_stale(min_idle_time=0)
+        assert [event["guild_id"] for _, event in events] == ["0", "1"]
@@ -0,0 +1,95 @@
+import multiprocessing
+import pytest
+from disboard.cluster import ClusterNode, pooled_proxy_urls
+
+REDIS_URL = "redis://localhost:6379/15"
+
+
+def run_node(node_id, proxy_urls, barrier, results):
+    """
+    Stands in for a crawl.py process running on another host.
+    """
+    node = ClusterNode(REDIS_URL, "test", node_id=node_id)
+    node.register(proxy_urls)
+    barrier.wait()
+
+    # Nodes release their extra proxies and claim free ones on each round
+    for _ in range(3):
+        node.claim_proxies()
+        barrier.wait()
+
+    results.put((node_id, node.claim_proxies()))
+    node.close()
+
+
+def test_nodes_share_proxies_without_overlap(redis_client):
+    n_of_nodes = 3
+    barrier = multiprocessing.Barrier(n_of_nodes)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=run_node,
+            args=(
+                f"node-{i}",
+                [f"http://node-{i}:{8191 + j}/v1" for j in range(i + 1)],
+                barrier,
+                results,
+            ),
+        )
+        for i in range(n_of_nodes)
+    ]
+    for process in processes:
+        process.start()
+    claims = dict(results.get(timeout=30) for _ in processes)
+    for process in processes:
+        process.join()
+
+    all_proxies = [proxy for proxies in claims.values() for proxy in proxies]
+    assert len(all_proxies) == len(set(all_proxies)) == 6
+    assert all(len(proxies) == 2 for proxies in claims.values())
+
+
+def test_dead_node_proxies_are_reassigned(redis_client):
+    alive = ClusterNode(REDIS_URL, "test", node_id="alive")
+    dead = ClusterNode(REDIS_URL, "test", node_id="dead", heartbeat_timeout=-1)
+    dead.register(["http://a/v1", "http://b/v1"])
+    alive.register([])
+
+    assert len(dead.claim_proxies()) == 2
+    assert alive.claim_proxies() == ["http://a/v1", "http://b/v1"]
+    assert alive.nodes() == ["alive"]
+
+
+def test_local_proxies_stay_on_their_node(redis_client):
+    first = ClusterNode(REDIS_URL, "test", node_id="first")
+    second = ClusterNode(REDIS_URL, "test", node_id="second")
+    first.register(["http://localhost:8191/v1", "http://a/v1"])
+    second.register(["http://localhost:8191/v1", "http://127.0.0.1:8192/v1"])
+
+    assert first.claim_proxies() == ["http://a/v1", "http://localhost:8191/v1"]
+    assert second.claim_proxies() == [
+        "http://127.0.0.1:8192/v1",
+        "http://localhost:8191/v1",
+    ]
+    assert pooled_proxy_urls(redis_client, "test", "first") == [
+        "http://a/v1",
+        "http://localhost:8191/v1",
+    ]
+
+    # The local proxies of a dead node are forgotten
+    second.leave()
+    assert first.claim_proxies() == ["http://a/v1", "http://localhost:8191/v1"]
+    assert redis_client.scard("test:proxies") == 2
+
+
+def test_cluster_command_and_stats(redis_client):
+    node = ClusterNode(REDIS_URL, "test", node_id="node")
+    node.send_command("drain")
+    assert node.command() == "drain"
+
+    redis_client.hset("test:stats:closed", "pages", 10)
+    redis_client.hset("test:workers", "w", '{"time": 1, "pages": 5, "items": 2}')
+    assert node.stats() == {"pages": 15, "items": 2}
+
+    node.send_command(None)
+    assert node.command() is None
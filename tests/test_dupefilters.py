@@ -0,0 +1,49 @@
+import time
+import pytest
+from disboard.dupefilters import RecrawlDupeFilter, request_fingerprint
+from scrapy.http import Request
+
+
+class TestRecrawlDupeFilter:
+    @pytest.fixture
+    def dupefilter(self, redis_client):
+        return RecrawlDupeFilter(
+            redis_client,
+            "test:dupefilter",
+            revisit_key="test:revisit",
+            negative_key="test:negative",
+            grace=60,
+        )
+
+    def test_filters_seen_requests(self, dupefilter):
+        request = Request("https://disboard.org/servers?fl=de")
+
+        assert not dupefilter.request_seen(request)
+        assert dupefilter.request_seen(request)
+
+    def test_lets_due_requests_through_once(self, dupefilter, redis_client):
+        request = Request("https://disboard.org/servers?fl=de")
+        fp = request_fingerprint(request)
+        dupefilter.request_seen(request)
+
+        redis_client.zadd("test:revisit", {fp: time.time() + 3600})
+        assert dupefilter.request_seen(request)
+
+        redis_client.zadd("test:revisit", {fp: time.time() - 1})
+        assert not dupefilter.request_seen(request)
+        assert dupefilter.request_seen(request)
+        assert redis_client.zscore("test:revisit", fp) > time.time()
+
+    def test_filters_requests_in_negative_cache(self, dupefilter, redis_client):
+        request = Request("https://disboard.org/servers/tag/dead?fl=de")
+        fp = request_fingerprint(request)
+
+        redis_client.zadd("test:negative", {fp: time.time() + 3600})
+        assert dupefilter.request_seen(request)
+        assert dupefilter.negative_hit
+        assert not redis_client.sismember("test:dupefilter", fp)
+
+        redis_client.zadd("test:negative", {fp: time.time() - 1})
+        assert not dupefilter.request_seen(request)
+        assert not dupefilter.negative_hit
+        assert redis_client.zscore("test:negative", fp) is None
@@ -0,0 +1,392 @@
+import json
+import os
+import time
+import tracemalloc
+import pytest
+from disboard.dupefilters import request_fingerprint
+from disboard.extensions import (
+    CrawlEfficiency,
+    LatencyMetrics,
+    NegativeCache,
+    Profiler,
+    RecrawlScheduler,
+    WorkerControl,
+    read_efficiency,
+)
+from disboard.metrics import PROXY_ROUND_TRIP, QUEUE_DWELL, LatencyRecorder
+from disboard.workers import send_command, wait_until_ready
+from scrapy.http import HtmlResponse, Request
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+
+
+class TestWorkerControl:
+    @pytest.fixture
+    def crawler_mock(self):
+        class EngineMock:
+            paused = False
+
+            def pause(self):
+                self.paused = True
+
+            def unpause(self):
+                self.paused = False
+
+        class CrawlerMock:
+            engine = EngineMock()
+            stats = StatsCollector(get_crawler())
+
+        return CrawlerMock()
+
+    @pytest.fixture
+    def extension(self, redis_client, crawler_mock, spider_mock):
+        spider_mock.name = "test"
+        extension = WorkerControl(
+            crawler=crawler_mock,
+            redis_url="redis://localhost:6379/15",
+            worker_id="worker-1",
+            poll_interval=60,
+        )
+        extension.spider_opened(spider_mock)
+        yield extension
+        extension.spider_closed(spider_mock)
+
+    def test_spider_opened_reports_readiness(self, extension, redis_client):
+        assert wait_until_ready(redis_client, "test", "worker-1", timeout=1)
+
+    def test_poll_executes_commands(self, extension, redis_client, crawler_mock):
+        send_command(redis_client, "test", "worker-1", "pause")
+        extension.poll()
+        assert crawler_mock.engine.paused
+
+        send_command(redis_client, "test", "worker-1", "resume")
+        extension.poll()
+        assert not crawler_mock.engine.paused
+        assert redis_client.llen("test:control:worker-1") == 0
+
+    def test_poll_reports_status(self, extension, redis_client, crawler_mock):
+        crawler_mock.stats.set_value("response_received_count", 3)
+        extension.poll()
+
+        status = json.loads(redis_client.hget("test:workers", "worker-1"))
+        assert status["pages"] == 3
+        assert status["paused"] is False
+
+
+class TestRecrawlScheduler:
+    @pytest.fixture
+    def crawler_mock(self):
+        class EngineMock:
+            def __init__(self):
+                self.requests = []
+
+            def crawl(self, request):
+                self.requests.append(request)
+
+        class CrawlerMock:
+            engine = EngineMock()
+            stats = StatsCollector(get_crawler())
+
+        return CrawlerMock()
+
+    @pytest.fixture
+    def extension(self, redis_client, crawler_mock, spider_mock):
+        spider_mock.name = "test"
+        extension = RecrawlScheduler(
+            crawler=crawler_mock,
+            redis_url="redis://localhost:6379/15",
+            min_interval=3600,
+            max_interval=7 * 24 * 3600,
+            check_interval=60,
+        )
+        extension.spider_opened(spider_mock)
+        yield extension
+        extension.spider_closed(spider_mock)
+
+    @pytest.mark.parametrize(
+        "url, interval",
+        [
+            ("https://disboard.org/servers?fl=de", 3600),
+            ("https://disboard.org/servers/category/gaming?fl=de", 4 * 3600),
+            ("https://disboard.org/servers/tag/anime/3?fl=de", 36 * 3600),
+            ("https://disboard.org/servers/tag/anime/50?fl=de", 7 * 24 * 3600),
+            ("https://disboard.org/servers/tag/18?fl=de", 12 * 3600),
+            ("https://disboard.org/servers/tag/18/2?fl=de", 24 * 3600),
+        ],
+    )
+    def test_initial_interval(self, extension, url, interval):
+        assert extension.initial_interval(url) == interval
+
+    def test_next_interval(self, extension):
+        assert extension.next_interval(4 * 3600, changed=True) == 2 * 3600
+        assert extension.next_interval(4 * 3600, changed=False) == 8 * 3600
+        assert extension.next_interval(3600, changed=True) == 3600
+
+    def test_response_received_schedules_revisit(
+        self, extension, redis_client, sample_response, spider_mock
+    ):
+        request = Request("https://disboard.org/servers?fl=de", priority=5)
+        extension.response_received(sample_response, request, spider_mock)
+        extension.response_received(sample_response, request, spider_mock)
+
+        fp = request_fingerprint(request)
+        freshness = json.loads(redis_client.hget("test:freshness", fp))
+        assert freshness["visits"] == 2
+        assert freshness["changes"] == 0
+        assert freshness["interval"] == 2 * 3600
+        assert redis_client.zscore("test:revisit", fp) > time.time() + 3600
+
+    def test_schedule_due_requests(
+        self, extension, redis_client, crawler_mock, sample_response, spider_mock
+    ):
+        request = Request("https://disboard.org/servers?fl=de", priority=5)
+        extension.response_received(sample_response, request, spider_mock)
+        redis_client.zadd("test:revisit", {request_fingerprint(request): 0})
+        # A revisit without freshness data is not scheduled
+        redis_client.zadd("test:revisit", {"unknown": 0})
+
+        extension.schedule_due_requests()
+        extension.schedule_due_requests()
+
+        assert len(crawler_mock.engine.requests) == 1
+        assert crawler_mock.stats.get_value("recrawl/scheduled") == 1
+        recrawl = crawler_mock.engine.requests[0]
+        assert recrawl.url == request.url
+        assert recrawl.priority == 5
+        assert recrawl.dont_filter
+        assert recrawl.meta["language"] == "de"
+
+
+class TestNegativeCache:
+    @pytest.fixture
+    def extension(self, redis_client, spider_mock):
+        class CrawlerMock:
+            stats = StatsCollector(get_crawler())
+
+        spider_mock.name = "test"
+        extension = NegativeCache(
+            crawler=CrawlerMock(),
+            redis_url="redis://localhost:6379/15",
+            ttl=3600,
+            jitter=0.2,
+        )
+        extension.spider_opened(spider_mock)
+        yield extension
+        extension.spider_closed(spider_mock)
+
+    def test_negative_reason(self, extension, sample_response, blocked_response):
+        not_found = HtmlResponse(
+            url="https://disboard.org/servers/tag/dead",
+            status=404,
+            body=b"<html><title>404 Not Found</title></html>",
+        )
+        empty = HtmlResponse(
+            url="https://disboard.org/servers/tag/empty",
+            body=b"<html><title>Discord Servers | DISBOARD</title></html>",
+        )
+
+        assert extension.negative_reason(sample_response) is None
+        assert extension.negative_reason(blocked_response) is None
+        assert extension.negative_reason(not_found) == "not_found"
+        assert extension.negative_reason(empty) == "empty"
+
+    def test_pages_without_a_title_are_not_added(
+        self, extension, redis_client, spider_mock
+    ):
+        request = Request("https://disboard.org/servers/tag/chill")
+        for body in [b"", b"<html><body>Bad gateway</body></html>"]:
+            response = HtmlResponse(url=request.url, body=body, request=request)
+            assert extension.negative_reason(response) is None
+            extension.response_received(response, request, spider_mock)
+
+        assert redis_client.zcard("test:negative") == 0
+        not_listing = HtmlResponse(
+            url=request.url, body=b"<html><title>Login</title></html>", request=request
+        )
+        assert extension.negative_reason(not_listing) == "not_listing"
+
+    def test_response_received_adds_entry(self, extension, redis_client, spider_mock):
+        request = Request("https://disboard.org/servers/tag/dead")
+        response = HtmlResponse(url=request.url, status=404, request=request)
+
+        extension.response_received(response, request, spider_mock)
+
+        expiry = redis_client.zscore("test:negative", request_fingerprint(request))
+        assert time.time() + 0.8 * 3600 - 1 < expiry < time.time() + 1.2 * 3600
+        assert extension.crawler.stats.get_value("negative_cache/added/not_found") == 1
+
+
+class TestLatencyMetrics:
+    @pytest.fixture
+    def extension(self):
+        extension = LatencyMetrics(
+            crawler=None,
+            redis_url="redis://localhost:6379/15",
+            worker_id="worker-1",
+            host="127.0.0.1",
+            port=0,
+            flush_interval=60,
+        )
+        extension.recorder = LatencyRecorder()
+        return extension
+
+    def test_queue_dwell_starts_with_the_original_request(self, extension, spider_mock):
+        request = Request("https://disboard.org/servers?fl=de")
+        extension.request_scheduled(request, spider_mock)
+        request.meta["scheduled_time"] -= 10
+        proxy_request = Request(
+            "http://localhost:8191/v1",
+            method="POST",
+            meta={"original_request": request, "redirected_to_flare_solverr": True},
+        )
+        extension.request_scheduled(proxy_request, spider_mock)
+
+        extension.request_reached_downloader(proxy_request, spider_mock)
+
+        histogram = extension.recorder.histograms[QUEUE_DWELL]
+        assert histogram.count == 1
+        assert 10 <= histogram.sum < 11
+
+    def test_retried_requests_start_over(self, extension, spider_mock):
+        request = Request("https://disboard.org/servers?fl=de")
+        extension.request_scheduled(request, spider_mock)
+        request.meta["scheduled_time"] -= 10
+        # See FlareSolverrRetryMiddleware
+        retry_request = request.replace(
+            meta={"original_request": request, "scheduled_time": time.time() - 10}
+        )
+
+        extension.request_scheduled(retry_request, spider_mock)
+
+        assert retry_request.meta["scheduled_time"] > time.time() - 1
+
+    def test_response_downloaded_records_proxy_round_trip(self, extension, spider_mock):
+        request = Request(
+            "https://disboard.org/servers?fl=de", meta={"download_latency": 2}
+        )
+        proxy_request = Request(
+            "http://localhost:8191/v1",
+            method="POST",
+            meta={"redirected_to_flare_solverr": True, "download_latency": 3},
+        )
+        response = HtmlResponse(url=request.url)
+
+        extension.response_downloaded(response, request, spider_mock)
+        extension.response_downloaded(response, proxy_request, spider_mock)
+
+        histogram = extension.recorder.histograms[PROXY_ROUND_TRIP]
+        assert histogram.count == 1
+        assert histogram.sum == 3
+
+
+class TestCrawlEfficiency:
+    @pytest.fixture
+    def extension(self, redis_client, spider_mock):
+        class CrawlerMock:
+            stats = StatsCollector(get_crawler())
+
+        spider_mock.name = "test"
+        extension = CrawlEfficiency(
+            crawler=CrawlerMock(),
+            redis_url="redis://localhost:6379/15",
+            flush_interval=60,
+        )
+        extension.spider_opened(spider_mock)
+        yield extension
+        extension.spider_closed(spider_mock)
+
+    def test_counts_by_origin_and_listing(
+        self, extension, redis_client, spider_mock, sample_response
+    ):
+        request = Request(
+            "https://disboard.org/servers/tag/chill?fl=de", meta={"origin": "tag"}
+        )
+        proxy_request = Request(
+            "http://localhost:8191/v1",
+            method="POST",
+            meta={
+                "original_request": request,
+                "redirected_to_flare_solverr": True,
+                "download_latency": 2.5,
+            },
+        )
+        response = sample_response.replace(url=request.url, request=request)
+
+        extension.response_downloaded(response, proxy_request, spider_mock)
+        extension.response_received(response, request, spider_mock)
+        extension.crawler.stats.inc_value("item_scraped_count/new")
+        extension.item_scraped({}, response, spider_mock)
+        extension.item_scraped({}, response, spider_mock)
+        extension.flush()
+
+        origins = read_efficiency(redis_client, "test:efficiency:origin")
+        assert origins["tag"] == {
+            "solves": 1,
+            "solve_time": 2.5,
+            "pages": 1,
+            "items": 2,
+            "new_guilds": 1,
+        }
+        listings = read_efficiency(redis_client, "test:efficiency:listing")
+        assert listings["tag:chill"]["solves"] == 1
+        assert extension.crawler.stats.get_value("efficiency/tag/new_guilds") == 1
+
+    def test_counts_blocked_requests(self, extension, redis_client, spider_mock):
+        request = Request(
+            "https://disboard.org/servers/2?fl=de", meta={"origin": "pagination"}
+        )
+        # See ServersSpider._handle_0_server_items
+        cloudflare_retry = request.replace(
+            meta={"origin": "retry", "retry_of": "pagination"}
+        )
+        # See FlareSolverrGetSolutionStatusMiddleware
+        rate_limited_retry = Request(
+            "http://localhost:8191/v1",
+            method="POST",
+            meta={"original_request": request, "solution_status": 429},
+        )
+
+        extension.request_scheduled(cloudflare_retry, spider_mock)
+        extension.request_scheduled(rate_limited_retry, spider_mock)
+        extension.request_scheduled(rate_limited_retry, spider_mock)
+        extension.flush()
+
+        origins = read_efficiency(redis_client, "test:efficiency:origin")
+        assert origins == {"pagination": {"blocked": 2}}
+
+
+class TestProfiler:
+    @pytest.fixture
+    def extension(self, tmp_path, spider_mock):
+        crawler = get_crawler(settings_dict={"PROXY_URL": "http://localhost:8191/v1"})
+        crawler.stats = StatsCollector(crawler)
+        spider_mock.name = "test"
+        extension = Profiler(
+            crawler=crawler,
+            directory=str(tmp_path),
+            duration=0,
+            signal_name="SIGUSR1",
+            frames=1,
+            top=10,
+        )
+        extension.spider = spider_mock
+        return extension
+
+    def test_writes_the_profile(self, extension, tmp_path):
+        def allocate():
+            return [str(i) for i in range(10000)]
+
+        extension.start()
+        data = allocate()
+        path = extension.stop()
+
+        assert path.startswith(str(tmp_path / "test-localhost_8191-"))
+        for suffix in (".prof", ".txt", ".tracemalloc.txt"):
+            assert os.path.getsize(f"{path}{suffix}") > 0
+        assert "(allocate)" in open(f"{path}.txt").read()
+        assert extension.crawler.stats.get_value("profiler/profiles") == 1
+        assert len(data) == 10000
+
+    def test_nothing_is_traced_when_idle(self, extension):
+        assert extension.stop() is None
+        assert not tracemalloc.is_tracing()
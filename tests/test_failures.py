@@ -0,0 +1,72 @@
+import os
+import pytest
+from disboard.failures import (
+    BLOCKED,
+    EMPTY_LISTING,
+    FailureCapture,
+    capture_note,
+    classify_empty_response,
+    read_capture,
+)
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+
+
+@pytest.fixture
+def capture(tmp_path):
+    return FailureCapture(str(tmp_path), sample_rate=1.0, max_per_minute=100)
+
+
+def test_classify_empty_response(blocked_response, sample_response):
+    assert classify_empty_response(blocked_response) == BLOCKED
+    assert classify_empty_response(sample_response) == EMPTY_LISTING
+    not_listing = HtmlResponse(url="https://disboard.org/", body=b"<html></html>")
+    assert classify_empty_response(not_listing) == "not_listing"
+
+
+def test_capture_note():
+    assert capture_note(None) == ""
+    path = "failures/blocked/1.zst"
+    assert capture_note(path) == f" (captured in {path})"
+
+
+class TestFailureCapture:
+    def test_captures_responses_by_failure_class(self, capture, blocked_response):
+        path = capture.capture(BLOCKED, blocked_response)
+
+        assert os.path.dirname(path) == os.path.join(capture.directory, BLOCKED)
+        page = read_capture(path)
+        assert page["url"] == blocked_response.url
+        assert page["failure"] == BLOCKED
+        assert page["body"] == blocked_response.text
+
+    def test_samples_responses(self, capture, blocked_response):
+        capture.sample_rate = 0.0
+        assert capture.capture(BLOCKED, blocked_response) is None
+        assert capture.seen == {BLOCKED: 1}
+        assert capture.captured == {}
+
+    def test_rate_limits_each_failure_class(self, capture, blocked_response):
+        capture.max_per_minute = 2
+        paths = [capture.capture(BLOCKED, blocked_response) for _ in range(5)]
+
+        assert sum(path is not None for path in paths) == 2
+        assert capture.capture(EMPTY_LISTING, blocked_response) is not None
+
+    def test_evicts_the_oldest_captures(self, capture, blocked_response):
+        first = capture.capture(BLOCKED, blocked_response)
+        # The captures differ by their capture time, so their size varies a bit
+        capture.max_size = 2 * os.path.getsize(first) + 16
+        paths = [capture.capture(BLOCKED, blocked_response) for _ in range(3)]
+
+        assert not os.path.exists(first)
+        assert all(os.path.exists(path) for path in paths[-2:])
+        assert capture.size <= capture.max_size
+
+    def test_is_shared_by_directory(self, tmp_path):
+        settings = Settings(
+            {"FAILURE_CAPTURE_ENABLED": True, "FAILURE_CAPTURE_DIR": str(tmp_path)}
+        )
+        assert FailureCapture.from_settings(settings) is FailureCapture.from_settings(
+            settings
+        )
@@ -0,0 +1,104 @@
+import pytest
+from disboard.handlers import HedgedDownloadHandler
+from scrapy.http import Request, TextResponse
+from scrapy.utils.test import get_crawler
+from twisted.internet import defer, task
+
+
+class TestHedgedDownloadHandler:
+    @pytest.fixture
+    def handler(self):
+        crawler = get_crawler(
+            settings_dict={
+                "HEDGE_ENABLED": True,
+                "HEDGE_MIN_DELAY": 1,
+                "HEDGE_MIN_SAMPLES": 3,
+                "HEDGE_MAX_RATE": 0.5,
+            }
+        )
+        handler = HedgedDownloadHandler(crawler.settings, crawler)
+        handler.clock = task.Clock()
+        handler.healthy_proxies = ["http://proxy-1/v1", "http://proxy-2/v1"]
+        handler.latencies.extend([2, 3, 4])
+        handler.downloads = {}
+
+        def download_attempt(request, spider):
+            d = defer.Deferred(lambda d: handler.downloads.pop(request.url, None))
+            handler.downloads[request.url] = d
+            return d
+
+        handler.download_attempt = download_attempt
+        return handler
+
+    @pytest.fixture
+    def request_to_proxy(self):
+        return Request(
+            "http://proxy-1/v1",
+            method="POST",
+            meta={"redirected_to_flare_solverr": True},
+        )
+
+    def _respond(self, handler, url):
+        handler.downloads.pop(url).callback(TextResponse(url=url, body=b"{}"))
+
+    def test_hedge_delay(self, handler):
+        assert handler.hedge_delay() == 4
+        handler.latencies.clear()
+        assert handler.hedge_delay() is None
+        handler.latencies.extend([0.1, 0.2, 0.3])
+        assert handler.hedge_delay() == 1
+
+    def test_fast_request_is_not_hedged(self, handler, request_to_proxy):
+        results = []
+        handler.download_request(request_to_proxy, None).addCallback(results.append)
+        self._respond(handler, "http://proxy-1/v1")
+        handler.clock.advance(10)
+
+        assert results[0].url == "http://proxy-1/v1"
+        assert handler.stats.get_value("hedge/requests") is None
+
+    def test_hedge_wins(self, handler, request_to_proxy):
+        results = []
+        handler.download_request(request_to_proxy, None).addCallback(results.append)
+        handler.clock.advance(4)
+        assert set(handler.downloads) == {"http://proxy-1/v1", "http://proxy-2/v1"}
+
+        self._respond(handler, "http://proxy-2/v1")
+
+        assert results[0].url == "http://proxy-2/v1"
+        # The slow download was cancelled
+        assert handler.downloads == {}
+        assert request_to_proxy.meta["hedge_proxy"] == "http://proxy-2/v1"
+        assert handler.stats.get_value("hedge/requests") == 1
+        assert handler.stats.get_value("hedge/wins") == 1
+
+    def test_original_request_wins(self, handler, request_to_proxy):
+        results = []
+        handler.download_request(request_to_proxy, None).addCallback(results.append)
+        handler.clock.advance(4)
+        self._respond(handler, "http://proxy-1/v1")
+
+        assert results[0].url == "http://proxy-1/v1"
+        assert handler.downloads == {}
+        assert handler.stats.get_value("hedge/losses") == 1
+
+    def test_failed_hedge_waits_for_the_original_request(
+        self, handler, request_to_proxy
+    ):
+        results = []
+        handler.download_request(request_to_proxy, None).addCallback(results.append)
+        handler.clock.advance(4)
+        handler.downloads.pop("http://proxy-2/v1").errback(ConnectionError())
+
+        assert results == []
+        assert handler.healthy_proxies == ["http://proxy-1/v1"]
+        self._respond(handler, "http://proxy-1/v1")
+        assert results[0].url == "http://proxy-1/v1"
+
+    def test_hedge_rate_is_capped(self, handler, request_to_proxy):
+        handler.n_of_hedges = 1
+        handler.download_request(request_to_proxy, None)
+        handler.clock.advance(4)
+
+        assert set(handler.downloads) == {"http://proxy-1/v1"}
+        assert handler.stats.get_value("hedge/capped") == 1
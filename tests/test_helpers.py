@@ -3,13 +3,18 @@ from disboard.commons.helpers import (
     blocked_by_cloudflare,
     count_disboard_server_items,
     has_pagination_links,
+    get_url_language,
     get_url_postfixes,
+    get_url_tag,
+    get_url_listing,
+    get_request_origin,
     extract_disboard_server_items,
     request_next_url,
     request_all_category_urls,
     request_all_tag_urls,
 )
 from disboard.items import DisboardServerItem
+from scrapy.http import Request
 
 
 def test_blocked_by_cloudflare(blocked_response):
@@ -31,18 +36,56 @@ def test_get_url_postfixes(spider_mock):
     assert postfixes == ["?fl=de", "?fl=de&sort=-member_count"]
 
 
+def test_get_url_postfixes_for_language(spider_mock):
+    postfixes = get_url_postfixes(spider_mock, "fr")
+    assert postfixes == ["?fl=fr", "?fl=fr&sort=-member_count"]
+
+
+def test_get_url_language():
+    assert get_url_language("https://disboard.org/servers?fl=pt-BR&sort=x") == "pt-BR"
+    assert get_url_language("https://disboard.org/servers/2?fl=") == ""
+    assert get_url_language("https://disboard.org/servers") is None
+
+
+def test_get_url_tag():
+    assert get_url_tag("https://disboard.org/servers/tag/chill/3?fl=de") == "chill"
+    assert get_url_tag("https://disboard.org/servers/tag/anime") == "anime"
+    assert get_url_tag("https://disboard.org/servers/category/gaming") is None
+
+
+def test_get_url_listing():
+    assert get_url_listing("https://disboard.org/servers/tag/chill/3?fl=de") == "tag:chill"
+    assert (
+        get_url_listing("https://disboard.org/servers/category/gaming")
+        == "category:gaming"
+    )
+    assert get_url_listing("https://disboard.org/servers/2?fl=de") == "front"
+
+
+def test_get_request_origin():
+    seed = Request("https://disboard.org/servers?fl=de")
+    tag = Request("https://disboard.org/servers/tag/chill", meta={"origin": "tag"})
+    proxy_request = Request(
+        "http://localhost:8191/v1", method="POST", meta={"original_request": tag}
+    )
+
+    assert get_request_origin(seed) == "seed"
+    assert get_request_origin(tag) == "tag"
+    assert get_request_origin(proxy_request) == "tag"
+
+
 def test_extract_disboard_server_items(sample_response):
     items = list(extract_disboard_server_items(sample_response))
     assert len(items) == 22
     assert isinstance(items[0], DisboardServerItem)
     assert items[0]["server_name"] == "My Hero Academia-Next Generation AU-RP"
-    assert items[0]["tags"] == [
-        {"39": "anime"},
-        {"1236": "my-hero-academia"},
-        {"5838": "boku-no-hero-academia"},
-        {"6787": "rollenspiel"},
-        {"6866": "rollenspiele"},
-    ]
+    assert items[0]["tags"] == (
+        ("39", "anime"),
+        ("1236", "my-hero-academia"),
+        ("5838", "boku-no-hero-academia"),
+        ("6787", "rollenspiel"),
+        ("6866", "rollenspiele"),
+    )
 
 
 def test_request_next_url(spider_mock, sample_response):
@@ -50,6 +93,8 @@ def test_request_next_url(spider_mock, sample_response):
     assert len(requests) == 1
     assert requests[0].url == "https://disboard.org/servers/2?fl=de"
     assert requests[0].priority == 22 + 50
+    assert requests[0].meta["origin"] == "pagination"
+    assert requests[0].meta["source_url"] == sample_response.url
 
 
 def test_request_all_category_urls(spider_mock, sample_response):
@@ -69,6 +114,8 @@ def test_request_all_tag_urls(spider_mock, sample_response):
     assert len(requests) == 280
     assert requests[0].url == "https://disboard.org/servers/tag/community?fl=de"
     assert requests[0].priority == 22 + 1
+    assert requests[0].meta["language"] == "de"
+    assert requests[0].meta["origin"] == "tag"
     assert (
         requests[1].url
         == "https://disboard.org/servers/tag/community?fl=de&sort=-member_count"
@@ -0,0 +1,65 @@
+import copy
+import dataclasses
+import json
+import pickle
+import pytest
+from disboard.commons.helpers import extract_disboard_server_items
+from disboard.items import DisboardServerItem, dump_tags, make_tags
+from itemadapter import ItemAdapter, is_item
+
+
+class TestDisboardServerItem:
+    @pytest.fixture
+    def item(self):
+        return DisboardServerItem(
+            scrape_time=1689026223.0,
+            platform_link="https://disboard.org/server/1234",
+            guild_id="1234",
+            server_name="Server",
+            server_description="Description",
+            tags=make_tags(["39", "1236"], ["anime", "my-hero-academia"]),
+            category="gaming",
+        )
+
+    def test_item_is_compact(self, item):
+        assert not hasattr(item, "__dict__")
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            item.guild_id = "5678"
+
+    def test_item_works_with_itemadapter(self, item):
+        assert is_item(item)
+        adapter = ItemAdapter(item)
+        assert adapter["guild_id"] == "1234"
+        assert adapter.asdict()["tags"] == (("39", "anime"), ("1236", "my-hero-academia"))
+
+    def test_item_is_subscriptable(self, item):
+        assert item["server_name"] == "Server"
+        with pytest.raises(KeyError):
+            item["tags_as_json"]
+
+    def test_item_can_be_copied_and_pickled(self, item):
+        for copied in [copy.copy(item), copy.deepcopy(item)]:
+            assert copied == item
+        unpickled = pickle.loads(pickle.dumps(item))
+        assert unpickled == item
+        assert unpickled.tags[0] is item.tags[0]
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            unpickled.guild_id = "5678"
+
+    def test_tags_as_json(self, item):
+        assert item.tags_as_json() == [{"39": "anime"}, {"1236": "my-hero-academia"}]
+
+    def test_dump_tags(self, item):
+        tags = item.tags + (("7", 'say "hi"'),)
+        assert json.loads(dump_tags(tags)) == [
+            {"39": "anime"},
+            {"1236": "my-hero-academia"},
+            {"7": 'say "hi"'},
+        ]
+        assert dump_tags(()) == "[]"
+
+    def test_tags_and_categories_are_shared(self, sample_response):
+        first = list(extract_disboard_server_items(sample_response))
+        second = list(extract_disboard_server_items(sample_response))
+        assert first[0].tags[0] is second[0].tags[0]
+        assert first[0].category is second[0].category
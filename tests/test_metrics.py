@@ -0,0 +1,131 @@
+import time
+
+from disboard.metrics import (
+    BUCKETS,
+    LATENCY,
+    REDIS,
+    Histogram,
+    LatencyRecorder,
+    TimedRedis,
+    observe_latency,
+    read_cluster_histograms,
+    summarize,
+)
+
+
+class TestHistogram:
+    def test_observe(self):
+        histogram = Histogram()
+        histogram.observe(0.0001)
+        histogram.observe(0.3)
+        histogram.observe(1000)
+
+        assert histogram.count == 3
+        assert histogram.counts[0] == 1
+        assert histogram.counts[BUCKETS.index(0.5)] == 1
+        assert histogram.counts[-1] == 1
+        assert histogram.sum == 1000.3001
+
+    def test_quantile(self):
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.02)
+        for _ in range(10):
+            histogram.observe(3)
+
+        assert 0.01 < histogram.quantile(0.5) <= 0.025
+        assert 2.5 < histogram.quantile(0.99) <= 5
+        assert Histogram().quantile(0.5) == 0.0
+
+
+class TestLatencyRecorder:
+    def test_time_iterable_excludes_the_consumer(self):
+        recorder = LatencyRecorder()
+
+        for _ in recorder.time_iterable("parse", range(3)):
+            time.sleep(0.01)
+
+        histogram = recorder.histograms["parse"]
+        assert histogram.count == 1
+        assert histogram.sum < 0.01
+
+    def test_render(self):
+        recorder = LatencyRecorder()
+        recorder.observe("parse", 0.002)
+        recorder.observe("parse", 0.2)
+
+        text = recorder.render({"worker": "worker-1"})
+
+        assert "# TYPE disboard_stage_latency_seconds histogram" in text
+        assert (
+            'disboard_stage_latency_seconds_bucket{stage="parse",worker="worker-1",'
+            'le="0.0025"} 1'
+        ) in text
+        assert (
+            'disboard_stage_latency_seconds_bucket{stage="parse",worker="worker-1",'
+            'le="+Inf"} 2'
+        ) in text
+        assert (
+            'disboard_stage_latency_seconds_count{stage="parse",worker="worker-1"} 2'
+        ) in text
+
+    def test_flush_aggregates_the_workers(self, redis_client):
+        worker_1, worker_2 = LatencyRecorder(), LatencyRecorder()
+        worker_1.observe("parse", 0.02)
+        worker_2.observe("parse", 0.02)
+        worker_2.observe("redis", 0.001)
+
+        worker_1.flush(redis_client, "test:metrics")
+        worker_2.flush(redis_client, "test:metrics")
+        # Only the new observations are added
+        worker_1.observe("parse", 0.02)
+        worker_1.flush(redis_client, "test:metrics")
+        worker_1.flush(redis_client, "test:metrics")
+
+        histograms = read_cluster_histograms(redis_client, "test")
+        assert histograms["parse"].count == 3
+        assert histograms["redis"].count == 1
+        count, mean, p50, _, _ = summarize(histograms["parse"])
+        assert count == 3
+        assert round(mean, 6) == 0.02
+        assert 0.01 < p50 <= 0.025
+
+
+    def test_disabled_recorder_records_nothing(self):
+        recorder = LatencyRecorder(enabled=False)
+        with recorder.time("parse"):
+            pass
+        values = [1, 2]
+
+        assert recorder.time_iterable("parse", values) is values
+        assert recorder.histograms == {}
+
+
+def test_observe_latency(monkeypatch):
+    @observe_latency("pipeline/test")
+    def process_item(item):
+        return item
+
+    monkeypatch.setattr(LATENCY, "enabled", False)
+    assert process_item(1) == 1
+    assert "pipeline/test" not in LATENCY.histograms
+
+    monkeypatch.setattr(LATENCY, "enabled", True)
+    assert process_item(1) == 1
+    assert LATENCY.histograms["pipeline/test"].count == 1
+
+
+class TestTimedRedis:
+    def test_records_commands_and_pipelines(self, redis_client, monkeypatch):
+        monkeypatch.setattr(LATENCY, "enabled", True)
+        client = TimedRedis(connection_pool=redis_client.connection_pool)
+        before = LATENCY.histograms.get(REDIS, Histogram()).count
+
+        client.set("test:key", 1)
+        with client.pipeline() as pipe:
+            pipe.get("test:key")
+            pipe.get("test:key")
+            pipe.execute()
+        client.close()
+
+        assert LATENCY.histograms[REDIS].count == before + 2
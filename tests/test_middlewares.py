@@ -1,6 +1,21 @@
+import os
+import time
 import pytest
-from scrapy.http import HtmlResponse
-from disboard.middlewares import FlareSolverrGetSolutionStatusMiddleware
+from disboard.commons.helpers import extract_disboard_server_items
+from disboard.spiders.servers import ServersSpider
+from itemadapter import is_item
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse, Request
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+from types import SimpleNamespace
+from disboard.middlewares import (
+    FlareSolverrCacheMiddleware,
+    FlareSolverrGetSolutionStatusMiddleware,
+    ItemBatchMiddleware,
+    RegistryMiddleware,
+    TagOverlapMiddleware,
+)
 
 
 class TestFlareSolverrGetSolutionStatusMiddleware:
@@ -20,9 +35,11 @@ class TestFlareSolverrGetSolutionStatusMiddleware:
             request=None,
             encoding="utf-8",
         )
-        response = middleware.process_response(None, response, spider_mock)
+        request = Request("http://localhost:8191/v1", method="POST")
+        response = middleware.process_response(request, response, spider_mock)
 
         assert response.status == retry_code
+        assert request.meta["solution_status"] == retry_code
 
     def test_process_response_returns_original_response(self, middleware, spider_mock):
         response = HtmlResponse(
@@ -35,3 +52,269 @@ class TestFlareSolverrGetSolutionStatusMiddleware:
         response = middleware.process_response(None, response, spider_mock)
 
         assert response.status == 200
+
+
+class TestTagOverlapMiddleware:
+    @pytest.fixture
+    def middleware(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        middleware = TagOverlapMiddleware(
+            redis_url="redis://localhost:6379/15",
+            stats=StatsCollector(get_crawler()),
+            action="skip",
+        )
+        middleware.spider_opened(spider_mock)
+        yield middleware
+        middleware.spider_closed(spider_mock)
+
+    @pytest.fixture
+    def tag_response(self):
+        cards = "".join(
+            f'<div class="server-name"><a href="/server/join/{guild_id}">x</a></div>'
+            for guild_id in range(100, 124)
+        )
+        html = (
+            f"<html><body>{cards}"
+            '<a class="tag" href="https://disboard.org/servers/tag/friendly">x</a>'
+            '<li class="next"><a href="/servers/tag/chill/6?fl=de">next</a></li>'
+            "</body></html>"
+        )
+        return HtmlResponse(
+            url="https://disboard.org/servers/tag/chill/5?fl=de",
+            body=html,
+            encoding="utf-8",
+        )
+
+    def _next_requests(self, middleware, response, spider):
+        result = [
+            Request("https://disboard.org/servers/tag/chill/6?fl=de", priority=74),
+            Request("https://disboard.org/servers/tag/friendly?fl=de", priority=25),
+        ]
+        return list(middleware.process_spider_output(response, result, spider))
+
+    def test_skips_overlapping_tag(
+        self, middleware, redis_client, tag_response, spider_mock
+    ):
+        redis_client.pfadd("test:tag_sketch:de:chill", *range(100))
+        redis_client.pfadd("test:tag_sketch:de:friendly", *range(200))
+
+        requests = self._next_requests(middleware, tag_response, spider_mock)
+
+        assert [request.url for request in requests] == [
+            "https://disboard.org/servers/tag/friendly?fl=de"
+        ]
+        assert middleware.stats.get_value("tag_overlap/requests_saved") == 1
+
+    def test_demotes_overlapping_tag(
+        self, middleware, redis_client, tag_response, spider_mock
+    ):
+        middleware.action = "demote"
+        redis_client.pfadd("test:tag_sketch:de:chill", *range(100))
+        redis_client.pfadd("test:tag_sketch:de:friendly", *range(200))
+
+        requests = self._next_requests(middleware, tag_response, spider_mock)
+
+        assert requests[0].priority == 74 - 100
+        assert requests[1].priority == 25
+
+    def test_follows_distinct_tag(
+        self, middleware, redis_client, tag_response, spider_mock
+    ):
+        redis_client.pfadd("test:tag_sketch:de:chill", *range(100))
+        redis_client.pfadd("test:tag_sketch:de:friendly", *range(1000, 1200))
+
+        requests = self._next_requests(middleware, tag_response, spider_mock)
+
+        assert len(requests) == 2
+        assert redis_client.pfcount("test:tag_sketch:de:chill") == 124
+
+
+class TestRegistryMiddleware:
+    @pytest.fixture
+    def middleware(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        middleware = RegistryMiddleware(
+            redis_url="redis://localhost:6379/15",
+            stats=StatsCollector(get_crawler()),
+        )
+        middleware.spider_opened(spider_mock)
+        yield middleware
+        middleware.spider_closed(spider_mock)
+
+    def test_registers_categories_and_tags(
+        self, middleware, redis_client, sample_response, spider_mock
+    ):
+        result = [Request("https://disboard.org/servers/2?fl=de")]
+        assert list(
+            middleware.process_spider_output(sample_response, result, spider_mock)
+        ) == result
+
+        categories = redis_client.smembers("test:registry:categories")
+        assert {b"gaming", b"community", b"anime-manga"} <= categories
+        assert redis_client.hget("test:registry:tags", "6") == b"community"
+        assert redis_client.hget("test:registry:tag_names", "6") == b"community"
+        assert middleware.stats.get_value("registry/categories") == len(categories)
+
+    def test_writes_only_new_entries(
+        self, middleware, redis_client, sample_response, spider_mock
+    ):
+        middleware.process_spider_output(sample_response, [], spider_mock)
+        n_of_tags = middleware.stats.get_value("registry/tags")
+        redis_client.delete("test:registry:tags")
+
+        middleware.process_spider_output(sample_response, [], spider_mock)
+        assert middleware.stats.get_value("registry/tags") == n_of_tags
+        assert redis_client.hlen("test:registry:tags") == 0
+
+    def test_loads_the_known_registry(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        redis_client.sadd("test:registry:categories", "gaming")
+        redis_client.hset("test:registry:tags", "6", "community")
+        middleware = RegistryMiddleware(
+            redis_url="redis://localhost:6379/15",
+            stats=StatsCollector(get_crawler()),
+        )
+        middleware.spider_opened(spider_mock)
+
+        assert middleware.known_categories == {"gaming"}
+        assert middleware.known_tags == {"6"}
+        middleware.spider_closed(spider_mock)
+
+
+class TestFlareSolverrCacheMiddleware:
+    @pytest.fixture
+    def middleware(self, tmp_path):
+        return FlareSolverrCacheMiddleware(
+            cache_dir=str(tmp_path), stats=StatsCollector(get_crawler())
+        )
+
+    def _solve(self, middleware, request, response, spider):
+        proxy_request = request.replace(
+            url="http://localhost:8191/v1",
+            method="POST",
+            meta={"original_request": request, "redirected_to_flare_solverr": True},
+        )
+        middleware.process_response(proxy_request, response, spider)
+
+    def test_serves_solved_pages(self, middleware, sample_response, spider_mock):
+        request = Request("https://disboard.org/servers?fl=de")
+        assert middleware.process_request(request, spider_mock) is None
+
+        self._solve(middleware, request, sample_response, spider_mock)
+        response = middleware.process_request(request, spider_mock)
+
+        assert response.url == sample_response.url
+        assert response.text == sample_response.text
+        assert response.request is request
+        assert middleware.stats.get_value("flaresolverr_cache/hit") == 1
+
+    def test_cached_pages_are_parsed(
+        self, middleware, sample_response, spider_mock, settings
+    ):
+        request = Request("https://disboard.org/servers?fl=de")
+        self._solve(middleware, request, sample_response, spider_mock)
+        response = middleware.process_request(request, spider_mock)
+
+        assert response.headers.get("Date") == sample_response.headers.get("Date")
+        spider = ServersSpider()
+        spider.settings = settings
+        items = [result for result in spider.parse(response) if is_item(result)]
+        expected = list(extract_disboard_server_items(sample_response))
+        assert len(items) == len(expected)
+        assert items[0].scrape_time == expected[0].scrape_time
+
+    def test_pages_cached_without_date(self, middleware, sample_response):
+        request = Request("https://disboard.org/servers?fl=de")
+        middleware.store(request, sample_response.replace(headers={}))
+        os.utime(middleware._path(request), (0, 1689026223))
+
+        response = middleware.load(request)
+        assert response.headers.get("Date") == b"Mon, 10 Jul 2023 21:57:03 GMT"
+
+    def test_does_not_store_blocked_pages(
+        self, middleware, blocked_response, spider_mock
+    ):
+        request = Request("https://disboard.org/servers?fl=de")
+        self._solve(middleware, request, blocked_response, spider_mock)
+
+        assert middleware.process_request(request, spider_mock) is None
+
+    def test_expired_pages(self, middleware, sample_response, spider_mock):
+        middleware.ttl = 60
+        request = Request("https://disboard.org/servers?fl=de")
+        self._solve(middleware, request, sample_response, spider_mock)
+        path = middleware._path(request)
+        os.utime(path, (time.time(), time.time() - 120))
+
+        assert middleware.process_request(request, spider_mock) is None
+
+        middleware.replay = True
+        assert middleware.process_request(request, spider_mock) is not None
+
+    def test_replay_ignores_missing_pages(self, middleware, spider_mock):
+        middleware.replay = True
+        with pytest.raises(IgnoreRequest):
+            middleware.process_request(Request("https://disboard.org/"), spider_mock)
+
+    def test_evicts_least_recently_used_pages(
+        self, middleware, sample_response, spider_mock
+    ):
+        requests = [Request(f"https://disboard.org/servers/{i}") for i in range(3)]
+        for i, request in enumerate(requests):
+            self._solve(middleware, request, sample_response, spider_mock)
+            os.utime(middleware._path(request), (i, i))
+        page_size = os.path.getsize(middleware._path(requests[0]))
+
+        middleware.max_size = int(2.5 * page_size)
+        request = Request("https://disboard.org/new")
+        self._solve(middleware, request, sample_response, spider_mock)
+
+        assert not os.path.exists(middleware._path(requests[0]))
+        assert not os.path.exists(middleware._path(requests[1]))
+        assert os.path.exists(middleware._path(requests[2]))
+        assert middleware.stats.get_value("flaresolverr_cache/evicted") == 2
+
+
+class TestItemBatchMiddleware:
+    class BatchPipeline:
+        def __init__(self):
+            self.batches = []
+
+        def process_items(self, items, spider):
+            self.batches.append(items)
+
+    @pytest.fixture
+    def pipeline(self):
+        return self.BatchPipeline()
+
+    @pytest.fixture
+    def middleware(self, pipeline):
+        crawler = get_crawler()
+        itemproc = SimpleNamespace(middlewares=[object(), pipeline])
+        crawler.engine = SimpleNamespace(scraper=SimpleNamespace(itemproc=itemproc))
+        return ItemBatchMiddleware(crawler)
+
+    def test_batches_the_items_of_a_response(
+        self, middleware, pipeline, sample_response, spider_mock
+    ):
+        items = list(extract_disboard_server_items(sample_response))
+        request = Request("https://disboard.org/servers/2?fl=de")
+        result = iter(items + [request])
+
+        output = list(
+            middleware.process_spider_output(sample_response, result, spider_mock)
+        )
+
+        assert output == items + [request]
+        assert pipeline.batches == [items]
+
+    def test_skips_responses_without_items(
+        self, middleware, pipeline, sample_response, spider_mock
+    ):
+        request = Request("https://disboard.org/servers/2?fl=de")
+        output = list(
+            middleware.process_spider_output(sample_response, [request], spider_mock)
+        )
+
+        assert output == [request]
+        assert pipeline.batches == []
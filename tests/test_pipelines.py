@@ -0,0 +1,161 @@
+import dataclasses
+import time
+import pytest
+from disboard.changes import item_digest
+from disboard.commons.helpers import extract_disboard_server_items
+from disboard.metrics import LATENCY, REDIS
+from disboard.pipelines import PostgresPipeline, ServersGuildIdPipeline
+from disboard.recent import RecentWrites
+from scrapy.statscollectors import StatsCollector
+from scrapy.utils.test import get_crawler
+
+
+class TestServersGuildIdPipeline:
+    @pytest.fixture
+    def pipeline(self, redis_client, spider_mock):
+        pipeline = ServersGuildIdPipeline(
+            spider_name="test",
+            redis_url="redis://localhost:6379/15",
+            stats=StatsCollector(get_crawler()),
+        )
+        pipeline.open_spider(spider_mock)
+        yield pipeline
+        pipeline.close_spider(spider_mock)
+
+    def _redis_calls(self):
+        histogram = LATENCY.histograms.get(REDIS)
+        return histogram.count if histogram else 0
+
+    def test_process_item(self, pipeline, redis_client, sample_response, spider_mock):
+        items = list(extract_disboard_server_items(sample_response))
+        redis_client.sadd("test:guild_id", items[0]["guild_id"])
+        for item in items:
+            pipeline.process_item(item, spider_mock)
+
+        assert pipeline.stats.get_value("item_scraped_count/new") == 21
+        assert pipeline.stats.get_value("item_scraped_count/old") == 1
+        assert redis_client.scard("test:guild_id") == 22
+
+    def test_process_items_in_one_round_trip(
+        self, pipeline, redis_client, sample_response, spider_mock, monkeypatch
+    ):
+        monkeypatch.setattr(LATENCY, "enabled", True)
+        items = list(extract_disboard_server_items(sample_response))
+        redis_client.sadd("test:guild_id", items[0]["guild_id"])
+
+        redis_calls = self._redis_calls()
+        pipeline.process_items(items, spider_mock)
+        for item in items:
+            pipeline.process_item(item, spider_mock)
+
+        assert self._redis_calls() - redis_calls == 1
+        assert pipeline.stats.get_value("item_scraped_count/new") == 21
+        assert pipeline.stats.get_value("item_scraped_count/old") == 1
+        assert pipeline.batched == {}
+
+    def test_same_guild_in_two_batches(self, pipeline, sample_response, spider_mock):
+        items = list(extract_disboard_server_items(sample_response))[:1]
+        pipeline.process_items(items, spider_mock)
+        pipeline.process_items(items, spider_mock)
+        pipeline.process_item(items[0], spider_mock)
+        pipeline.process_item(items[0], spider_mock)
+
+        assert pipeline.stats.get_value("item_scraped_count/new") == 1
+        assert pipeline.stats.get_value("item_scraped_count/old") == 1
+
+
+class CursorStub:
+    def __init__(self):
+        self.guild_ids = []
+
+    def execute(self, sql, data):
+        self.guild_ids.append(data[2])
+
+
+class TestPostgresPipelineRecentWrites:
+    @pytest.fixture
+    def pipeline(self, redis_client, spider_mock):
+        pipeline = PostgresPipeline(
+            db_url=None,
+            spider_name="test",
+            stats=StatsCollector(get_crawler()),
+            recent_write_window=60,
+        )
+        pipeline.cursor = CursorStub()
+        pipeline.recent = RecentWrites(redis_client, "test", window=60)
+        return pipeline
+
+    @pytest.fixture
+    def items(self, sample_response):
+        return list(extract_disboard_server_items(sample_response))
+
+    def _process_page(self, pipeline, items, spider):
+        pipeline.process_items(items, spider)
+        for item in items:
+            pipeline.process_item(item, spider)
+
+    def test_skips_recently_written_guilds(self, pipeline, items, spider_mock):
+        self._process_page(pipeline, items, spider_mock)
+        self._process_page(pipeline, items, spider_mock)
+
+        assert len(pipeline.cursor.guild_ids) == len(items)
+        assert pipeline.stats.get_value("recent_writes/misses") == len(items)
+        assert pipeline.stats.get_value("recent_writes/hits") == len(items)
+
+    def test_writes_changed_guilds(self, pipeline, items, spider_mock):
+        self._process_page(pipeline, items, spider_mock)
+        changed = dataclasses.replace(items[0], server_name="Renamed")
+        pipeline.process_item(changed, spider_mock)
+
+        assert pipeline.cursor.guild_ids[-1] == items[0].guild_id
+        assert pipeline.stats.get_value("recent_writes/misses") == len(items) + 1
+
+    def test_window_is_shared_by_workers(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        self._process_page(pipeline, items, spider_mock)
+        assert redis_client.ttl(f"test:recent:{items[0].guild_id}") > 0
+
+        other_worker = RecentWrites(redis_client, "test", window=60)
+        other_worker.load([items[0].guild_id])
+        assert other_worker.is_recent(items[0].guild_id, item_digest(items[0]))
+
+    def test_expired_writes(self, pipeline, items, spider_mock):
+        self._process_page(pipeline, items[:1], spider_mock)
+        pipeline.recent.window = 0.01
+        time.sleep(0.02)
+        pipeline.process_item(items[0], spider_mock)
+
+        assert len(pipeline.cursor.guild_ids) == 2
+
+    def test_a_lost_item_does_not_stop_the_flushes(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        pipeline.process_items(items[:5], spider_mock)
+        # The last item of the first batch never reaches the pipeline
+        for item in items[:4]:
+            pipeline.process_item(item, spider_mock)
+        self._process_page(pipeline, items[5:10], spider_mock)
+
+        assert redis_client.exists(f"test:recent:{items[0].guild_id}")
+        assert pipeline.recent.pending == {}
+
+    def test_gives_up_on_a_batch_after_the_timeout(
+        self, pipeline, redis_client, items, spider_mock
+    ):
+        pipeline.batches.timeout = 0.01
+        pipeline.process_items(items[:2], spider_mock)
+        time.sleep(0.02)
+        pipeline.process_item(items[0], spider_mock)
+
+        assert redis_client.exists(f"test:recent:{items[0].guild_id}")
+        assert len(pipeline.batches) == 0
+
+
+class TestRecentWrites:
+    def test_bounded_cache(self, redis_client):
+        recent = RecentWrites(redis_client, "test", window=60, max_size=2)
+        for guild_id in ["1", "2", "3"]:
+            recent.record(guild_id, "digest")
+
+        assert list(recent.cache) == ["2", "3"]
@@ -0,0 +1,296 @@
+import pytest
+from disboard.commons.helpers import get_url_language
+from disboard.middlewares import FlareSolverrRedirectMiddleware
+from disboard.queues import LanguageFairQueue, LeasedPriorityQueue, pending_requests
+from scrapy.http import Request
+from scrapy.settings import Settings
+
+
+class TestLeasedPriorityQueue:
+    @pytest.fixture
+    def queue(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        return LeasedPriorityQueue(
+            redis_client, spider_mock, "%(spider)s:requests", worker_id="worker-1"
+        )
+
+    def test_pop_leases_request(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers", priority=10))
+        queue.push(Request("https://disboard.org/servers/2", priority=50))
+
+        request = queue.pop()
+
+        assert request.url == "https://disboard.org/servers/2"
+        assert request.meta["lease_id"] in queue.leased
+        assert len(queue) == 1
+        assert redis_client.hlen("test:processing:worker-1") == 1
+
+    def test_ack_removes_request_from_processing(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers"))
+        request = queue.pop()
+
+        queue.ack(request.meta["lease_id"])
+
+        assert queue.leased == {}
+        assert redis_client.hlen("test:processing:worker-1") == 0
+
+    def test_reap_requeues_expired_leases(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers", priority=72))
+        queue.pop()
+        assert len(queue) == 0
+
+        # Simulate a worker that stopped sending heartbeats
+        redis_client.zadd("test:leases", {"worker-1": 0})
+
+        assert queue.reap() == 1
+        assert redis_client.zrange("test:requests", 0, -1, withscores=True)[0][1] == -72
+        assert not redis_client.exists("test:processing:worker-1")
+
+    def test_reap_keeps_live_leases(self, queue):
+        queue.push(Request("https://disboard.org/servers"))
+        queue.pop()
+        queue.heartbeat()
+
+        assert queue.reap() == 0
+        assert len(queue) == 0
+
+    def test_release_requeues_own_leases(self, queue):
+        queue.push(Request("https://disboard.org/servers"))
+        queue.push(Request("https://disboard.org/servers/2"))
+        queue.pop()
+        queue.pop()
+
+        assert queue.release() == 2
+        assert len(queue) == 2
+        assert queue.leased == {}
+
+    def test_pop_batch_leases_requests_by_priority(self, queue, redis_client):
+        for i in range(5):
+            queue.push(Request(f"https://disboard.org/servers/{i}", priority=i))
+
+        requests = queue.pop_batch(3)
+
+        assert [request.priority for request in requests] == [4, 3, 2]
+        assert len(queue.leased) == 3
+        assert len(queue) == 2
+        assert redis_client.hlen("test:processing:worker-1") == 3
+        assert len(queue.pop_batch(3)) == 2
+        assert queue.pop_batch(3) == []
+
+    def test_unlease_requeues_with_original_priority(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers", priority=72))
+        queue.push(Request("https://disboard.org/servers/2", priority=10))
+        first, second = queue.pop_batch(2)
+
+        assert queue.unlease([second.meta["lease_id"], "unknown"]) == 1
+        assert redis_client.zrange("test:requests", 0, -1, withscores=True)[0][1] == -10
+        assert list(queue.leased) == [first.meta["lease_id"]]
+        assert redis_client.hlen("test:processing:worker-1") == 1
+
+
+class TestLanguageFairQueue:
+    @pytest.fixture
+    def spider(self, spider_mock):
+        spider_mock.name = "test"
+        spider_mock.settings = Settings(
+            {
+                "LANGUAGES": "en,de,fr",
+                "LANGUAGE_WEIGHTS": '{"en": 2}',
+                "LANGUAGE_QUOTAS": '{"fr": 1}',
+            }
+        )
+        return spider_mock
+
+    @pytest.fixture
+    def queue(self, redis_client, spider):
+        return LanguageFairQueue(
+            redis_client, spider, "%(spider)s:requests", worker_id="worker-1"
+        )
+
+    def test_push_routes_requests_by_language(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers?fl=de"))
+        queue.push(Request("https://disboard.org/servers/tag/chill?fl=en"))
+        queue.push(Request("https://disboard.org/servers", meta={"language": "fr"}))
+
+        assert len(queue) == 3
+        assert redis_client.zcard("test:requests:de") == 1
+        assert redis_client.zcard("test:requests:fr") == 1
+
+    def test_pop_is_weighted_and_fair(self, queue):
+        for i in range(6):
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=en"))
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=de"))
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=fr"))
+
+        languages = [get_url_language(queue.pop().url) for _ in range(10)]
+
+        assert languages[:3] == ["en", "de", "fr"]
+        assert languages.count("en") == 6
+        assert languages.count("de") == 3
+        # The quota of fr is exhausted after the first request
+        assert languages.count("fr") == 1
+        assert queue.progress()["fr"] == {"queued": 5, "served": 1, "quota": 1}
+
+    def test_pop_batch_is_weighted_and_fair(self, queue):
+        for i in range(6):
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=en"))
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=de"))
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=fr"))
+
+        languages = [get_url_language(request.url) for request in queue.pop_batch(3)]
+        languages += [get_url_language(request.url) for request in queue.pop_batch(7)]
+
+        assert languages[:3] == ["en", "de", "fr"]
+        assert languages.count("en") == 6
+        assert languages.count("de") == 3
+        # Only de is left below its quota
+        assert len(queue.pop_batch(10)) == 3
+        assert queue.progress()["fr"]["served"] == 1
+
+    def test_languages_over_quota_are_not_pending(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers?fl=fr"))
+        queue.push(Request("https://disboard.org/servers/2?fl=fr"))
+        queue.push(Request("https://disboard.org/servers?fl=de"))
+        assert len(queue) == 3
+        assert pending_requests(redis_client, "test", queue.quotas) == 3
+
+        languages = [get_url_language(request.url) for request in queue.pop_batch(2)]
+        assert sorted(languages) == ["de", "fr"]
+
+        # The second fr request is never popped: the job is done
+        assert queue.open_languages() == ["en", "de"]
+        assert len(queue) == 0
+        assert pending_requests(redis_client, "test", queue.quotas) == 0
+        assert pending_requests(redis_client, "test") == 1
+        assert pending_requests(redis_client, "test", queue.quotas, leased=True) == 2
+
+    def test_follow_ups_are_popped_beyond_the_quota(self, queue, redis_client, spider):
+        queue.push(Request("https://disboard.org/servers?fl=fr"))
+        queue.push(Request("https://disboard.org/servers/2?fl=fr"))
+        request = queue.pop()
+        assert request.url == "https://disboard.org/servers?fl=fr"
+
+        # The request to FlareSolverr is pushed back into the queue
+        middleware = FlareSolverrRedirectMiddleware(
+            Settings({"PROXY_URL": "http://localhost:8191/v1"})
+        )
+        queue.push(middleware.process_request(request, spider))
+        assert redis_client.zcard("test:requests:fr:follow_up") == 1
+        assert len(queue) == 1
+
+        proxy_request = queue.pop()
+        assert proxy_request.meta["original_request"].url == request.url
+        assert queue.progress()["fr"]["served"] == 1
+        assert queue.pop() is None
+        assert pending_requests(redis_client, "test", queue.quotas) == 0
+
+    def test_reap_requeues_to_language_sub_queue(self, queue, redis_client):
+        queue.push(Request("https://disboard.org/servers?fl=de"))
+        queue.pop()
+        redis_client.zadd("test:leases", {"worker-1": 0})
+
+        assert queue.reap() == 1
+        assert redis_client.zcard("test:requests:de") == 1
+
+
+class TestTieredFrontier:
+    @pytest.fixture
+    def queue(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        spider_mock.settings = Settings(
+            {"FRONTIER_HOT_SIZE": 10, "FRONTIER_CHUNK_SIZE": 4}
+        )
+        return LeasedPriorityQueue(
+            redis_client, spider_mock, "%(spider)s:requests", worker_id="worker-1"
+        )
+
+    def _push(self, queue, priorities):
+        for priority in priorities:
+            queue.push(
+                Request(f"https://disboard.org/servers/{priority}", priority=priority)
+            )
+
+    def test_spills_low_priority_requests(self, queue, redis_client):
+        self._push(queue, range(30))
+
+        assert queue.rebalance() == 0
+        assert redis_client.zcard("test:requests") == 10
+        assert redis_client.zcard("test:frontier:cold") == 5
+        assert redis_client.hget("test:frontier:counts", "test:frontier:cold") == b"20"
+        assert len(queue) == 30
+        # The hot set keeps the highest priorities
+        assert queue.pop().priority == 29
+
+    def test_refills_in_priority_order(self, queue, redis_client):
+        self._push(queue, range(30))
+        queue.rebalance()
+
+        priorities = [queue.pop().priority for _ in range(30)]
+
+        assert priorities == list(range(29, -1, -1))
+        assert queue.pop() is None
+        assert len(queue) == 0
+        assert redis_client.hget("test:frontier:counts", "test:frontier:cold") == b"0"
+
+    def test_spilled_requests_survive_a_crash(self, queue, redis_client):
+        self._push(queue, range(30))
+        queue.compressor = None
+
+        # The worker dies after the requests left the hot set, before their
+        # chunks were stored
+        with pytest.raises(AttributeError):
+            queue.rebalance()
+        assert redis_client.zcard("test:requests") == 10
+        assert redis_client.hlen("test:frontier:staging:worker-1") == 20
+        assert pending_requests(redis_client, "test", leased=True) == 30
+
+        redis_client.zadd("test:leases", {"worker-1": 0})
+        assert queue.reap() == 20
+        assert redis_client.zcard("test:requests") == 30
+        assert not redis_client.exists("test:frontier:staging:worker-1")
+
+    def test_spill_clears_the_staged_requests(self, queue, redis_client):
+        self._push(queue, range(30))
+        queue.rebalance()
+
+        assert not redis_client.exists("test:frontier:staging:worker-1")
+        assert pending_requests(redis_client, "test", leased=True) == 30
+
+    def test_refilled_chunks_survive_a_crash(self, queue, redis_client):
+        self._push(queue, range(30))
+        queue.rebalance()
+        for _ in range(10):
+            queue.pop()
+        queue.decompressor = None
+
+        with pytest.raises(AttributeError):
+            queue.rebalance()
+        assert redis_client.zcard("test:frontier:cold") == 5
+        assert redis_client.hget("test:frontier:counts", "test:frontier:cold") == b"20"
+
+    def test_clear_removes_the_cold_tier(self, queue, redis_client):
+        self._push(queue, range(30))
+        queue.rebalance()
+        queue.clear()
+
+        assert len(queue) == 0
+        assert not redis_client.exists("test:frontier:cold")
+
+    def test_language_sub_queues_have_their_own_tier(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        spider_mock.settings = Settings(
+            {"LANGUAGES": "en,de", "FRONTIER_HOT_SIZE": 2, "FRONTIER_CHUNK_SIZE": 2}
+        )
+        queue = LanguageFairQueue(
+            redis_client, spider_mock, "%(spider)s:requests", worker_id="worker-1"
+        )
+        for i in range(5):
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=en"))
+            queue.push(Request(f"https://disboard.org/servers/{i}?fl=de"))
+        queue.rebalance()
+
+        assert redis_client.zcard("test:requests:en") == 2
+        assert redis_client.zcard("test:frontier:cold:en") == 2
+        assert len(queue) == 10
+        popped = [queue.pop() for _ in range(10)]
+        assert all(popped) and queue.pop() is None
@@ -0,0 +1,85 @@
+import time
+import pytest
+from disboard.dupefilters import request_fingerprint
+from disboard.queues import LanguageFairQueue, LeasedPriorityQueue
+from disboard.registry import (
+    CATEGORY_PRIORITY,
+    TAG_PRIORITY,
+    load_frontier,
+    read_registry,
+    seed_requests,
+)
+from scrapy.settings import Settings
+
+
+@pytest.fixture
+def spider(spider_mock):
+    spider_mock.name = "test"
+    return spider_mock
+
+
+def test_read_registry(redis_client, spider):
+    redis_client.sadd("test:registry:categories", "gaming", "anime-manga")
+    redis_client.hset("test:registry:tags", mapping={"6": "community", "39": "anime"})
+
+    categories, tags = read_registry(redis_client, "test")
+
+    assert categories == {"gaming", "anime-manga"}
+    assert tags == {"6": "community", "39": "anime"}
+
+
+def test_seed_requests(spider):
+    requests = seed_requests(spider, ["de", "en"], {"gaming"}, ["anime"])
+
+    assert [request.url for request in requests] == [
+        "https://disboard.org/servers/category/gaming?fl=de",
+        "https://disboard.org/servers/category/gaming?fl=de&sort=-member_count",
+        "https://disboard.org/servers/tag/anime?fl=de",
+        "https://disboard.org/servers/tag/anime?fl=de&sort=-member_count",
+        "https://disboard.org/servers/category/gaming?fl=en",
+        "https://disboard.org/servers/category/gaming?fl=en&sort=-member_count",
+        "https://disboard.org/servers/tag/anime?fl=en",
+        "https://disboard.org/servers/tag/anime?fl=en&sort=-member_count",
+    ]
+    assert [request.priority for request in requests[:4]] == [
+        CATEGORY_PRIORITY,
+        CATEGORY_PRIORITY,
+        TAG_PRIORITY,
+        TAG_PRIORITY,
+    ]
+    assert requests[4].meta == {"language": "en", "origin": "registry"}
+
+
+class TestLoadFrontier:
+    def _load(self, redis_client, queue, requests, **kwargs):
+        return load_frontier(
+            redis_client,
+            queue,
+            dupefilter_key="test:dupefilter",
+            negative_key="test:negative",
+            requests=requests,
+            **kwargs,
+        )
+
+    def test_pushes_unseen_requests(self, redis_client, spider):
+        queue = LeasedPriorityQueue(redis_client, spider, "%(spider)s:requests")
+        requests = seed_requests(spider, ["de"], {"gaming", "music"}, ["anime"])
+        redis_client.sadd("test:dupefilter", request_fingerprint(requests[0]))
+        redis_client.zadd(
+            "test:negative", {request_fingerprint(requests[1]): time.time() + 60}
+        )
+
+        assert self._load(redis_client, queue, requests, chunk_size=2) == 4
+        assert len(queue) == 4
+        assert redis_client.scard("test:dupefilter") == 5
+        assert queue.pop().priority == CATEGORY_PRIORITY
+        assert self._load(redis_client, queue, requests) == 0
+
+    def test_pushes_to_the_language_sub_queues(self, redis_client, spider):
+        spider.settings = Settings({"LANGUAGES": "en,de"})
+        queue = LanguageFairQueue(redis_client, spider, "%(spider)s:requests")
+        requests = seed_requests(spider, ["en", "de"], {"gaming"}, ["anime"])
+
+        assert self._load(redis_client, queue, requests) == 8
+        assert redis_client.zcard("test:requests:en") == 4
+        assert redis_client.zcard("test:requests:de") == 4
@@ -0,0 +1,190 @@
+import time
+import pytest
+from collections import deque
+from types import SimpleNamespace
+from disboard.queues import LeasedPriorityQueue
+from disboard.scheduler import LeasingScheduler
+from scrapy.http import Request
+from scrapy.utils.test import get_crawler
+
+
+class TestLeasingSchedulerWindow:
+    @pytest.fixture
+    def scheduler(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        crawler = get_crawler(
+            settings_dict={
+                "REDIS_URL": "redis://localhost:6379/15",
+                "DUPEFILTER_CLASS": "scrapy_redis.dupefilter.RFPDupeFilter",
+                "WINDOW_DEFAULT_SOLVE_TIME": 30,
+            }
+        )
+        scheduler = LeasingScheduler.from_crawler(crawler)
+        scheduler.spider = spider_mock
+        scheduler.queue = LeasedPriorityQueue(
+            redis_client, spider_mock, "%(spider)s:requests", worker_id="worker-1"
+        )
+        return scheduler
+
+    def _start_window(self, redis_client, duration):
+        redis_client.set("test:window", time.time() + duration)
+
+    def test_pops_without_window(self, scheduler):
+        url = "https://disboard.org/servers/tag/chill"
+        scheduler.queue.push(Request(url, priority=1))
+        assert scheduler.window_remaining() is None
+        assert scheduler.next_request().url == url
+
+    def test_starts_nothing_that_cannot_finish(self, scheduler, redis_client):
+        self._start_window(redis_client, 20)
+        scheduler.queue.push(Request("https://disboard.org/servers", priority=100))
+
+        assert scheduler.next_request() is None
+        assert len(scheduler.queue) == 1
+        assert scheduler.stats.get_value("window/idle_polls") == 1
+
+    def test_solve_time_follows_the_proxy(self, scheduler):
+        scheduler.solve_times.extend([10.0] * 9 + [100.0])
+        assert scheduler.solve_time() == 100.0
+        scheduler.solve_times.extend([10.0] * 10)
+        assert scheduler.solve_time() == 10.0
+
+    def test_endgame_favours_short_high_yield_work(self, scheduler, redis_client):
+        self._start_window(redis_client, 100)
+        scheduler.queue.push(
+            Request("https://disboard.org/servers/tag/chill/12?fl=de", priority=80)
+        )
+        scheduler.queue.push(
+            Request("https://disboard.org/servers/category/gaming?fl=de", priority=60)
+        )
+        scheduler.queue.push(
+            Request("https://disboard.org/servers/tag/chill?fl=de", priority=5)
+        )
+
+        request = scheduler.next_request()
+        assert request.url == "https://disboard.org/servers/category/gaming?fl=de"
+        assert scheduler.next_request() is None
+
+        assert len(scheduler.queue) == 0
+        assert len(scheduler.deferred) == 2
+        assert redis_client.hlen("test:processing:worker-1") == 3
+        assert scheduler.stats.get_value("window/deferred") == 2
+
+    def test_endgame_looks_past_the_skipped_requests(self, scheduler, redis_client):
+        self._start_window(redis_client, 100)
+        for page in range(11, 17):
+            scheduler.queue.push(
+                Request(f"https://disboard.org/servers/tag/chill/{page}", priority=74)
+            )
+        scheduler.queue.push(
+            Request("https://disboard.org/servers/category/gaming?fl=de", priority=60)
+        )
+
+        assert scheduler.endgame_max_skips < 6
+        requests = [scheduler.next_request() for _ in range(3)]
+
+        assert requests[0] is None
+        assert requests[1].url == "https://disboard.org/servers/category/gaming?fl=de"
+        assert requests[2] is None
+        assert scheduler.stats.get_value("window/deferred") == 6
+
+    def test_endgame_reads_the_page_of_proxy_requests(self, scheduler, redis_client):
+        self._start_window(redis_client, 100)
+        deep = Request("https://disboard.org/servers/25", priority=80)
+        scheduler.queue.push(
+            Request(
+                "http://localhost:8191/v1",
+                method="POST",
+                priority=80,
+                meta={"original_request": deep, "redirected_to_flare_solverr": True},
+            )
+        )
+
+        assert scheduler.next_request() is None
+        assert len(scheduler.deferred) == 1
+
+    def test_endgame_puts_the_skipped_requests_back(self, scheduler, redis_client):
+        self._start_window(redis_client, 100)
+        url = "https://disboard.org/servers/tag/chill/12?fl=de"
+        scheduler.queue.push(Request(url, priority=80))
+        assert scheduler.next_request() is None
+        assert len(scheduler) == 1
+
+        # The window is over, and the skipped request can be started again
+        redis_client.delete("test:window")
+        scheduler.window_read_at = 0
+        assert scheduler.next_request().url == url
+        assert scheduler.deferred == []
+
+    def test_accounts_window_time(self, scheduler, redis_client):
+        self._start_window(redis_client, 100)
+        scheduler.window_remaining()
+        now = time.time()
+
+        solved = Request("https://localhost:8191/v1", meta={"window_started": now - 10})
+        solved.meta["download_latency"] = 10
+        scheduler.request_left_downloader(solved, scheduler.spider)
+        failed = Request("https://localhost:8191/v1", meta={"window_started": now - 5})
+        scheduler.request_left_downloader(failed, scheduler.spider)
+
+        completed = scheduler.stats.get_value("window/solve_time/completed")
+        wasted = scheduler.stats.get_value("window/solve_time/wasted")
+        assert completed == pytest.approx(10, abs=1)
+        assert wasted == pytest.approx(5, abs=1)
+        assert len(scheduler.solve_times) == 1
+
+
+class TestLeasingSchedulerPrefetch:
+    @pytest.fixture
+    def scheduler(self, redis_client, spider_mock):
+        spider_mock.name = "test"
+        crawler = get_crawler(
+            settings_dict={
+                "REDIS_URL": "redis://localhost:6379/15",
+                "DUPEFILTER_CLASS": "scrapy_redis.dupefilter.RFPDupeFilter",
+                "SCHEDULER_PREFETCH_MAX": 3,
+            }
+        )
+        crawler.engine = SimpleNamespace(
+            downloader=SimpleNamespace(total_concurrency=16)
+        )
+        scheduler = LeasingScheduler.from_crawler(crawler)
+        scheduler.spider = spider_mock
+        scheduler.queue = LeasedPriorityQueue(
+            redis_client, spider_mock, "%(spider)s:requests", worker_id="worker-1"
+        )
+        for i in range(5):
+            scheduler.queue.push(
+                Request(f"https://disboard.org/servers/{i}", priority=i)
+            )
+        return scheduler
+
+    def test_pops_batches_into_the_buffer(self, scheduler, redis_client):
+        assert scheduler.prefetch_size() == 3
+        priorities = [scheduler.next_request().priority for _ in range(4)]
+
+        assert priorities == [4, 3, 2, 1]
+        assert len(scheduler.prefetched) == 1
+        assert len(scheduler) == 1
+        assert redis_client.hlen("test:processing:worker-1") == 5
+        assert scheduler.stats.get_value("scheduler/prefetch/batches") == 2
+        assert scheduler.stats.get_value("scheduler/dequeued/redis") == 4
+
+    def test_returns_the_buffer_to_the_queue(self, scheduler, redis_client):
+        started = scheduler.next_request()
+
+        assert scheduler.release_prefetched() == 2
+        assert scheduler.prefetched == deque()
+        assert len(scheduler.queue) == 4
+        assert redis_client.hkeys("test:processing:worker-1") == [
+            scheduler.queue.leased[started.meta["lease_id"]]
+        ]
+
+    def test_returns_the_buffer_when_the_window_ends(self, scheduler, redis_client):
+        scheduler.next_request()
+        redis_client.set("test:window", time.time() + 20)
+        scheduler.window_read_at = 0
+
+        assert scheduler.next_request() is None
+        assert len(scheduler.queue) == 4
+        assert len(scheduler) == 4
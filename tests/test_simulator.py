@@ -0,0 +1,72 @@
+import pytest
+import requests
+from disboard.commons.helpers import (
+    blocked_by_cloudflare,
+    count_disboard_server_items,
+    extract_disboard_server_items,
+    has_pagination_links,
+)
+from disboard.simulator import DisboardSimulator, FlareSolverrSimulator
+from scrapy.http import HtmlResponse
+
+
+def to_response(url, html):
+    return HtmlResponse(
+        url=url,
+        headers={"Date": b"Mon, 10 Jul 2023 21:57:03 GMT"},
+        body=html,
+        encoding="utf-8",
+    )
+
+
+class TestDisboardSimulator:
+    @pytest.fixture
+    def simulator(self):
+        return DisboardSimulator(n_of_pages=3, n_of_tags=10)
+
+    def test_listing_is_parsed_like_disboard(self, simulator):
+        url = "https://disboard.org/servers/tag/tag-3/2?fl=de"
+        status, html = simulator.page(url)
+        response = to_response(url, html)
+
+        assert status == 200
+        assert count_disboard_server_items(response) == 24
+        assert has_pagination_links(response)
+        items = list(extract_disboard_server_items(response))
+        assert any(("3", "tag-3") in item["tags"] for item in items)
+
+    def test_pages_are_deterministic(self, simulator):
+        url = "https://disboard.org/servers/category/music?fl=de"
+        assert simulator.page(url) == simulator.page(url)
+
+    def test_last_page(self, simulator):
+        _, html = simulator.page("https://disboard.org/servers/3?fl=de")
+        assert not has_pagination_links(to_response("https://disboard.org/", html))
+
+        status, _ = simulator.page("https://disboard.org/servers/4?fl=de")
+        assert status == 404
+
+    def test_blocked_pages(self):
+        simulator = DisboardSimulator(block_rate=1.0)
+        status, html = simulator.page("https://disboard.org/servers")
+
+        assert status == 200
+        assert blocked_by_cloudflare(to_response("https://disboard.org/servers", html))
+
+
+def test_flaresolverr_simulator():
+    proxy = FlareSolverrSimulator(("127.0.0.1", 0), DisboardSimulator())
+    proxy.start()
+    try:
+        assert requests.get(f"{proxy.url}/health", timeout=5).status_code == 200
+
+        response = requests.post(
+            f"{proxy.url}/v1",
+            json={"cmd": "request.get", "url": "https://disboard.org/servers?fl=de"},
+            timeout=5,
+        )
+        solution = response.json()["solution"]
+        assert solution["status"] == 200
+        assert "server-name" in solution["response"]
+    finally:
+        proxy.stop()
@@ -0,0 +1,63 @@
+import json
+import multiprocessing
+import pytest
+import time
+from disboard.workers import Supervisor, WorkerPool
+
+
+class TestSupervisor:
+    @pytest.fixture
+    def supervisor(self):
+        pool = WorkerPool(
+            redis_url="redis://localhost:6379/15",
+            spider_name="test",
+            proxy_urls=[f"http://localhost:{8191 + i}/v1" for i in range(4)],
+        )
+        return Supervisor(pool, min_workers=1, requests_per_worker=100)
+
+    @pytest.mark.parametrize(
+        "queue_depth,n_of_healthy_proxies,desired",
+        [(0, 4, 1), (150, 4, 2), (10000, 4, 4), (10000, 2, 2), (50, 0, 0)],
+    )
+    def test_desired_workers(
+        self, supervisor, queue_depth, n_of_healthy_proxies, desired
+    ):
+        assert supervisor.desired_workers(queue_depth, n_of_healthy_proxies) == desired
+
+    def test_queue_depth_counts_language_sub_queues(self, supervisor, redis_client):
+        redis_client.zadd("test:requests:en", {"a": 0, "b": 0})
+        redis_client.zadd("test:requests:fr", {"c": 0})
+        redis_client.hset("test:frontier:counts", "test:frontier:cold:en", 10)
+        assert supervisor.queue_depth(redis_client) == 13
+
+        supervisor.quotas = {"fr": 1}
+        redis_client.hset("test:languages:served", "fr", 1)
+        assert supervisor.queue_depth(redis_client) == 12
+
+    def test_throughput(self, supervisor, redis_client):
+        redis_client.hset("test:workers", "w", json.dumps({"time": 10, "pages": 5}))
+        assert supervisor.throughput(redis_client) == {}
+
+        redis_client.hset("test:workers", "w", json.dumps({"time": 20, "pages": 25}))
+        assert supervisor.throughput(redis_client) == {"w": 2.0}
+
+
+def sleep_forever():
+    time.sleep(60)
+
+
+def test_close_waits_for_the_workers_then_terminates(redis_client):
+    pool = WorkerPool(
+        redis_url="redis://localhost:6379/15",
+        spider_name="test",
+        proxy_urls=["http://localhost:8191/v1"],
+    )
+    (worker_id,) = pool.worker_proxies
+    process = multiprocessing.Process(target=sleep_forever)
+    process.start()
+    pool.processes[worker_id] = process
+
+    pool.close(timeout=0.5)
+
+    assert not process.is_alive()
+    assert redis_client.lrange(f"test:control:{worker_id}", 0, -1) == [b"stop"]